@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from database.models import CustomUser, Client, Carrier
+from project.cache import generation_key, increment
+
+USER_VERSION_KEY = 'auth_user_version_{}'
+USER_CACHE_KEY = 'auth_user_{}_{}_{}'
+
+# Пароль в кэш не попадает: в объекте пользователя он остается отложенным полем
+USER_FIELDS = [
+    field.attname for field in CustomUser._meta.concrete_fields if field.attname != 'password'
+]
+
+
+def invalidate_users(user_ids):
+    """
+    Сбрасывает закэшированные данные аутентификации пользователей.
+    """
+    for user_id in user_ids:
+        increment(USER_VERSION_KEY.format(user_id))
+
+
+def load_user_entry(user_id):
+    """
+    Данные для аутентификации из базы: поля пользователя, группы, id клиента и перевозчика.
+    """
+    columns = [*USER_FIELDS, 'client__id', 'carrier__id']
+    if api_settings.CHECK_REVOKE_TOKEN:
+        columns.append('password')
+    row = CustomUser.objects.filter(id=user_id).values(*columns).first()
+    if row is None:
+        return None
+
+    password = row.pop('password', None)
+    groups = sorted(Group.objects.filter(user__id=user_id).values_list('name', flat=True))
+    return {
+        'fields': [row[name] for name in USER_FIELDS],
+        'client_id': row['client__id'],
+        'carrier_id': row['carrier__id'],
+        'role': ','.join(groups) or 'user',
+        'password_hash': get_md5_hash_password(password) if password is not None else None,
+    }
+
+
+def build_user(entry):
+    """
+    Пользователь из кэша как загруженный из базы: незакэшированные поля
+    (пароль) отложены и дочитываются при обращении, save() их не перезапишет.
+    Клиент и перевозчик - объекты только с id, остальные поля так же отложены.
+    """
+    user = CustomUser.from_db('default', USER_FIELDS, entry['fields'])
+    user._cached_role = entry['role']
+
+    for model, related_id in ((Client, entry['client_id']), (Carrier, entry['carrier_id'])):
+        related = None
+        if related_id is not None:
+            related = model.from_db('default', ['id', 'user_id'], [related_id, user.id])
+            model.user.field.set_cached_value(related, user)
+        # None в кэше связи: hasattr(user, 'client') вернет False без запроса
+        model.user.field.remote_field.set_cached_value(user, related)
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT-аутентификация без запросов к базе на горячем пути.
+
+    Пользователь, его роль (группы) и id клиента/перевозчика хранятся в кэше
+    AUTH_USER_CACHE_TIMEOUT секунд. Ключ включает версию пользователя и
+    поколение групп: сигналы authentication увеличивают их при сохранении
+    CustomUser, Client, Carrier и изменении групп, и старая запись перестает читаться.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        version_key = USER_VERSION_KEY.format(user_id)
+        groups_key = generation_key(Group)
+        versions = cache.get_many([version_key, groups_key])
+        key = USER_CACHE_KEY.format(user_id, versions.get(version_key, 0), versions.get(groups_key, 0))
+
+        entry = cache.get(key)
+        if entry is None:
+            entry = load_user_entry(user_id)
+            if entry is None:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            cache.set(key, entry, timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+
+        user = build_user(entry)
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != entry['password_hash']:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.backends import CachedJWTAuthentication
+from authentication.views import ProtectedEndpoint
+from booking.views import BookingListClientApiView
+from database.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Запросов в секунду с JWT-аутентификацией из базы и из кэша'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **kwargs):
+        user = CustomUser.objects.filter(client__isnull=False, is_active=True).first()
+        if user is None:
+            raise CommandError('В базе нет клиентов, заполните ее командой generate_data.')
+        token = f'Bearer {AccessToken.for_user(user)}'
+
+        for title, view_class, params in (
+            ('только аутентификация', ProtectedEndpoint, {}),
+            ('брони клиента', BookingListClientApiView, {'page_size': 20}),
+        ):
+            for authentication in (JWTAuthentication, CachedJWTAuthentication):
+                view = view_class.as_view(authentication_classes=[authentication])
+                self.run(f'{title}, {authentication.__name__}', view, token, params, kwargs['requests'])
+
+    def run(self, title, view, token, params, requests):
+        factory = APIRequestFactory()
+        view(factory.get('/', params, HTTP_AUTHORIZATION=token)).render()  # прогрев кэша
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for _ in range(requests):
+                response = view(factory.get('/', params, HTTP_AUTHORIZATION=token))
+                response.render()
+            elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise CommandError(f"{title}: status {response.status_code}")
+
+        self.stdout.write(
+            f"{title:50} {requests / elapsed:7.0f} запросов/с, "
+            f"{len(queries.captured_queries) / requests:.1f} SQL на запрос"
+        )
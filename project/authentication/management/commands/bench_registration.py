@@ -0,0 +1,101 @@
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+
+from authentication.registration import register_users
+from authentication.views import CustomRegisterClientView
+from database.models import CustomUser, Client
+
+PASSWORD = 'Bench-registration-2024'
+
+
+class Command(BaseCommand):
+    help = 'Регистраций в секунду: через API по одной и пакетами, как import_employees'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--registrations', type=int, default=20, help="Регистраций через API")
+        parser.add_argument('--bulk', type=int, default=5000, help="Сотрудников в пакетной регистрации")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+
+    def handle(self, *args, **kwargs):
+        self.prefix = f'bench.{uuid.uuid4().hex[:8]}'
+        try:
+            self.bench_api(kwargs['registrations'])
+            self.bench_bulk(kwargs['bulk'], kwargs['batch_size'])
+            self.bench_hashing(kwargs['workers'], kwargs['bulk'])
+        finally:
+            deleted, _ = CustomUser.objects.filter(email__startswith=self.prefix).delete()
+            self.stdout.write(f"Удалено тестовых записей: {deleted}")
+
+    def report(self, title, count, elapsed, queries):
+        self.stdout.write(
+            f"  {title:40} {count / elapsed:8.1f} регистраций/с, {queries / count:.2f} SQL на регистрацию"
+        )
+
+    def bench_api(self, count):
+        view = CustomRegisterClientView.as_view()
+        factory = APIRequestFactory()
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for i in range(count):
+                response = view(factory.post('/', {
+                    'email': f'{self.prefix}.api{i}@example.com',
+                    'password1': PASSWORD,
+                    'password2': PASSWORD,
+                    'client_type': 'IND',
+                    'first_name': 'Иван',
+                    'last_name': 'Иванов',
+                    'surname': 'Иванович',
+                    'phone_number': '9000000000',
+                }, format='json'))
+                if response.status_code != 201:
+                    raise CommandError(f"registration: status {response.status_code} {response.data}")
+            elapsed = time.perf_counter() - started
+
+        # Большая часть времени - PBKDF2 пароля, его доля показана отдельно
+        started = time.perf_counter()
+        make_password(PASSWORD)
+        hashing = time.perf_counter() - started
+
+        self.stdout.write('Через API (проверка, хэш пароля, транзакция):')
+        self.report('по одной', count, elapsed, len(queries.captured_queries))
+        self.stdout.write(f"  из них хэширование пароля: {hashing * 1000:.0f} мс на регистрацию")
+
+    def bench_bulk(self, count, batch_size):
+        company = dict(legal_type='LLC', company_name='ООО Пример', inn='7700000000', kpp='770001001')
+        unusable = make_password(None)
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for offset in range(0, count, batch_size):
+                numbers = range(offset, min(offset + batch_size, count))
+                register_users(
+                    [CustomUser(email=f'{self.prefix}.bulk{i}@example.com', password=unusable, first_name='Иван',
+                                last_name='Иванов') for i in numbers],
+                    Client,
+                    [Client(client_type='LEG', **company) for _ in numbers],
+                    'client',
+                )
+            elapsed = time.perf_counter() - started
+
+        self.stdout.write(f'Пакетами по {batch_size} (import_employees, без паролей в CSV):')
+        self.report(f'{count} сотрудников', count, elapsed, len(queries.captured_queries))
+
+    def bench_hashing(self, workers, count):
+        passwords = [f'{PASSWORD}{i}' for i in range(max(workers * 2, 4))]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(make_password, passwords))
+        rate = len(passwords) / (time.perf_counter() - started)
+
+        self.stdout.write(f'Хэширование паролей из CSV, потоков {workers}:')
+        self.stdout.write(f"  {rate:8.1f} паролей/с, {count} сотрудников - {count / rate:.0f} с на хэширование")
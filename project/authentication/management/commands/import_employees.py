@@ -0,0 +1,154 @@
+import csv
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import IntegrityError
+from django.db.models.functions import Lower
+
+from authentication.registration import register_users
+from database.models import CustomUser, Client
+
+NAME_FIELDS = ('first_name', 'last_name', 'surname')
+# Реквизиты компании, которые копируются в профиль каждого сотрудника
+REQUISITES = (
+    'legal_type', 'company_name', 'inn', 'kpp', 'ogrn', 'current_account', 'corresp_account', 'bik', 'oktmo',
+    'legal_address',
+)
+
+
+class Command(BaseCommand):
+    help = 'Регистрация сотрудников клиента - юридического лица из CSV (email, ФИО, телефон, пароль)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file_path', type=str,
+                            help="CSV с заголовком email[,first_name,last_name,surname,phone_number,password]")
+        parser.add_argument('--client', type=int, required=True,
+                            help="id клиента - юридического лица, реквизиты которого получат сотрудники")
+        parser.add_argument('--verified', action='store_true', help="Считать адреса почты подтвержденными")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Потоков для хэширования паролей из CSV")
+        parser.add_argument('--delimiter', default=',')
+
+    def iter_rows(self, file, delimiter):
+        reader = csv.DictReader(file, delimiter=delimiter)
+        if not reader.fieldnames or 'email' not in reader.fieldnames:
+            raise CommandError("CSV header must contain email")
+
+        seen = set()
+        for row in reader:
+            email = CustomUser.objects.normalize_email((row.get('email') or '').strip())
+            names = {name: (row.get(name) or '').strip() for name in NAME_FIELDS}
+            try:
+                validate_email(email)
+                for name, value in names.items():
+                    if len(value) > CustomUser._meta.get_field(name).max_length:
+                        raise ValidationError(name)
+            except ValidationError:
+                self.stdout.write(self.style.WARNING(f"Пропуск строки {reader.line_num}: {row}"))
+                continue
+
+            if email.lower() in seen:
+                self.stdout.write(self.style.WARNING(f"Пропуск строки {reader.line_num}: повтор {email}"))
+                continue
+            seen.add(email.lower())
+            yield {
+                'line': reader.line_num,
+                'email': email,
+                'names': names,
+                'phone_number': (row.get('phone_number') or '').strip() or None,
+                'password': row.get('password') or None,
+            }
+
+    def taken_emails(self, batch):
+        return set(
+            CustomUser.objects.annotate(email_lower=Lower('email'))
+            .filter(email_lower__in=[row['email'].lower() for row in batch])
+            .values_list('email_lower', flat=True)
+        )
+
+    def register_batch(self, batch, company, pool, verified):
+        existing = self.taken_emails(batch)
+        batch = [row for row in batch if row['email'].lower() not in existing]
+        if not batch:
+            return 0, len(existing), 0
+
+        # PBKDF2 освобождает GIL, поэтому пароли хэшируются параллельно в потоках;
+        # без пароля в CSV сотрудник задает его через восстановление пароля
+        started = time.perf_counter()
+        pending = list(zip(batch, pool.map(make_password, [row['password'] for row in batch])))
+        hashing = time.perf_counter() - started
+
+        skipped = len(existing)
+        while pending:
+            users = [
+                CustomUser(email=row['email'], password=password_hash, is_active=True, **row['names'])
+                for row, password_hash in pending
+            ]
+            profiles = [
+                Client(client_type='LEG', phone_number=row['phone_number'], **company)
+                for row, _ in pending
+            ]
+            try:
+                register_users(users, Client, profiles, 'client', verified=verified)
+                break
+            except IntegrityError:
+                # Адрес занят параллельной регистрацией после проверки выше:
+                # такие строки пропускаются, остальные регистрируются повторно
+                taken = self.taken_emails([row for row, _ in pending])
+                if not taken:
+                    raise
+                for row, _ in pending:
+                    if row['email'].lower() in taken:
+                        self.stdout.write(self.style.WARNING(
+                            f"Пропуск строки {row['line']}: адрес {row['email']} уже занят"
+                        ))
+                pending = [(row, password_hash) for row, password_hash in pending
+                           if row['email'].lower() not in taken]
+                skipped += len(taken)
+        return len(pending), skipped, hashing
+
+    def load(self, rows, company, batch_size, workers, verified):
+        # Зарегистрировано, пропущено, секунд на хэширование
+        totals = [0, 0, 0.0]
+        batch = []
+        with ThreadPoolExecutor(workers) as pool:
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    result = self.register_batch(batch, company, pool, verified)
+                    totals = [total + value for total, value in zip(totals, result)]
+                    self.stdout.write(f"Зарегистрировано: {totals[0]}")
+                    batch = []
+            if batch:
+                result = self.register_batch(batch, company, pool, verified)
+                totals = [total + value for total, value in zip(totals, result)]
+        return totals
+
+    def handle(self, *args, **kwargs):
+        file_path = kwargs['file_path']
+        company = Client.objects.filter(id=kwargs['client'], client_type='LEG').values(*REQUISITES).first()
+        if company is None:
+            raise CommandError(f"Legal entity client {kwargs['client']} not found")
+
+        started = time.perf_counter()
+        try:
+            with open(file_path, 'r', encoding='utf-8', newline='') as file:
+                rows = self.iter_rows(file, kwargs['delimiter'])
+                created, skipped, hashing = self.load(
+                    rows, company, kwargs['batch_size'], kwargs['workers'], kwargs['verified']
+                )
+        except FileNotFoundError:
+            raise CommandError(f"Файл не найден: {file_path}")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Зарегистрировано сотрудников: {created}, пропущено (адрес уже занят) {skipped}. "
+            f"Время: {elapsed:.1f} с (хэширование паролей {hashing:.1f} с), "
+            f"{created / max(elapsed, 1e-9):.0f} регистраций в секунду."
+        ))
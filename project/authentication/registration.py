@@ -0,0 +1,136 @@
+from allauth.account import app_settings as allauth_account_settings
+from allauth.account.adapter import get_adapter
+from allauth.account.models import EmailAddress
+from allauth.account.utils import complete_signup
+from django.contrib.auth.models import Group
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+
+from database.models import CustomUser
+
+# id групп по имени, загружаются одним запросом при первом обращении в процессе
+_group_ids = {}
+
+
+def get_group_id(name):
+    """
+    id группы из кэша процесса. Группы создает create_roles и почти не меняет,
+    после изменения группы кэш процесса сбрасывает сигнал (reset_group_ids).
+    """
+    if name not in _group_ids:
+        _group_ids.update(Group.objects.values_list('name', 'id'))
+    try:
+        return _group_ids[name]
+    except KeyError:
+        raise Group.DoesNotExist(f"Group '{name}' does not exist, run create_roles")
+
+
+def reset_group_ids():
+    _group_ids.clear()
+
+
+def _reset_for_retry(instances):
+    # После отката транзакции объекты снова новые: повторный save() или bulk_create() вставит их заново
+    for instance in instances:
+        instance.pk = None
+        instance._state.adding = True
+
+
+def add_to_group(user_ids, group_name):
+    """
+    Добавляет пользователей в группу одним INSERT в промежуточную таблицу,
+    без чтения группы и уже существующих связей, как в groups.add().
+
+    m2m_changed при этом не отправляется: кэш аутентификации сбрасывают
+    сигналы сохранения профиля или вызывающий код.
+    """
+    through = CustomUser.groups.through
+    group_id = get_group_id(group_name)
+    through.objects.bulk_create(
+        [through(customuser_id=user_id, group_id=group_id) for user_id in user_ids],
+        ignore_conflicts=True,
+    )
+
+
+def register_user(request, serializer, profile_model, profile_fields, user_fields=None):
+    """
+    Регистрация через RegisterSerializer с профилем (Client или Carrier) в одной транзакции.
+
+    Как RegisterSerializer.save, но поля пользователя (ФИО) заполняются до
+    INSERT, а адрес почты создается сразу: новый пользователь не может иметь
+    других адресов. На регистрацию - INSERT пользователя, адреса, профиля и
+    членства в группе (сигнал post_save профиля). Адрес, занятый параллельной
+    регистрацией, возвращается как ошибка валидации, а не 500.
+
+    Внешние ключи проверяются при COMMIT, поэтому id группы, устаревший после ее
+    пересоздания в другом процессе, дает IntegrityError всей транзакции: тогда кэш
+    id групп перечитывается и регистрация повторяется один раз.
+
+    После транзакции, как RegisterView.perform_create, вызывается complete_signup
+    allauth: письмо подтверждения почты и сигнал user_signed_up.
+    """
+    adapter = get_adapter(request)
+    user = adapter.new_user(request)
+    serializer.cleaned_data = serializer.get_cleaned_data()
+    adapter.save_user(request, user, serializer, commit=False)
+    for name, value in (user_fields or {}).items():
+        setattr(user, name, value)
+
+    try:
+        adapter.clean_password(serializer.cleaned_data['password1'], user=user)
+    except DjangoValidationError as exc:
+        raise serializers.ValidationError(detail=serializers.as_serializer_error(exc))
+
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                user.save()
+                EmailAddress.objects.create(user=user, email=user.email, primary=True, verified=False)
+                profile_model.objects.create(user=user, **profile_fields)
+            break
+        except IntegrityError:
+            if CustomUser.objects.filter(email__iexact=user.email).exists():
+                raise serializers.ValidationError(
+                    {'email': [_('A user is already registered with this e-mail address.')]}
+                )
+            if attempt:
+                raise
+            reset_group_ids()
+            _reset_for_retry([user])
+
+    complete_signup(request._request, user, allauth_account_settings.EMAIL_VERIFICATION, None)
+    return user
+
+
+def register_users(users, profile_model, profiles, group_name, verified=False):
+    """
+    Массовая регистрация: пользователи, адреса почты, профили и членство в
+    группе - по одному INSERT на таблицу, все в одной транзакции.
+
+    :param users: несохраненные CustomUser с готовым хэшем пароля
+    :param profiles: несохраненные профили в том же порядке, user проставляется здесь
+    :param verified: считать адреса почты подтвержденными
+
+    Сигналы post_save не отправляются: группа добавляется здесь же, а в кэше
+    аутентификации новых пользователей еще нет. При IntegrityError (например,
+    группа пересоздана, см. register_user) пакет повторяется один раз.
+    """
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                CustomUser.objects.bulk_create(users)
+                EmailAddress.objects.bulk_create([
+                    EmailAddress(user=user, email=user.email, primary=True, verified=verified) for user in users
+                ])
+                for user, profile in zip(users, profiles):
+                    profile.user = user
+                profile_model.objects.bulk_create(profiles)
+                add_to_group([user.id for user in users], group_name)
+            return users
+        except IntegrityError:
+            if attempt:
+                raise
+            reset_group_ids()
+            _reset_for_retry([*users, *profiles])
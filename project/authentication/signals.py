@@ -1,18 +1,55 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth.models import Group
-from database.models import Client, Carrier
+from database.models import CustomUser, Client, Carrier
 
+from authentication.backends import invalidate_users
+from authentication.registration import add_to_group, reset_group_ids
+from project.cache import bump_generation
 
+
+# Кэш аутентификации сбрасывает invalidate_cached_user_profile ниже
 @receiver(post_save, sender=Client)
 def add_group_client(sender, instance, created, **kwargs):
     if created:
-        group = Group.objects.get(name='client')
-        instance.user.groups.add(group)
+        add_to_group([instance.user_id], 'client')
 
 
 @receiver(post_save, sender=Carrier)
-def add_group_client(sender, instance, created, **kwargs):
+def add_group_carrier(sender, instance, created, **kwargs):
     if created:
-        group = Group.objects.get(name='carrier')
-        instance.user.groups.add(group)
\ No newline at end of file
+        add_to_group([instance.user_id], 'carrier')
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_users([instance.id]))
+
+
+@receiver([post_save, post_delete], sender=Client)
+@receiver([post_save, post_delete], sender=Carrier)
+def invalidate_cached_user_profile(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_users([instance.user_id]))
+
+
+@receiver(m2m_changed, sender=CustomUser.groups.through)
+def invalidate_cached_user_groups(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # Изменились пользователи группы: при clear их id известны только до удаления
+        if action == 'pre_clear':
+            instance._cleared_user_ids = list(instance.user_set.values_list('id', flat=True))
+            return
+        user_ids = instance.__dict__.pop('_cleared_user_ids', None) if action == 'post_clear' else pk_set
+    else:
+        user_ids = [instance.pk]
+
+    if action in ('post_add', 'post_remove', 'post_clear') and user_ids:
+        transaction.on_commit(lambda: invalidate_users(user_ids))
+
+
+@receiver([post_save, post_delete], sender=Group)
+def invalidate_cached_roles(sender, instance, **kwargs):
+    # Роль - имена групп: переименование группы меняет роль всех ее пользователей
+    reset_group_ids()
+    transaction.on_commit(lambda: bump_generation(Group))
@@ -1,3 +1,186 @@
-from django.test import TestCase
+import io
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Group
+from django.contrib.sites.models import Site
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.backends import CachedJWTAuthentication
+from authentication.management.commands import import_employees
+from authentication.registration import _group_ids, get_group_id, register_users
+from database.models import CustomUser, Client, Carrier
+
+PASSWORD = 'Registration-test-2024'
+
+
+class RegisterClientTests(TransactionTestCase):
+    """
+    Внешние ключи проверяются при COMMIT, поэтому тесты идут в настоящих транзакциях.
+    """
+
+    def setUp(self):
+        Site.objects.get_or_create(id=1, defaults={'domain': 'testserver', 'name': 'testserver'})
+        Group.objects.get_or_create(name='client')
+
+    def register(self, email):
+        return self.client.post(reverse('rest_register_client'), {
+            'email': email,
+            'password1': PASSWORD,
+            'password2': PASSWORD,
+            'client_type': 'IND',
+            'first_name': 'Иван',
+            'last_name': 'Иванов',
+            'surname': 'Иванович',
+            'phone_number': '9000000000',
+        }, content_type='application/json')
+
+    def test_sends_confirmation_email(self):
+        response = self.register('new.client@example.com')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['new.client@example.com'])
+
+    def test_group_recreated_in_another_process(self):
+        stale_id = get_group_id('client')
+        Group.objects.filter(name='client').delete()
+        group = Group.objects.create(name='client')
+        # Сигнал сбросил кэш только в этом процессе; в остальных остался старый id
+        _group_ids['client'] = stale_id
+
+        response = self.register('after.recreate@example.com')
+
+        self.assertEqual(response.status_code, 201)
+        user = CustomUser.objects.get(email='after.recreate@example.com')
+        self.assertEqual(list(user.groups.values_list('id', flat=True)), [group.id])
+
+
+class CachedUserInvalidationTests(TestCase):
+    """
+    Сигналы сбрасывают кэш после COMMIT, поэтому изменения идут в captureOnCommitCallbacks.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('cached@example.com', 'Cached-password-1', first_name='Иван')
+        self.token = AccessToken.for_user(self.user)
+        Group.objects.get_or_create(name='client')
+        Group.objects.get_or_create(name='carrier')
+
+    def get_user(self):
+        return CachedJWTAuthentication().get_user(self.token)
+
+    def test_cached_until_changed(self):
+        self.get_user()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_user().first_name, 'Иван')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Петр'
+            self.user.save()
+
+        self.assertEqual(self.get_user().first_name, 'Петр')
+
+    def test_deactivated_user_rejected(self):
+        self.get_user()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.get_user()
+
+    def test_client_profile(self):
+        self.assertFalse(hasattr(self.get_user(), 'client'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            client = Client.objects.create(user=self.user)
+
+        user = self.get_user()
+        self.assertEqual(user.client.id, client.id)
+        self.assertEqual(user._cached_role, 'client')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            client.delete()
+
+        self.assertFalse(hasattr(self.get_user(), 'client'))
+
+    def test_carrier_profile(self):
+        self.assertFalse(hasattr(self.get_user(), 'carrier'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            carrier = Carrier.objects.create(user=self.user, company_name='Перевозчик', inn='1', kpp='1')
+
+        user = self.get_user()
+        self.assertEqual(user.carrier.id, carrier.id)
+        self.assertEqual(user._cached_role, 'carrier')
+
+    def test_group_membership(self):
+        group = Group.objects.create(name='manager')
+        self.assertEqual(self.get_user()._cached_role, 'user')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(group)
+        self.assertEqual(self.get_user()._cached_role, 'manager')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            group.user_set.clear()
+        self.assertEqual(self.get_user()._cached_role, 'user')
+
+    def test_group_renamed(self):
+        group = Group.objects.create(name='manager')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(group)
+        self.assertEqual(self.get_user()._cached_role, 'manager')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            group.name = 'dispatcher'
+            group.save()
+
+        self.assertEqual(self.get_user()._cached_role, 'dispatcher')
+
+
+class ImportEmployeesTests(TestCase):
+    def setUp(self):
+        Group.objects.get_or_create(name='client')
+        owner = CustomUser.objects.create_user('owner@example.com', 'Owner-password-1')
+        self.company = Client.objects.create(user=owner, client_type='LEG', company_name='ООО Автобусы', inn='7700')
+
+    def run_import(self, csv):
+        file = self.enterContext(tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8'))
+        file.write(csv)
+        file.flush()
+        stdout = io.StringIO()
+        call_command('import_employees', file.name, '--client', str(self.company.id), '--workers', '1',
+                     stdout=stdout)
+        return stdout.getvalue()
+
+    def test_registers_employees(self):
+        output = self.run_import('email,first_name\nfirst@example.com,Анна\nowner@example.com,Олег\n')
+
+        employee = CustomUser.objects.get(email='first@example.com')
+        self.assertEqual((employee.first_name, employee.client.company_name), ('Анна', 'ООО Автобусы'))
+        self.assertIn('Зарегистрировано сотрудников: 1, пропущено (адрес уже занят) 1', output)
+
+    def test_concurrent_registration_reported(self):
+        def register_concurrently(users, *args, **kwargs):
+            # Другой процесс регистрирует адрес между проверкой и вставкой пакета
+            if not CustomUser.objects.filter(email='second@example.com').exists():
+                CustomUser.objects.create_user('second@example.com', 'Other-password-1')
+            return register_users(users, *args, **kwargs)
+
+        with mock.patch.object(import_employees, 'register_users', side_effect=register_concurrently):
+            output = self.run_import('email\nfirst@example.com\nsecond@example.com\n')
+
+        self.assertTrue(CustomUser.objects.filter(email='first@example.com', client__isnull=False).exists())
+        self.assertFalse(Client.objects.filter(user__email='second@example.com').exists())
+        self.assertIn('Пропуск строки 3: адрес second@example.com уже занят', output)
+        self.assertIn('Зарегистрировано сотрудников: 1, пропущено (адрес уже занят) 1', output)
@@ -25,6 +25,7 @@ from dj_rest_auth.views import (
 )
 
 from project.utils import StandardResponseMixin
+from .registration import register_user
 from .serializers import *
 from database.models import *
 
@@ -48,17 +49,16 @@ class CustomRegisterClientView(StandardResponseMixin, RegisterView):
         return super().post(request, *args, **kwargs)
 
     def perform_create(self, serializer):
-        CustomUser = serializer.save(request=self.request)
         validation_data = serializer.validated_data.copy()
 
         validation_data.pop('email', None)
         validation_data.pop('password1', None)
         validation_data.pop('password2', None)
 
-        if validation_data.get('client_type') == 'IND':
-            CustomUser.first_name = validation_data.pop('first_name', '')
-            CustomUser.last_name = validation_data.pop('last_name', '')
-            CustomUser.surname = validation_data.pop('surname', '')
+        # ФИО сохраняется в пользователе и только у физических лиц
+        user_fields = {name: validation_data.pop(name, '') for name in ('first_name', 'last_name', 'surname')}
+        if validation_data.get('client_type') != 'IND':
+            user_fields = {}
 
         if validation_data.get('client_type') == 'LEG' and \
                 validation_data.get('legal_type') == 'OTH':
@@ -66,14 +66,7 @@ class CustomRegisterClientView(StandardResponseMixin, RegisterView):
 
         validation_data.pop('custom_type', None)
 
-        CustomUser.save()
-        Client.objects.create(user=CustomUser, **validation_data)
-
-        tokens = get_tokens_for_user(CustomUser)
-        return Response({
-            "CustomUser": serializer.validated_data,
-            "tokens": tokens
-        })
+        return register_user(self.request, serializer, Client, validation_data, user_fields)
 
 
 class CustomRegisterCarrierView(StandardResponseMixin, RegisterView):
@@ -87,7 +80,6 @@ class CustomRegisterCarrierView(StandardResponseMixin, RegisterView):
         return super().post(request, *args, **kwargs)
 
     def perform_create(self, serializer):
-        CustomUser = serializer.save(request=self.request)
         validation_data = serializer.validated_data.copy()
 
         validation_data.pop('email', None)
@@ -99,8 +91,7 @@ class CustomRegisterCarrierView(StandardResponseMixin, RegisterView):
 
         validation_data.pop('custom_type', None)
 
-        CustomUser.save()
-        Carrier.objects.create(user=CustomUser, **validation_data)
+        return register_user(self.request, serializer, Carrier, validation_data)
 
 
 def email_confirm_redirect(request, key):
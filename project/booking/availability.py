@@ -0,0 +1,335 @@
+import threading
+from bisect import bisect_left
+from datetime import datetime, timezone as dt_timezone
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from database.models import Schedule, Order
+
+ACTIVE_ORDER_STATUSES = ('pending', 'confirmed')
+
+VERSION_CACHE_KEY = 'bus_availability_index_version'
+# Журнал изменений: по номеру версии - id автобусов, чьи интервалы изменились (None - все)
+CHANGE_CACHE_KEY = 'bus_availability_index_change_{}'
+CHANGE_LOG_TIMEOUT = 60 * 60
+# Отстав больше чем на столько версий, процесс пересобирает индекс целиком
+MAX_INCREMENTAL_CHANGES = 500
+
+# Сколько занятых автобусов исключать списком id, больше - пересечения ищет база
+MAX_EXCLUDED_IDS = 1000
+
+_MIN_DATETIME = datetime.min.replace(tzinfo=dt_timezone.utc)
+_MAX_DATETIME = datetime.max.replace(tzinfo=dt_timezone.utc)
+
+
+def _aware(value):
+    if timezone.is_naive(value):
+        return timezone.make_aware(value)
+    return value
+
+
+def _merge(intervals):
+    """
+    Сортирует интервалы и склеивает пересекающиеся.
+
+    На выходе два параллельных массива starts/ends с непересекающимися
+    интервалами, оба отсортированы по возрастанию.
+    """
+    starts, ends = [], []
+    for start, end in sorted(intervals):
+        if ends and start <= ends[-1]:
+            if end > ends[-1]:
+                ends[-1] = end
+            continue
+        starts.append(start)
+        ends.append(end)
+    return starts, ends
+
+
+class IntervalTree:
+    """
+    Статическое центрированное дерево интервалов [start, end) со значениями.
+
+    Центр узла - медиана начал его интервалов: в узле остаются интервалы,
+    содержащие центр (хотя бы один), левее и правее уходит не больше половины.
+    Поиск всех интервалов, пересекающих окно, - O(log n + k).
+    """
+
+    __slots__ = ('center', 'by_start', 'by_end', 'left', 'right')
+
+    def __init__(self, intervals):
+        """
+        :param intervals: непустой список троек (start, end, value), start < end
+        """
+        center = sorted(start for start, _, _ in intervals)[len(intervals) // 2]
+        here, left, right = [], [], []
+        for item in intervals:
+            if item[1] <= center:
+                left.append(item)
+            elif item[0] > center:
+                right.append(item)
+            else:
+                here.append(item)
+
+        self.center = center
+        self.by_start = sorted(here, key=itemgetter(0))
+        self.by_end = sorted(here, key=itemgetter(1), reverse=True)
+        self.left = IntervalTree(left) if left else None
+        self.right = IntervalTree(right) if right else None
+
+    def overlapping(self, start, end, result):
+        """
+        Добавляет в result значения интервалов, пересекающих [start, end).
+        """
+        if end <= self.center:
+            # Интервалы узла кончаются после центра, пересекают окно те, что начались до его конца
+            for item in self.by_start:
+                if item[0] >= end:
+                    break
+                result.add(item[2])
+            if self.left is not None:
+                self.left.overlapping(start, end, result)
+        elif start > self.center:
+            # Интервалы узла начались не позже центра, пересекают окно те, что кончаются после его начала
+            for item in self.by_end:
+                if item[1] <= start:
+                    break
+                result.add(item[2])
+            if self.right is not None:
+                self.right.overlapping(start, end, result)
+        else:
+            # Центр внутри окна: его пересекают все интервалы узла
+            result.update(item[2] for item in self.by_start)
+            if self.left is not None:
+                self.left.overlapping(start, end, result)
+            if self.right is not None:
+                self.right.overlapping(start, end, result)
+        return result
+
+
+class BusAvailabilityIndex:
+    """
+    Индекс занятости автобусов в памяти процесса.
+
+    Хранит рейсы из Schedule и активные брони из Order, которые еще не
+    закончились: прошедшие интервалы на ответ для будущих окон не влияют, а
+    без них индекс не растет вместе с историей. Окна в прошлом индекс считает
+    свободными.
+
+    Для проверки одного автобуса - отсортированные непересекающиеся интервалы
+    по автобусу, бинарный поиск за O(log n). Для поиска всех занятых в окне -
+    дерево интервалов по времени, O(log n + k) без обхода всех автобусов.
+
+    Индекс обновляется лениво: сигналы post_save/post_delete увеличивают номер
+    версии в общем кэше и записывают в журнал id измененных автобусов. Процесс
+    при первом обращении после смены версии перечитывает из базы только эти
+    автобусы; если журнал неполон (истек или версий слишком много) - собирает
+    индекс целиком. Без общего кэша (AVAILABILITY_INDEX = False) другие процессы
+    смену версии не увидели бы, поэтому индекс не используется, см. is_busy и exclude_busy.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._busy = {}
+        self._tree = None
+        self._version = None
+        self._dirty = True
+
+    def invalidate(self, bus_ids=None):
+        """
+        Помечает интервалы автобусов bus_ids (по умолчанию - всех) устаревшими во всех процессах.
+        """
+        if bus_ids is None:
+            self._dirty = True
+        try:
+            version = cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            version = 1
+            cache.set(VERSION_CACHE_KEY, version, timeout=None)
+        changed = None if bus_ids is None else sorted(set(bus_ids))
+        cache.set(CHANGE_CACHE_KEY.format(version), changed, timeout=CHANGE_LOG_TIMEOUT)
+
+    def _load_rows(self, bus_ids=None):
+        """
+        Незакончившиеся интервалы занятости: тройки (bus_id, start, end).
+
+        :param bus_ids: только эти автобусы, None - все
+        """
+        current = timezone.now()
+
+        schedules = Schedule.objects.filter(trip_end__gt=current)
+        orders = (
+            Order.objects
+            .filter(status__in=ACTIVE_ORDER_STATUSES)
+            .filter(Q(time_range__endswith__gt=current) | Q(time_range__upper_inf=True))
+        )
+        if bus_ids is not None:
+            schedules = schedules.filter(bus_id__in=bus_ids)
+            orders = orders.filter(id_transport__in=bus_ids)
+
+        yield from schedules.values_list('bus_id', 'trip_start', 'trip_end').iterator(chunk_size=5000)
+
+        orders = orders.values_list('id_transport', 'time_range')
+        for bus_id, time_range in orders.iterator(chunk_size=5000):
+            if time_range is None or time_range.isempty:
+                continue
+            yield bus_id, time_range.lower or _MIN_DATETIME, time_range.upper or _MAX_DATETIME
+
+    @staticmethod
+    def _merge_rows(rows):
+        intervals = {}
+        for bus_id, start, end in rows:
+            if start < end:
+                intervals.setdefault(bus_id, []).append((start, end))
+        return {bus_id: _merge(items) for bus_id, items in intervals.items()}
+
+    def _build(self, busy):
+        merged = [
+            (start, end, bus_id)
+            for bus_id, (starts, ends) in busy.items()
+            for start, end in zip(starts, ends)
+        ]
+        return busy, IntervalTree(merged) if merged else None
+
+    def _changed_buses(self, version):
+        """
+        id автобусов, измененных после версии индекса, или None, если нужна полная сборка.
+        """
+        if self._version is None or not 0 < version - self._version <= MAX_INCREMENTAL_CHANGES:
+            return None
+        keys = [CHANGE_CACHE_KEY.format(number) for number in range(self._version + 1, version + 1)]
+        changes = cache.get_many(keys)
+        # Запись журнала истекла или еще не записана, либо изменились все автобусы
+        if len(changes) != len(keys) or any(changed is None for changed in changes.values()):
+            return None
+        return set().union(*changes.values())
+
+    def _ensure_fresh(self):
+        version = cache.get(VERSION_CACHE_KEY, 0)
+        if self._dirty or version != self._version:
+            with self._lock:
+                if self._dirty or version != self._version:
+                    changed = None if self._dirty else self._changed_buses(version)
+                    # Сбрасываем флаг до загрузки, чтобы не потерять инвалидацию во время сборки
+                    self._dirty = False
+                    if changed is None:
+                        busy = self._merge_rows(self._load_rows())
+                    else:
+                        busy = {bus_id: item for bus_id, item in self._busy.items() if bus_id not in changed}
+                        if changed:
+                            busy.update(self._merge_rows(self._load_rows(sorted(changed))))
+                    self._busy, self._tree = self._build(busy)
+                    self._version = version
+        return self._busy, self._tree
+
+    @staticmethod
+    def _overlaps(starts, ends, start_date, end_date):
+        # Последний интервал, начавшийся до конца окна; остальные интервалы левее и кончаются раньше
+        i = bisect_left(starts, end_date) - 1
+        return i >= 0 and ends[i] > start_date
+
+    def is_busy(self, bus_id, start_date, end_date):
+        """
+        Проверяет, занят ли автобус хотя бы частично в промежутке [start_date, end_date).
+        """
+        intervals = self._ensure_fresh()[0].get(bus_id)
+        if intervals is None:
+            return False
+        return self._overlaps(*intervals, _aware(start_date), _aware(end_date))
+
+    def busy_buses(self, start_date, end_date):
+        """
+        Возвращает множество id автобусов, занятых в промежутке [start_date, end_date).
+        """
+        start_date, end_date = _aware(start_date), _aware(end_date)
+        tree = self._ensure_fresh()[1]
+        if tree is None or start_date >= end_date:
+            return set()
+        return tree.overlapping(start_date, end_date, set())
+
+
+availability_index = BusAvailabilityIndex()
+
+
+def _busy_conditions(bus, start_date, end_date):
+    # Пересечения с рейсами и активными бронями по GiST-индексам диапазонов
+    window = DateTimeTZRange(start_date, end_date)
+    return (
+        Exists(Schedule.objects.filter(bus_id=bus, trip_range__overlap=window)),
+        Exists(Order.objects.filter(id_transport=bus, status__in=ACTIVE_ORDER_STATUSES, time_range__overlap=window)),
+    )
+
+
+def is_busy(bus_id, start_date, end_date):
+    """
+    Занят ли автобус в промежутке [start_date, end_date): по индексу или, без общего кэша, запросом к базе.
+    """
+    if settings.AVAILABILITY_INDEX:
+        return availability_index.is_busy(bus_id, start_date, end_date)
+    schedules, orders = _busy_conditions(bus_id, _aware(start_date), _aware(end_date))
+    return Schedule.objects.filter(schedules).exists() or Order.objects.filter(orders).exists()
+
+
+def exclude_busy(queryset, start_date, end_date):
+    """
+    Убирает из queryset автобусов занятые в промежутке [start_date, end_date).
+
+    Занятые берутся из индекса. Если их больше MAX_EXCLUDED_IDS, список id
+    сделал бы запрос слишком длинным, а без общего кэша индекса нет - тогда
+    пересечения ищет сама база по GiST-индексам диапазонов рейсов и броней.
+    """
+    start_date, end_date = _aware(start_date), _aware(end_date)
+    if settings.AVAILABILITY_INDEX:
+        busy = availability_index.busy_buses(start_date, end_date)
+        if len(busy) <= MAX_EXCLUDED_IDS:
+            return queryset.exclude(id__in=busy) if busy else queryset
+
+    schedules, orders = _busy_conditions(OuterRef('pk'), start_date, end_date)
+    return queryset.exclude(schedules).exclude(orders)
+
+
+def bulk_availability(bus_ids, windows):
+    """
+    Проверяет доступность нескольких автобусов в нескольких окнах одним запросом.
+
+    :param bus_ids: список id автобусов
+    :param windows: список пар (start_date, end_date)
+    :return: матрица bool размером len(bus_ids) x len(windows), True - автобус свободен
+    """
+    schedule_bus = Schedule._meta.get_field('bus_id').column
+    order_bus = Order._meta.get_field('id_transport').column
+
+    # Окна и автобусы разворачиваются из массивов, пересечения ищутся по GiST-индексам диапазонов
+    sql = f"""
+        SELECT b.ord, w.ord
+        FROM unnest(%s::bigint[]) WITH ORDINALITY AS b(id, ord)
+        CROSS JOIN unnest(%s::timestamptz[], %s::timestamptz[]) WITH ORDINALITY AS w(lo, hi, ord)
+        WHERE EXISTS (
+            SELECT 1 FROM {Schedule._meta.db_table} s
+            WHERE s.{schedule_bus} = b.id AND s.trip_range && tstzrange(w.lo, w.hi)
+        ) OR EXISTS (
+            SELECT 1 FROM {Order._meta.db_table} o
+            WHERE o.{order_bus} = b.id
+              AND o.status = ANY(%s)
+              AND o.time_range && tstzrange(w.lo, w.hi)
+        )
+    """
+    params = [
+        list(bus_ids),
+        [_aware(start_date) for start_date, _ in windows],
+        [_aware(end_date) for _, end_date in windows],
+        list(ACTIVE_ORDER_STATUSES),
+    ]
+
+    matrix = [[True] * len(windows) for _ in bus_ids]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for bus_ord, window_ord in cursor.fetchall():
+            matrix[bus_ord - 1][window_ord - 1] = False
+    return matrix
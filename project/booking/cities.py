@@ -0,0 +1,89 @@
+import logging
+import threading
+from bisect import bisect_left
+
+from django.core.cache import cache
+from django.db import DatabaseError
+
+from database.models import Cities
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'city_prefix_index_version'
+
+
+def normalize(value):
+    return value.strip().casefold().replace('ё', 'е')
+
+
+class CityPrefixIndex:
+    """
+    Отсортированный массив нормализованных названий городов для автодополнения.
+
+    Поиск по префиксу - бинарный поиск начала диапазона и проход по совпадениям,
+    без обращения к базе. Как и индекс занятости, пересобирается при смене
+    версии в кэше (сигналы записи Cities и загрузка городов).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = ([], [])
+        self._version = None
+        self._dirty = True
+
+    def invalidate(self):
+        self._dirty = True
+        try:
+            cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            cache.set(VERSION_CACHE_KEY, 1, timeout=None)
+
+    def _load_rows(self):
+        """
+        Города: тройки (id, name, region).
+        """
+        return Cities.objects.values_list('id', 'name', 'region').iterator(chunk_size=5000)
+
+    def _load(self):
+        rows = sorted((normalize(name), city_id, name, region) for city_id, name, region in self._load_rows())
+        # Ключи и города подменяются одной ссылкой, чтобы параллельный поиск не увидел их вразнобой
+        self._data = (
+            [row[0] for row in rows],
+            [{'id': city_id, 'name': name, 'region': region} for _, city_id, name, region in rows],
+        )
+
+    def _ensure_fresh(self):
+        version = cache.get(VERSION_CACHE_KEY, 0)
+        if not self._dirty and version == self._version:
+            return
+        with self._lock:
+            if self._dirty or version != self._version:
+                self._dirty = False
+                self._load()
+                self._version = version
+
+    def warm(self):
+        """
+        Загружает индекс заранее, при старте процесса. Ошибка базы не мешает запуску,
+        тогда индекс загрузится при первом запросе.
+        """
+        try:
+            self._ensure_fresh()
+        except DatabaseError as exc:
+            self._dirty = True
+            logger.warning("City prefix index was not warmed: %s", exc)
+
+    def search(self, prefix, limit=10):
+        self._ensure_fresh()
+        prefix = normalize(prefix)
+        keys, cities = self._data
+
+        result = []
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and len(result) < limit and keys[i].startswith(prefix):
+            result.append(cities[i])
+            i += 1
+        return result
+
+
+city_index = CityPrefixIndex()
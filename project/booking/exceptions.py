@@ -0,0 +1,21 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# SQLSTATE exclusion_violation в PostgreSQL
+EXCLUSION_VIOLATION = '23P01'
+
+
+class BookingConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Transport is already booked for this time range.'
+    default_code = 'booking_conflict'
+
+
+def is_booking_conflict(exc):
+    """
+    Проверяет, что IntegrityError вызван ограничением order_no_double_booking.
+    """
+    cause = exc.__cause__
+    if getattr(cause, 'sqlstate', None) != EXCLUSION_VIOLATION:
+        return False
+    return getattr(cause.diag, 'constraint_name', None) == 'order_no_double_booking'
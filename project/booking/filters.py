@@ -0,0 +1,80 @@
+import django_filters
+from django.db.models import Exists, F, OuterRef, Value
+from django.db.models.functions import Coalesce
+from rest_framework.filters import OrderingFilter
+
+from database.models import Transport, Order, BusSearch, AMENITY_FLAGS
+
+
+class BusSearchFilter(django_filters.FilterSet):
+    """
+    Фильтры поиска автобусов по денормализованной таблице BusSearch.
+
+    Имена параметров остались прежними, чтобы не ломать клиентов.
+    order__price, как и раньше, - автобусы с бронью ровно по этой цене;
+    диапазон минимальной цены задают price_min и price_max.
+    """
+    n_seats = django_filters.NumberFilter(field_name='search__n_seats')
+    order__price = django_filters.NumberFilter(method='filter_order_price')
+    price = django_filters.RangeFilter(field_name='search__min_price')
+    id_route__id_from = django_filters.NumberFilter(field_name='search__from_city_id')
+    id_route__id_to = django_filters.NumberFilter(field_name='search__to_city_id')
+    luggage = django_filters.BooleanFilter(method='filter_amenity')
+    wifi = django_filters.BooleanFilter(method='filter_amenity')
+    tv = django_filters.BooleanFilter(method='filter_amenity')
+    toilet = django_filters.BooleanFilter(method='filter_amenity')
+
+    class Meta:
+        model = Transport
+        fields = []
+
+    def filter_order_price(self, queryset, name, value):
+        if value is None:
+            return queryset
+        return queryset.filter(Exists(Order.objects.filter(id_transport=OuterRef('pk'), price=value)))
+
+    def filter_amenity(self, queryset, name, value):
+        if value is None:
+            return queryset
+        flag = AMENITY_FLAGS[name]
+        alias = f'_has_{name}'
+        return queryset.alias(**{alias: F('search__amenities').bitand(flag)}).filter(**{alias: flag if value else 0})
+
+
+class BusSearchOrderingFilter(OrderingFilter):
+    """
+    Сортировка поиска по колонкам BusSearch под публичными именами.
+
+    Автобус без строки BusSearch (LEFT JOIN) сортируется как строка со значениями
+    по умолчанию: NULL в ключе сортировки не записать в курсор KeysetPagination.
+    """
+    ordering_aliases = {
+        'price': 'search__min_price',
+        'n_seats': 'search__n_seats',
+        'rating': 'search__rating',
+    }
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+        return [
+            ('-' if field.startswith('-') else '') + self.sort_key(field.lstrip('-'))
+            for field in ordering
+        ]
+
+    @staticmethod
+    def sort_key(name):
+        return f'sort_{name}'
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.get_ordering(request, queryset, view)
+        if not ordering:
+            return queryset
+
+        keys = {}
+        for name, path in self.ordering_aliases.items():
+            if self.sort_key(name) in (field.lstrip('-') for field in ordering):
+                field = BusSearch._meta.get_field(path.split('__', 1)[1])
+                keys[self.sort_key(name)] = Coalesce(path, Value(field.get_default()), output_field=field)
+        return queryset.annotate(**keys).order_by(*ordering)
@@ -0,0 +1,105 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from booking.availability import availability_index, bulk_availability, ACTIVE_ORDER_STATUSES
+from database.models import Transport, Schedule, Order
+
+
+class Command(BaseCommand):
+    help = 'Сравнение проверки доступности автобусов через ORM и через индекс в памяти'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help="Количество случайных окон")
+        parser.add_argument('--days', type=int, default=90, help="Горизонт, в котором выбираются окна")
+        parser.add_argument('--bulk-buses', type=int, default=20, help="Автобусов в пакетной проверке")
+        parser.add_argument('--bulk-windows', type=int, default=5, help="Периодов в пакетной проверке")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def orm_busy_buses(self, start_date, end_date):
+        busy = set(Schedule.objects.filter(
+            trip_start__lt=end_date,
+            trip_end__gt=start_date
+        ).values_list('bus_id', flat=True))
+        busy.update(Order.objects.filter(
+            status__in=ACTIVE_ORDER_STATUSES,
+            time_range__overlap=(start_date, end_date)
+        ).values_list('id_transport', flat=True))
+        return busy
+
+    def orm_is_busy(self, bus_id, start_date, end_date):
+        return Schedule.objects.filter(
+            bus_id=bus_id,
+            trip_start__lt=end_date,
+            trip_end__gt=start_date
+        ).exists() or Order.objects.filter(
+            id_transport=bus_id,
+            status__in=ACTIVE_ORDER_STATUSES,
+            time_range__overlap=(start_date, end_date)
+        ).exists()
+
+    def measure(self, func, windows):
+        started = time.perf_counter()
+        results = [func(*window) for window in windows]
+        return time.perf_counter() - started, results
+
+    def handle(self, *args, **kwargs):
+        rnd = random.Random(kwargs['seed'])
+        bus_ids = list(Transport.objects.values_list('id', flat=True))
+        if not bus_ids:
+            self.stdout.write(self.style.WARNING('В базе нет автобусов.'))
+            return
+
+        base = now()
+        windows = []
+        for _ in range(kwargs['iterations']):
+            start_date = base + timedelta(hours=rnd.randint(0, kwargs['days'] * 24))
+            windows.append((start_date, start_date + timedelta(hours=rnd.randint(1, 72))))
+        bus_windows = [(rnd.choice(bus_ids), *window) for window in windows]
+
+        started = time.perf_counter()
+        availability_index.invalidate()
+        availability_index.busy_buses(base, base)
+        build_time = time.perf_counter() - started
+
+        orm_search, orm_search_res = self.measure(self.orm_busy_buses, windows)
+        idx_search, idx_search_res = self.measure(availability_index.busy_buses, windows)
+        orm_check, orm_check_res = self.measure(self.orm_is_busy, bus_windows)
+        idx_check, idx_check_res = self.measure(availability_index.is_busy, bus_windows)
+
+        n = len(windows)
+        self.stdout.write(f'Автобусов: {len(bus_ids)}, окон: {n}, сборка индекса: {build_time * 1000:.1f} мс')
+        self.stdout.write(
+            f'Поиск:    ORM {orm_search / n * 1000:.3f} мс/запрос, индекс {idx_search / n * 1000:.3f} мс/запрос'
+        )
+        self.stdout.write(
+            f'Проверка: ORM {orm_check / n * 1000:.3f} мс/запрос, индекс {idx_check / n * 1000:.3f} мс/запрос'
+        )
+
+        # Пакетная проверка: цикл по автобусам и периодам против одного запроса
+        bulk_buses = rnd.sample(bus_ids, min(kwargs['bulk_buses'], len(bus_ids)))
+        bulk_windows = windows[:kwargs['bulk_windows']]
+
+        started = time.perf_counter()
+        loop_res = [
+            [not self.orm_is_busy(bus_id, *window) for window in bulk_windows]
+            for bus_id in bulk_buses
+        ]
+        loop_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        bulk_res = bulk_availability(bulk_buses, bulk_windows)
+        bulk_time = time.perf_counter() - started
+
+        self.stdout.write(
+            f'Пакет {len(bulk_buses)}x{len(bulk_windows)}: цикл {loop_time * 1000:.1f} мс, '
+            f'один запрос {bulk_time * 1000:.1f} мс'
+        )
+
+        if orm_search_res != idx_search_res or orm_check_res != idx_check_res or loop_res != bulk_res:
+            self.stdout.write(self.style.ERROR('Результаты ORM и индекса расходятся!'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Результаты ORM и индекса совпадают.'))
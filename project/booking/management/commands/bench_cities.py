@@ -0,0 +1,54 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from booking.cities import city_index
+from database.models import Cities
+
+
+class Command(BaseCommand):
+    help = 'Сравнение автодополнения городов: индекс в памяти, триграммный индекс и icontains'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=500, help="Количество запросов")
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def measure(self, func, prefixes):
+        started = time.perf_counter()
+        for prefix in prefixes:
+            func(prefix)
+        return (time.perf_counter() - started) / len(prefixes) * 1000
+
+    def handle(self, *args, **kwargs):
+        limit = kwargs['limit']
+        rnd = random.Random(kwargs['seed'])
+
+        names = list(Cities.objects.values_list('name', flat=True))
+        if not names:
+            self.stdout.write(self.style.WARNING('В базе нет городов, загрузите их командой load_cities.'))
+            return
+        prefixes = [
+            name[:rnd.randint(1, min(4, len(name)))]
+            for name in rnd.choices(names, k=kwargs['queries'])
+        ]
+
+        started = time.perf_counter()
+        city_index.invalidate()
+        city_index.warm()
+        warm_ms = (time.perf_counter() - started) * 1000
+
+        def index_lookup(prefix):
+            return city_index.search(prefix, limit)
+
+        def trigram_lookup(prefix):
+            return list(Cities.objects.filter(name__istartswith=prefix).values('id', 'name', 'region')[:limit])
+
+        def icontains_lookup(prefix):
+            return list(Cities.objects.filter(name__icontains=prefix).values('id', 'name', 'region')[:limit])
+
+        self.stdout.write(f'Городов: {len(names)}, запросов: {len(prefixes)}, прогрев индекса: {warm_ms:.1f} мс')
+        self.stdout.write(f'Индекс в памяти:           {self.measure(index_lookup, prefixes):.4f} мс/запрос')
+        self.stdout.write(f'istartswith (pg_trgm GIN): {self.measure(trigram_lookup, prefixes):.4f} мс/запрос')
+        self.stdout.write(f'icontains:                 {self.measure(icontains_lookup, prefixes):.4f} мс/запрос')
@@ -0,0 +1,72 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from booking.serializers import TransportSerializer
+from database.models import Route, Transport
+from project.renderers import EnvelopeJSONRenderer
+
+
+class StdlibEnvelopeJSONRenderer(EnvelopeJSONRenderer):
+    use_orjson = False
+
+
+class Command(BaseCommand):
+    help = 'Стоимость обертки и сериализации в JSON большого списка автобусов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **kwargs):
+        # Данные сериализатора строятся один раз и без базы: меряется только путь ответа
+        transports = [
+            Transport(id=i, brand='Mercedes-Benz', model='Tourismo', year_issued=2015 + i % 10, n_deck=1,
+                      n_seats=40 + i % 20, luggage=True, wifi=i % 2 == 0, tv=False, toilet=True,
+                      id_route=Route(id=i, id_from_id=i, id_to_id=i + 1))
+            for i in range(1, kwargs['rows'] + 1)
+        ]
+        data = TransportSerializer(transports, many=True).data
+
+        self.run('как было: две обертки + json', data, kwargs['repeat'], self.legacy)
+        self.run('рендерер-обертка, json', data, kwargs['repeat'], self.envelope(StdlibEnvelopeJSONRenderer))
+        if EnvelopeJSONRenderer.use_orjson:
+            self.run('рендерер-обертка, orjson', data, kwargs['repeat'], self.envelope(EnvelopeJSONRenderer))
+        else:
+            self.stdout.write(self.style.WARNING('orjson не установлен, вариант с ним пропущен'))
+
+    @staticmethod
+    def legacy(data):
+        # Прежний StandardResponseMixin: обертка в finalize_response и еще одна в dispatch
+        response = Response(data)
+        response.data = {"status": "success", "data": response.data, "errors": {}}
+        response.data = {"status": "success", "data": response.data, "errors": {}}
+        return JSONRenderer().render(response.data, renderer_context={'response': response})
+
+    @staticmethod
+    def envelope(renderer_class):
+        def render(data):
+            response = Response(data)
+            response.envelope = True
+            return renderer_class().render(response.data, renderer_context={'response': response})
+        return render
+
+    def run(self, title, data, repeat, render):
+        render(data)
+        started = time.process_time()
+        for _ in range(repeat):
+            size = len(render(data))
+        cpu = (time.process_time() - started) / repeat
+
+        tracemalloc.start()
+        render(data)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        self.stdout.write(
+            f"{title:30} CPU {cpu * 1000:7.1f} мс на ответ, пик памяти {peak / 1024 / 1024:6.1f} МиБ, "
+            f"{size / 1024:.0f} КиБ"
+        )
@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from booking.serializers import (
+    TransportSerializer, OrderSerializer, TransportListSerializer, BusSearchListSerializer, OrderListSerializer,
+)
+from database.models import Transport, Order
+
+
+class Command(BaseCommand):
+    help = 'Сравнение сериализаторов списков: DRF и проекция values()'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help="Строк в замере сериализации")
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **kwargs):
+        rows, repeat = kwargs['rows'], kwargs['repeat']
+        if not Order.objects.exists():
+            raise CommandError('В базе нет броней, заполните ее командой generate_data.')
+
+        self.stdout.write('Загрузка и сериализация списка (время SQL вычтено):')
+        transports = Transport.objects.order_by('id')
+        orders = Order.objects.order_by('id')
+        self.compare(
+            'автобусы', repeat,
+            lambda: TransportSerializer(
+                list(transports.select_related('id_route').defer('photo')[:rows]), many=True).data,
+            lambda: TransportListSerializer(list(TransportListSerializer.project(transports)[:rows]), many=True).data,
+        )
+        self.compare(
+            'поиск автобусов', repeat,
+            lambda: TransportSerializer(
+                list(transports.select_related('id_route', 'search').defer('photo')[:rows]), many=True).data,
+            lambda: BusSearchListSerializer(list(BusSearchListSerializer.project(transports)[:rows]), many=True).data,
+        )
+        self.compare(
+            'брони', repeat,
+            lambda: OrderSerializer(
+                list(orders.select_related('id_transport__id_route', 'id_route').defer('id_transport__photo')
+                     [:rows]), many=True).data,
+            lambda: OrderListSerializer(list(OrderListSerializer.project(orders)[:rows]), many=True).data,
+        )
+
+    def measure(self, build, repeat):
+        # Время выполнения SQL вычитается: сравниваются создание объектов и сериализация
+        best = None
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                data = build()
+                elapsed = time.perf_counter() - started
+            query_time = sum(float(query['time']) for query in queries.captured_queries)
+            elapsed = max(elapsed - query_time, 0)
+            best = elapsed if best is None else min(best, elapsed)
+        return best, len(data)
+
+    def compare(self, title, repeat, drf, projection):
+        drf_time, count = self.measure(drf, repeat)
+        projection_time, _ = self.measure(projection, repeat)
+        self.stdout.write(
+            f"  {title:18} {count} строк: DRF {drf_time * 1000:7.1f} мс, проекция {projection_time * 1000:6.1f} мс "
+            f"(x{drf_time / max(projection_time, 1e-9):.1f})"
+        )
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from booking.search import refresh_bus_search
+
+
+class Command(BaseCommand):
+    help = 'Пересборка таблицы поиска автобусов BusSearch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Размер пакета upsert")
+        parser.add_argument('--missing', action='store_true',
+                            help="Только автобусы без строки поиска (созданные в обход сигналов)")
+
+    def handle(self, *args, **kwargs):
+        started = time.perf_counter()
+        refreshed = refresh_bus_search(batch_size=kwargs['batch_size'], missing_only=kwargs['missing'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено строк поиска: {refreshed} за {time.perf_counter() - started:.1f} с.'
+        ))
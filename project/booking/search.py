@@ -0,0 +1,77 @@
+from decimal import Decimal
+
+from django.db.models import Min, Q
+
+from database.models import Transport, BusSearch, AMENITY_FLAGS
+from project.cache import bump_generation
+
+SEARCH_FIELDS = [
+    'from_city_id', 'to_city_id', 'from_city_name', 'to_city_name',
+    'amenities', 'n_seats', 'rating', 'min_price',
+]
+
+
+def _build_rows(transports):
+    rows = (
+        transports
+        .values(
+            'id', 'n_seats', 'rating', *AMENITY_FLAGS,
+            'id_route__id_from', 'id_route__id_to',
+            'id_route__id_from__name', 'id_route__id_to__name',
+        )
+        .annotate(min_price=Min('order__price', filter=~Q(order__status='canceled')))
+        .order_by()
+    )
+    for row in rows.iterator(chunk_size=2000):
+        yield BusSearch(
+            transport_id=row['id'],
+            from_city_id=row['id_route__id_from'],
+            to_city_id=row['id_route__id_to'],
+            from_city_name=row['id_route__id_from__name'],
+            to_city_name=row['id_route__id_to__name'],
+            amenities=sum(flag for name, flag in AMENITY_FLAGS.items() if row[name]),
+            n_seats=row['n_seats'],
+            rating=row['rating'],
+            min_price=row['min_price'] or Decimal(0),
+        )
+
+
+def refresh_bus_search(transport_ids=None, batch_size=1000, missing_only=False):
+    """
+    Пересчитывает строки BusSearch для указанных автобусов (или для всех).
+
+    Одна агрегирующая выборка по Transport/Route/Order и один upsert на пакет.
+    missing_only - только автобусы без строки: фильтры поиска идут через join
+    с BusSearch, и такие автобусы в поиск не попадают.
+    """
+    transports = Transport.objects.all()
+    if missing_only:
+        transports = transports.filter(search__isnull=True)
+    if transport_ids is not None:
+        transport_ids = list(transport_ids)
+        if not transport_ids:
+            return 0
+        transports = transports.filter(id__in=transport_ids)
+
+    refreshed = 0
+    batch = []
+    for row in _build_rows(transports):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            refreshed += _upsert(batch)
+            batch = []
+    refreshed += _upsert(batch)
+
+    bump_generation(BusSearch)
+    return refreshed
+
+
+def _upsert(rows):
+    if rows:
+        BusSearch.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['transport'],
+            update_fields=SEARCH_FIELDS,
+        )
+    return len(rows)
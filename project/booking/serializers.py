@@ -1,6 +1,7 @@
 from django.utils.timezone import now
 
 from database.models import *
+from project.projection import Column, ProjectionSerializer, model_field_string, prefixed
 from rest_framework import serializers
 
 
@@ -11,7 +12,9 @@ class RouteSerializer(serializers.ModelSerializer):
 
 
 class TransportSerializer(serializers.ModelSerializer):
-    route = RouteSerializer()  # Чтобы отображать информацию по маршруту
+    route = RouteSerializer(source='id_route', read_only=True)  # Чтобы отображать информацию по маршруту
+    # В ответе только URL файла в хранилище
+    photo = serializers.ImageField(source='photo_file', required=False, allow_null=True)
     
     class Meta:
         model = Transport
@@ -27,10 +30,33 @@ class ScheduleSerializer(serializers.ModelSerializer):
         fields = ['trip_start', 'trip_end']
 
 
+class AvailabilityWindowSerializer(serializers.Serializer):
+    start_date = serializers.DateTimeField()
+    end_date = serializers.DateTimeField()
+
+    def validate(self, data):
+        if data['start_date'] >= data['end_date']:
+            raise serializers.ValidationError("End date must be after start date.")
+        return data
+
+
+class BulkAvailabilitySerializer(serializers.Serializer):
+    bus_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=500)
+    windows = serializers.ListField(child=AvailabilityWindowSerializer(), allow_empty=False, max_length=50)
+
+    def validate_bus_ids(self, value):
+        # Несуществующий автобус иначе выглядел бы свободным: занятости у него нет
+        existing = set(Transport.objects.filter(id__in=value).values_list('id', flat=True))
+        unknown = [bus_id for bus_id in value if bus_id not in existing]
+        if unknown:
+            raise serializers.ValidationError(f"Unknown transport ids: {', '.join(map(str, unknown))}.")
+        return value
+
+
 class OrderSerializer(serializers.ModelSerializer):
-    # Чтобы отображать строковые представления автобуса и маршрута
-    transport = TransportSerializer(read_only=True)
-    route = serializers.StringRelatedField()
+    # Чтобы отображать автобус и маршрут брони
+    transport = TransportSerializer(source='id_transport', read_only=True)
+    route = RouteSerializer(source='id_route', read_only=True)
     
     class Meta:
         model = Order
@@ -48,4 +74,65 @@ class OrderSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Start date cannot be in the past.")
 
         return data
-    
\ No newline at end of file
+    
+
+# Быстрые сериализаторы списков: те же ответы, что у TransportSerializer и OrderSerializer,
+# но из строк values() без полей DRF
+
+def transport_fields(route):
+    return {
+        'id': 'id',
+        'brand': 'brand',
+        'model': 'model',
+        'year_issued': 'year_issued',
+        'n_deck': 'n_deck',
+        'n_seats': 'n_seats',
+        'photo': Column('photo_file', 'photo_url'),
+        'luggage': 'luggage',
+        'wifi': 'wifi',
+        'tv': 'tv',
+        'toilet': 'toilet',
+        'route': route,
+    }
+
+
+ROUTE_FIELDS = {'id_from': 'id_route__id_from', 'id_to': 'id_route__id_to'}
+
+
+class TransportProjectionMixin:
+    photo_storage = Transport._meta.get_field('photo_file').storage
+
+    def photo_url(self, name):
+        if not name:
+            return None
+        url = self.photo_storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+
+class TransportListSerializer(TransportProjectionMixin, ProjectionSerializer):
+    fields = transport_fields(ROUTE_FIELDS)
+
+
+class BusSearchListSerializer(TransportProjectionMixin, ProjectionSerializer):
+    # Маршрут - из Route, как в TransportSerializer: у автобуса может еще не быть строки BusSearch
+    fields = transport_fields(ROUTE_FIELDS)
+
+
+class OrderListSerializer(TransportProjectionMixin, ProjectionSerializer):
+    fields = {
+        'id': 'id',
+        'transport': prefixed(transport_fields(ROUTE_FIELDS), 'id_transport__'),
+        'route': ROUTE_FIELDS,
+        'status': 'status',
+        'create_time': Column('create_time', serializers.DateTimeField().to_representation),
+        'time_range': Column('time_range', model_field_string(Order._meta.get_field('time_range'))),
+        'passenger_type': 'passenger_type',
+        'price': Column('price', serializers.DecimalField(max_digits=10, decimal_places=2).to_representation),
+        'notification_sent': 'notification_sent',
+        'id_extra_service': 'id_extra_service',
+        'id_client': 'id_client',
+        'id_transport': 'id_transport',
+        'id_route': 'id_route',
+        'id_carrier': 'id_carrier',
+    }
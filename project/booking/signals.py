@@ -0,0 +1,93 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from database.models import Transport, Schedule, Order, Route, Cities
+from booking.availability import availability_index
+from booking.cities import city_index
+from booking.search import refresh_bus_search
+from notification.stream import hub
+from project.cache import bump_generation
+
+
+@receiver([post_save, post_delete], sender=Schedule)
+def invalidate_schedule_bus(sender, instance, **kwargs):
+    invalidate_buses(instance.bus_id_id, getattr(instance, '_loaded_bus_id', None))
+    instance._loaded_bus_id = instance.bus_id_id
+
+
+@receiver([post_save, post_delete], sender=Order)
+def invalidate_order_bus(sender, instance, **kwargs):
+    invalidate_buses(instance.id_transport_id, getattr(instance, '_loaded_transport_id', None))
+    instance._loaded_transport_id = instance.id_transport_id
+
+
+def invalidate_buses(*bus_ids):
+    # Сбрасываем интервалы только после коммита, иначе другие процессы прочитают старые данные
+    bus_ids = {bus_id for bus_id in bus_ids if bus_id is not None}
+    transaction.on_commit(lambda: availability_index.invalidate(bus_ids))
+
+
+@receiver([post_save, post_delete], sender=Transport)
+@receiver([post_save, post_delete], sender=Schedule)
+@receiver([post_save, post_delete], sender=Order)
+@receiver([post_save, post_delete], sender=Route)
+@receiver([post_save, post_delete], sender=Cities)
+def bump_response_cache_generation(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_generation(sender))
+
+
+@receiver(post_save, sender=Transport)
+def refresh_search_for_transport(sender, instance, **kwargs):
+    # Строка поиска пишется в той же транзакции, что и автобус: без нее автобус выпал бы из поиска
+    refresh_bus_search([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Order)
+def refresh_search_for_order(sender, instance, **kwargs):
+    transaction.on_commit(lambda: refresh_bus_search([instance.id_transport_id]))
+
+
+@receiver(post_save, sender=Route)
+def refresh_search_for_route(sender, instance, created, **kwargs):
+    if created:
+        return
+    transport_ids = Transport.objects.filter(id_route=instance).values_list('id', flat=True)
+    transaction.on_commit(lambda: refresh_bus_search(transport_ids))
+
+
+@receiver(post_save, sender=Cities)
+def refresh_search_for_city(sender, instance, created, **kwargs):
+    if created:
+        return
+    transport_ids = Transport.objects.filter(
+        Q(id_route__id_from=instance) | Q(id_route__id_to=instance)
+    ).values_list('id', flat=True)
+    transaction.on_commit(lambda: refresh_bus_search(transport_ids))
+
+
+@receiver([post_save, post_delete], sender=Cities)
+def invalidate_city_index(sender, instance, **kwargs):
+    transaction.on_commit(city_index.invalidate)
+
+
+@receiver(post_save, sender=Order)
+def publish_order_status(sender, instance, created, **kwargs):
+    # Новая бронь приходит уведомлением во входящих, здесь - только смена статуса
+    loaded_status = getattr(instance, '_loaded_status', None)
+    instance._loaded_status = instance.__dict__.get('status')
+    if created or loaded_status is None or instance.status == loaded_status:
+        return
+    order_id, order_status = instance.id, instance.status
+
+    def publish():
+        user_ids = (
+            Order.objects.filter(id=order_id)
+            .values_list('id_client__user_id', 'id_carrier__user_id')
+            .first()
+        )
+        if user_ids:
+            hub.publish(set(user_ids), 'order_status', {'id': order_id, 'status': order_status})
+
+    transaction.on_commit(publish)
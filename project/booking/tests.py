@@ -1,3 +1,688 @@
-from django.test import TestCase
+import io
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
 
-# Create your tests here.
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken
+
+from database.models import BusSearch, Carrier, Cities, Client, CustomUser, Order, Route, Transport
+from project.cache import bump_generation, get_or_compute
+from project.pagination import KeysetPagination
+from project.utils import CacheResponseMixin
+from .availability import (
+    CHANGE_CACHE_KEY, VERSION_CACHE_KEY, BusAvailabilityIndex, IntervalTree, _merge, availability_index,
+)
+from .cities import CityPrefixIndex, city_index
+from .exceptions import BookingConflict
+from .serializers import BusSearchListSerializer, TransportListSerializer, TransportSerializer
+from .views import (
+    BookingDetailApiView, BookingListCarrierApiView, BookingListClientApiView, BusSearchApiView, CitySearchApiView,
+    TransportViewSet,
+)
+
+BASE = datetime(2030, 1, 1, tzinfo=dt_timezone.utc)
+
+
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+def hours(value):
+    return BASE + timedelta(hours=value)
+
+
+def create_booking_data(buses):
+    """
+    Клиент, перевозчик, маршрут и buses автобусов с одной бронью клиента на каждом.
+    """
+    for name in ('client', 'carrier'):
+        Group.objects.get_or_create(name=name)
+    route = Route.objects.create(
+        id_from=Cities.objects.create(name='Москва', region='Москва'),
+        id_to=Cities.objects.create(name='Казань', region='Татарстан'),
+    )
+    client = Client.objects.create(user=CustomUser.objects.create_user('client@example.com', 'Client-password-1'))
+    carrier = Carrier.objects.create(
+        user=CustomUser.objects.create_user('carrier@example.com', 'Carrier-password-1'),
+        company_name='ООО Перевозчик', inn='7700000000', kpp='770001001',
+    )
+    for i in range(buses):
+        bus = Transport.objects.create(bus_nickname=f'Автобус {i}', brand='ПАЗ', model='3205', n_seats=20 + i,
+                                       id_route=route)
+        Order.objects.create(time_range=DateTimeTZRange(hours(i), hours(i + 2)), price=1000 + i, id_client=client,
+                             id_transport=bus, id_route=route, id_carrier=carrier)
+    return route, client.user, carrier.user
+
+
+class StaticIndex(BusAvailabilityIndex):
+    """
+    Индекс с интервалами из списка вместо базы.
+    """
+
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = rows
+        self.loads = []
+
+    def _load_rows(self, bus_ids=None):
+        self.loads.append(bus_ids)
+        return iter(row for row in self.rows if bus_ids is None or row[0] in bus_ids)
+
+
+class MergeTests(SimpleTestCase):
+    def test_merges_overlapping_and_touching(self):
+        starts, ends = _merge([(hours(5), hours(7)), (hours(0), hours(2)), (hours(1), hours(3)), (hours(3), hours(4))])
+        self.assertEqual(starts, [hours(0), hours(5)])
+        self.assertEqual(ends, [hours(4), hours(7)])
+
+    def test_nested_interval_keeps_outer_end(self):
+        starts, ends = _merge([(hours(0), hours(10)), (hours(2), hours(3))])
+        self.assertEqual((starts, ends), ([hours(0)], [hours(10)]))
+
+    def test_empty(self):
+        self.assertEqual(_merge([]), ([], []))
+
+
+class IntervalTreeTests(SimpleTestCase):
+    def test_matches_brute_force(self):
+        rnd = random.Random(1)
+        intervals = []
+        for value in range(300):
+            start = rnd.randint(0, 1000)
+            intervals.append((start, start + rnd.randint(1, 50), value))
+        tree = IntervalTree(intervals)
+
+        for _ in range(500):
+            start = rnd.randint(-20, 1050)
+            end = start + rnd.randint(1, 100)
+            expected = {value for lo, hi, value in intervals if lo < end and hi > start}
+            self.assertEqual(tree.overlapping(start, end, set()), expected)
+
+    def test_half_open_bounds(self):
+        tree = IntervalTree([(10, 20, 'a')])
+        self.assertEqual(tree.overlapping(0, 10, set()), set())
+        self.assertEqual(tree.overlapping(20, 30, set()), set())
+        self.assertEqual(tree.overlapping(19, 30, set()), {'a'})
+
+
+class BusyBusesTests(SimpleTestCase):
+    def setUp(self):
+        self.index = StaticIndex([
+            (1, hours(0), hours(2)),
+            (1, hours(1), hours(4)),
+            (2, hours(3), hours(5)),
+            (3, hours(10), hours(12)),
+            (4, hours(6), hours(6)),  # пустой интервал не занимает автобус
+        ])
+
+    def test_busy_buses(self):
+        self.assertEqual(self.index.busy_buses(hours(2), hours(3)), {1})
+        self.assertEqual(self.index.busy_buses(hours(3), hours(11)), {1, 2, 3})
+        self.assertEqual(self.index.busy_buses(hours(5), hours(10)), set())
+        self.assertEqual(self.index.busy_buses(hours(-5), hours(100)), {1, 2, 3})
+
+    def test_agrees_with_is_busy(self):
+        for start in range(-1, 13):
+            for length in (1, 2, 5):
+                busy = self.index.busy_buses(hours(start), hours(start + length))
+                for bus_id in (1, 2, 3, 4):
+                    self.assertEqual(bus_id in busy, self.index.is_busy(bus_id, hours(start), hours(start + length)))
+
+    def test_naive_dates_and_empty_window(self):
+        self.assertEqual(self.index.busy_buses(datetime(2030, 1, 1, 1), datetime(2030, 1, 1, 1)), set())
+
+    def test_invalidate_rebuilds(self):
+        self.assertEqual(self.index.busy_buses(hours(20), hours(21)), set())
+        self.index.rows = self.index.rows + [(5, hours(20), hours(22))]
+        self.index.invalidate()
+        self.assertEqual(self.index.busy_buses(hours(20), hours(21)), {5})
+
+    def test_invalidate_reloads_changed_buses(self):
+        self.index.busy_buses(hours(0), hours(1))
+        self.index.rows = [row for row in self.index.rows if row[0] != 2] + [(2, hours(20), hours(22))]
+        self.index.invalidate([2])
+        del self.index.loads[:]
+
+        self.assertEqual(self.index.busy_buses(hours(20), hours(21)), {2})
+        self.assertEqual(self.index.busy_buses(hours(0), hours(12)), {1, 3})
+        self.assertEqual(self.index.loads, [[2]])
+
+    def test_missing_change_log_rebuilds(self):
+        self.index.busy_buses(hours(0), hours(1))
+        self.index.rows = self.index.rows + [(5, hours(20), hours(22))]
+        self.index.invalidate([5])
+        # Другой процесс видит версию, но запись журнала уже истекла
+        self.index._dirty = False
+        cache.delete(CHANGE_CACHE_KEY.format(cache.get(VERSION_CACHE_KEY)))
+        del self.index.loads[:]
+
+        self.assertEqual(self.index.busy_buses(hours(20), hours(21)), {5})
+        self.assertEqual(self.index.loads, [None])
+
+
+class CountingList:
+    def list(self, request, *args, **kwargs):
+        self.counter['calls'] += 1
+        return Response({'calls': self.counter['calls']})
+
+
+class CachedListView(CacheResponseMixin, CountingList, APIView):
+    authentication_classes = []
+    permission_classes = []
+    cache_models = (Transport,)
+    name_prefix_cache = 'test'
+    counter = None
+
+    def get(self, request, *args, **kwargs):
+        return self.list(request, *args, **kwargs)
+
+
+@override_settings(RESPONSE_CACHE=True)
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.counter = {'calls': 0}
+        self.view = CachedListView.as_view(counter=self.counter)
+        self.factory = APIRequestFactory()
+
+    def get(self, query):
+        return self.view(self.factory.get(f'/buses/{query}')).data['calls']
+
+    def test_query_string_is_normalised(self):
+        self.assertEqual(self.get('?b=2&a=1'), 1)
+        self.assertEqual(self.get('?a=1&b=2'), 1)
+        self.assertEqual(self.get('?a=1&b=3'), 2)
+
+    def test_generation_bump_invalidates(self):
+        self.assertEqual(self.get('?a=1'), 1)
+        self.assertEqual(self.get('?a=1'), 1)
+        bump_generation(Transport)
+        self.assertEqual(self.get('?a=1'), 2)
+        self.assertEqual(self.get('?a=1'), 2)
+
+    @override_settings(RESPONSE_CACHE=False)
+    def test_disabled_without_shared_cache(self):
+        self.assertEqual(self.get('?a=1'), 1)
+        self.assertEqual(self.get('?a=1'), 2)
+
+
+class GetOrComputeTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_misses_are_coalesced(self):
+        calls = []
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'value', True
+
+        results = []
+
+        def worker():
+            results.append(get_or_compute('coalesce', slow, timeout=60, stale_timeout=60))
+
+        first = threading.Thread(target=worker)
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=worker)
+        second.start()
+        time.sleep(0.1)
+        release.set()
+        first.join(5)
+        second.join(5)
+
+        self.assertEqual(results, ['value', 'value'])
+        self.assertEqual(len(calls), 1)
+
+    def test_stale_value_is_refreshed_in_background(self):
+        get_or_compute('stale', lambda: ('old', True), timeout=0, stale_timeout=60)
+
+        release = threading.Event()
+
+        def refresh():
+            release.wait(5)
+            return 'new', True
+
+        # Устаревшее значение отдается сразу, не дожидаясь пересчета
+        self.assertEqual(get_or_compute('stale', refresh, timeout=0, stale_timeout=60), 'old')
+        release.set()
+
+        deadline = time.monotonic() + 5
+        while cache.get('stale')[1] != 'new' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(cache.get('stale')[1], 'new')
+
+
+@override_settings(CACHES=NO_CACHE)
+class ListQueryCountTests(TestCase):
+    """
+    Число запросов списков не зависит от числа строк на странице.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.route, cls.client_user, cls.carrier_user = create_booking_data(buses=6)
+
+    def count_queries(self, view, user, page_size):
+        request = APIRequestFactory().get('/', {'page_size': page_size})
+        # Свежий объект: закэшированные в пользователе связи (client) не должны экономить запросы второму вызову
+        force_authenticate(request, user=CustomUser.objects.get(id=user.id))
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request)
+            response.render()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), page_size)
+        return len(queries.captured_queries)
+
+    def assertConstantQueries(self, view, user):
+        self.assertEqual(self.count_queries(view, user, 1), self.count_queries(view, user, 6))
+
+    def test_buses(self):
+        # Список автобусов без пагинации, для проверки она включается здесь
+        view = TransportViewSet.as_view({'get': 'list'}, pagination_class=KeysetPagination)
+        self.assertConstantQueries(view, self.client_user)
+
+    def test_bus_search(self):
+        self.assertConstantQueries(BusSearchApiView.as_view(), self.client_user)
+
+    def test_client_bookings(self):
+        self.assertConstantQueries(BookingListClientApiView.as_view(), self.client_user)
+
+    def test_carrier_bookings(self):
+        self.assertConstantQueries(BookingListCarrierApiView.as_view(), self.carrier_user)
+
+
+class BusSearchListSerializerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.route, _, _ = create_booking_data(buses=2)
+
+    def serialize(self, queryset):
+        return BusSearchListSerializer(list(BusSearchListSerializer.project(queryset)), many=True).data
+
+    def test_matches_transport_serializer(self):
+        queryset = Transport.objects.order_by('id')
+        self.assertEqual(self.serialize(queryset), TransportSerializer(queryset, many=True).data)
+
+    def test_route_without_search_row(self):
+        # bulk_create не отправляет post_save, и строка BusSearch не создается
+        bus, = Transport.objects.bulk_create([
+            Transport(bus_nickname='Новый', brand='ПАЗ', model='3205', id_route=self.route),
+        ])
+        row, = self.serialize(Transport.objects.filter(id=bus.id))
+        self.assertEqual(row['route'], {'id_from': self.route.id_from_id, 'id_to': self.route.id_to_id})
+
+
+@override_settings(QUERY_BUDGET_MODE='raise')
+class QueryBudgetTests(TestCase):
+    """
+    Запросы бюджетированных представлений с настоящей JWT-аутентификацией.
+
+    Без кэша каждый запрос - промах кэша пользователя (пользователь с профилем и
+    группы), и ответы не кэшируются: число запросов равно бюджету. С кэшем
+    повторный запрос не читает пользователя, а кэшируемые ответы - и данные.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.route, cls.client_user, cls.carrier_user = create_booking_data(buses=3)
+        cls.bus = Transport.objects.order_by('id').first()
+        cls.order = Order.objects.order_by('id').first()
+
+    def count_queries(self, view, user, params, kwargs):
+        request = APIRequestFactory().get('/', params, HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request, **kwargs)
+            response.render()
+        self.assertEqual(response.status_code, 200)
+        return len(queries.captured_queries)
+
+    def assertQueries(self, view, user, uncached, cached, params=None, **kwargs):
+        with override_settings(CACHES=NO_CACHE):
+            availability_index.invalidate()
+            self.assertEqual(self.count_queries(view, user, params, kwargs), uncached)
+
+        with override_settings(RESPONSE_CACHE=True):
+            cache.clear()
+            availability_index.invalidate()
+            self.count_queries(view, user, params, kwargs)
+            self.assertEqual(self.count_queries(view, user, params, kwargs), cached)
+
+    def test_bus_list(self):
+        self.assertQueries(TransportViewSet.as_view({'get': 'list'}), self.client_user, uncached=3, cached=0)
+
+    def test_bus_detail(self):
+        self.assertQueries(TransportViewSet.as_view({'get': 'retrieve'}), self.client_user, uncached=4, cached=0,
+                           pk=self.bus.id)
+
+    def test_bus_search(self):
+        # Без индекса занятости пересечения ищутся подзапросами в той же выборке
+        params = {'start_date': hours(0).isoformat(), 'end_date': hours(1).isoformat()}
+        self.assertQueries(BusSearchApiView.as_view(), self.client_user, uncached=3, cached=0, params=params)
+
+    @override_settings(AVAILABILITY_INDEX=True)
+    def test_bus_search_with_index(self):
+        # С датами при устаревшем индексе занятости - две выборки для его сборки
+        params = {'start_date': hours(0).isoformat(), 'end_date': hours(1).isoformat()}
+        self.assertQueries(BusSearchApiView.as_view(), self.client_user, uncached=5, cached=0, params=params)
+
+    def test_client_bookings(self):
+        self.assertQueries(BookingListClientApiView.as_view(), self.client_user, uncached=3, cached=1)
+
+    def test_carrier_bookings(self):
+        self.assertQueries(BookingListCarrierApiView.as_view(), self.carrier_user, uncached=3, cached=1)
+
+    def test_booking_detail(self):
+        self.assertQueries(BookingDetailApiView.as_view(), self.client_user, uncached=3, cached=1, pk=self.order.id)
+
+
+class BookingConflictTests(TestCase):
+    """
+    Пересекающаяся активная бронь того же автобуса отклоняется ограничением в базе с ответом 409.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.route, cls.client_user, cls.carrier_user = create_booking_data(buses=2)
+        cls.first, cls.second = Order.objects.order_by('id')
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(CustomUser.objects.get(id=self.client_user.id))
+
+    def order_data(self, bus, start, end):
+        return {
+            'time_range': {'lower': hours(start).isoformat(), 'upper': hours(end).isoformat()},
+            'id_transport': bus.id,
+            'id_route': self.route.id,
+            'id_carrier': self.first.id_carrier_id,
+        }
+
+    def assertConflict(self, response):
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['errors'], {'detail': [BookingConflict.default_detail]})
+
+    def test_create_overlapping(self):
+        response = self.api.post(reverse('booking-create'), self.order_data(self.first.id_transport, 1, 3),
+                                 format='json')
+
+        self.assertConflict(response)
+        self.assertEqual(Order.objects.filter(id_transport=self.first.id_transport).count(), 1)
+
+    def test_create_adjacent(self):
+        # Диапазоны полуоткрытые: бронь с конца существующей не пересекается с ней
+        response = self.api.post(reverse('booking-create'), self.order_data(self.first.id_transport, 2, 4),
+                                 format='json')
+
+        self.assertEqual(response.status_code, 201)
+
+    def test_create_over_canceled(self):
+        Order.objects.filter(id=self.first.id).update(status='canceled')
+
+        response = self.api.post(reverse('booking-create'), self.order_data(self.first.id_transport, 1, 3),
+                                 format='json')
+
+        self.assertEqual(response.status_code, 201)
+
+    def test_update_overlapping(self):
+        response = self.api.patch(reverse('booking-update', args=[self.second.id]),
+                                  self.order_data(self.first.id_transport, 0, 1), format='json')
+
+        self.assertConflict(response)
+        order = Order.objects.get(id=self.second.id)
+        self.assertEqual((order.id_transport_id, order.time_range.lower), (self.second.id_transport_id, hours(1)))
+
+
+class BulkAvailabilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.route, cls.client_user, cls.carrier_user = create_booking_data(buses=2)
+        cls.first, cls.second = Transport.objects.order_by('id')
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(CustomUser.objects.get(id=self.client_user.id))
+
+    def post(self, bus_ids, windows):
+        return self.api.post(reverse('buses-bulk-availability'), {
+            'bus_ids': bus_ids,
+            'windows': [{'start_date': hours(start).isoformat(), 'end_date': hours(end).isoformat()}
+                        for start, end in windows],
+        }, format='json')
+
+    def test_matrix(self):
+        # Брони: первый автобус занят в [0, 2), второй - в [1, 3)
+        response = self.post([self.first.id, self.second.id], [(0, 1), (2, 3), (3, 4)])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data'], {
+            'bus_ids': [self.first.id, self.second.id],
+            'available': [[False, True, True], [True, False, True]],
+        })
+
+    def test_canceled_order_frees_bus(self):
+        Order.objects.filter(id_transport=self.first).update(status='canceled')
+
+        response = self.post([self.first.id], [(0, 1)])
+
+        self.assertEqual(response.json()['data']['available'], [[True]])
+
+    def test_unknown_bus(self):
+        missing = self.second.id + 100
+        response = self.post([self.first.id, missing], [(0, 1)])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors']['bus_ids'], [f'Unknown transport ids: {missing}.'])
+
+    def test_invalid_window(self):
+        response = self.post([self.first.id], [(2, 1)])
+
+        self.assertEqual(response.status_code, 400)
+
+
+class BusSearchOrderingTests(TestCase):
+    """
+    Постраничный обход поиска с сортировкой по колонкам BusSearch.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.route, cls.client_user, cls.carrier_user = create_booking_data(buses=3)
+        # bulk_create не вызывает сигналы: у автобуса нет строки BusSearch
+        cls.unindexed = Transport.objects.bulk_create([
+            Transport(bus_nickname='Без поиска', brand='ПАЗ', model='3205', n_seats=10, id_route=cls.route),
+        ])[0]
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(CustomUser.objects.get(id=self.client_user.id))
+
+    def walk(self, ordering):
+        ids = []
+        response = self.api.get(reverse('bus-search'), {'ordering': ordering, 'page_size': 1})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            page = response.json()['data']
+            ids.extend(bus['id'] for bus in page['results'])
+            if not page['next']:
+                return ids
+            response = self.api.get(page['next'])
+
+    def test_walks_all_pages(self):
+        # Цены броней 1000, 1001, 1002; автобус без строки поиска идет как цена 0
+        buses = [bus.id for bus in Transport.objects.exclude(id=self.unindexed.id).order_by('id')]
+
+        self.assertEqual(self.walk('price'), [self.unindexed.id, *buses])
+        self.assertEqual(self.walk('-price'), [*reversed(buses), self.unindexed.id])
+        self.assertEqual(self.walk('n_seats'), [self.unindexed.id, *buses])
+
+
+@override_settings(RESPONSE_CACHE=True)
+class BusListCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.route, cls.client_user, cls.carrier_user = create_booking_data(buses=1)
+
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(CustomUser.objects.get(id=self.client_user.id))
+
+    def routes(self):
+        return [bus['route'] for bus in self.api.get(reverse('buses-list')).json()['data']]
+
+    def test_route_change_resets_cached_list(self):
+        self.assertEqual(self.routes(), [{'id_from': self.route.id_from_id, 'id_to': self.route.id_to_id}])
+        city = Cities.objects.create(name='Тверь', region='Тверская область')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.route.id_to = city
+            self.route.save()
+
+        self.assertEqual(self.routes(), [{'id_from': self.route.id_from_id, 'id_to': city.id}])
+
+
+class TransportPhotoTests(TestCase):
+    """
+    Фото автобуса в ответе - только URL файла в хранилище, без старой колонки photo.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        create_booking_data(buses=2)
+        cls.with_photo, cls.without_photo = Transport.objects.order_by('id')
+        Transport.objects.filter(id=cls.with_photo.id).update(photo_file='buses/bus.png', photo=b'blob')
+
+    def test_photo_url(self):
+        request = APIRequestFactory().get('/')
+        queryset = Transport.objects.order_by('id')
+        expected = ['http://testserver/media/buses/bus.png', None]
+
+        data = TransportSerializer(queryset, many=True, context={'request': request}).data
+        projected = TransportListSerializer(list(TransportListSerializer.project(queryset)), many=True,
+                                            context={'request': request}).data
+
+        self.assertEqual([bus['photo'] for bus in data], expected)
+        self.assertEqual([bus['photo'] for bus in projected], expected)
+
+
+class BusSearchBackfillTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.route, cls.client_user, cls.carrier_user = create_booking_data(buses=1)
+        # bulk_create не вызывает сигналы: строки BusSearch у автобуса нет
+        cls.bus = Transport.objects.bulk_create([
+            Transport(bus_nickname='Без поиска', brand='ПАЗ', model='3205', n_seats=10, wifi=True,
+                      id_route=cls.route),
+        ])[0]
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(CustomUser.objects.get(id=self.client_user.id))
+
+    def search(self, **params):
+        return [bus['id'] for bus in self.api.get(reverse('bus-search'), params).json()['data']]
+
+    def test_missing_rows_are_backfilled(self):
+        params = {'n_seats': 10, 'wifi': True, 'id_route__id_from': self.route.id_from_id}
+        self.assertEqual(self.search(**params), [])
+
+        call_command('rebuild_bus_search', '--missing', stdout=io.StringIO())
+
+        self.assertEqual(self.search(**params), [self.bus.id])
+        self.assertEqual(BusSearch.objects.count(), Transport.objects.count())
+
+
+class StaticCityIndex(CityPrefixIndex):
+    """
+    Индекс городов из списка вместо базы.
+    """
+
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = rows
+
+    def _load_rows(self):
+        return iter(self.rows)
+
+
+class CityPrefixIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = StaticCityIndex([
+            (1, 'Казань', 'Татарстан'),
+            (2, 'Калуга', 'Калужская область'),
+            (3, 'Орёл', 'Орловская область'),
+            (4, 'Москва', 'Москва'),
+            (5, 'Каменск-Уральский', 'Свердловская область'),
+        ])
+
+    def ids(self, prefix, limit=10):
+        return [city['id'] for city in self.index.search(prefix, limit)]
+
+    def test_prefix_in_name_order(self):
+        self.assertEqual(self.ids('Ка'), [1, 2, 5])
+        self.assertEqual(self.ids('Кал'), [2])
+        self.assertEqual(self.ids('Тверь'), [])
+
+    def test_case_and_yo_folding(self):
+        self.assertEqual(self.ids('  кАЗ '), [1])
+        self.assertEqual(self.ids('орел'), [3])
+        self.assertEqual(self.ids('ОРЁЛ'), [3])
+
+    def test_limit(self):
+        self.assertEqual(self.ids('ка', limit=2), [1, 2])
+
+    def test_returns_city_fields(self):
+        self.assertEqual(self.index.search('мос'), [{'id': 4, 'name': 'Москва', 'region': 'Москва'}])
+
+    def test_invalidate_reloads(self):
+        self.assertEqual(self.ids('Тв'), [])
+        self.index.rows = self.index.rows + [(6, 'Тверь', 'Тверская область')]
+        self.index.invalidate()
+        self.assertEqual(self.ids('Тв'), [6])
+
+
+class CitySearchApiViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cities = Cities.objects.bulk_create([
+            Cities(name=f'Каменка {i:02}', region='Пензенская область') for i in range(60)
+        ] + [Cities(name='Казань', region='Татарстан')])
+
+    def setUp(self):
+        city_index.invalidate()
+
+    def search(self, **params):
+        return self.client.get(reverse('city-search'), params)
+
+    def test_prefix_and_case_folding(self):
+        # limit заполнен префиксным поиском - до триграмм дело не доходит
+        response = self.search(q='КАЗ', limit=1)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([city['name'] for city in response.json()['data']], ['Казань'])
+
+    def test_limit(self):
+        self.assertEqual(len(self.search(q='ка', limit=3).json()['data']), 3)
+        self.assertEqual(len(self.search(q='ка').json()['data']), 10)
+        self.assertEqual(len(self.search(q='ка', limit=500).json()['data']), CitySearchApiView.max_limit)
+        self.assertEqual(len(self.search(q='ка', limit=0).json()['data']), 1)
+
+    def test_invalid_params(self):
+        self.assertEqual(self.search(q=' ').status_code, 400)
+        self.assertEqual(self.search(q='ка', limit='many').status_code, 400)
@@ -3,6 +3,7 @@ from rest_framework.routers import DefaultRouter
 from booking.views import (
     TransportViewSet,
     BusSearchApiView,
+    CitySearchApiView,
     BookingCreateApiView,
     BookingListClientApiView,
     BookingListCarrierApiView,
@@ -16,6 +17,7 @@ router.register(r'buses', TransportViewSet, basename='buses')
 
 urlpatterns = [
     path('search/', BusSearchApiView.as_view(), name='bus-search'),
+    path('cities/', CitySearchApiView.as_view(), name='city-search'),
     path('', BookingCreateApiView.as_view(), name='booking-create'),
     path('user/', BookingListClientApiView.as_view(), name='booking-list-client'),
     # Сделано bookings/carrier/ вместо bookings/company/ для ясности
@@ -1,9 +1,12 @@
 from datetime import datetime
 
+from django.db import IntegrityError, transaction
 from django.shortcuts import render, redirect
+from django.utils.timezone import is_naive, make_aware
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
+from django.contrib.postgres.search import TrigramSimilarity
 from rest_framework import viewsets, status, filters
 from rest_framework import permissions
 from rest_framework.decorators import action
@@ -12,14 +15,29 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from project.utils import StandardResponseMixin
+from project.pagination import KeysetPagination
+from project.projection import ProjectionListMixin
+from project.querybudget import QueryBudgetMixin
+from project.utils import StandardResponseMixin, CacheResponseMixin
+from .availability import bulk_availability, exclude_busy, is_busy
+from .cities import city_index
+from .exceptions import BookingConflict, is_booking_conflict
+from .filters import BusSearchFilter, BusSearchOrderingFilter
 from .serializers import *
 from database.models import *
+from notification.inbox import notify
 
 
-class TransportViewSet(StandardResponseMixin, viewsets.ModelViewSet):
-    queryset = Transport.objects.all()
+class TransportViewSet(StandardResponseMixin, QueryBudgetMixin, CacheResponseMixin, ProjectionListMixin,
+                       viewsets.ModelViewSet):
+    queryset = Transport.objects.defer('photo')
+    # Аутентификация (два запроса при промахе кэша) + автобусы с маршрутом одним запросом
+    query_budget = {'list': 3, 'retrieve': 4}
+    # Маршрут автобуса входит в ответ
+    cache_models = (Transport, Route, Cities)
+    name_prefix_cache = 'buses'
     serializer_class = TransportSerializer
+    projection_class = TransportListSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['n_seats', 'luggage', 'wifi', 'tv', 'toilet']
@@ -120,32 +138,72 @@ class TransportViewSet(StandardResponseMixin, viewsets.ModelViewSet):
         except ValueError:
             return Response({"error": "Invalid date format."}, status=status.HTTP_400_BAD_REQUEST)
 
+        if is_naive(start_date):
+            start_date = make_aware(start_date)
+        if is_naive(end_date):
+            end_date = make_aware(end_date)
+
         if start_date < now():
             return Response({"error": "Start date cannot be in the past."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Проверка доступности
-        is_available = not transport.schedule_set.filter(
-            trip_start__lt=end_date,
-            trip_end__gt=start_date
-        ).exists()
+        # Проверка доступности по рейсам и активным броням
+        is_available = not is_busy(transport.id, start_date, end_date)
 
         return Response({"is_available": is_available}, status=status.HTTP_200_OK)
 
+    @swagger_auto_schema(
+        tags=["[booking] бронь (в разработке)"],
+        operation_description="Проверка доступности нескольких автобусов в нескольких периодах одним запросом.",
+        request_body=BulkAvailabilitySerializer,
+        responses={
+            200: openapi.Response(
+                description="Матрица доступности: строки - автобусы, столбцы - периоды.",
+                examples={"application/json": {"bus_ids": [1, 2], "available": [[True, False], [True, True]]}}
+            ),
+            400: openapi.Response(
+                description="Некорректные периоды или несуществующие автобусы.",
+                examples={"application/json": {"bus_ids": ["Unknown transport ids: 3."]}}
+            ),
+        }
+    )
+    @action(detail=False, methods=['post'], url_path='availability')
+    def bulk_availability(self, request):
+        serializer = BulkAvailabilitySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        bus_ids = serializer.validated_data['bus_ids']
+        windows = [
+            (window['start_date'], window['end_date'])
+            for window in serializer.validated_data['windows']
+        ]
+
+        return Response({
+            "bus_ids": bus_ids,
+            "available": bulk_availability(bus_ids, windows),
+        }, status=status.HTTP_200_OK)
+
 
 class ScheduleApiView(APIView):
     pass
 
 
-class BusSearchApiView(StandardResponseMixin, ListAPIView):
+class BusSearchApiView(StandardResponseMixin, QueryBudgetMixin, CacheResponseMixin, ProjectionListMixin, ListAPIView):
     serializer_class = TransportSerializer
+    # Аутентификация, выдача и, при устаревшем индексе занятости, две выборки для его сборки
+    query_budget = 5
+    projection_class = BusSearchListSerializer
+    cache_models = (Transport, Schedule, Order, BusSearch)
+    name_prefix_cache = 'bus_search'
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
-    filterset_fields = ['n_seats', 'order__price', 'id_route__id_from', 'id_route__id_to', 'luggage', 'wifi', 'tv',
-                        'toilet']
-    ordering_fields = ['price', 'n_seats']  # Потом добавить 'rating'
+    pagination_class = KeysetPagination
+    cursor_ordering = ('id',)
+    filter_backends = [DjangoFilterBackend, BusSearchOrderingFilter]
+    filterset_class = BusSearchFilter
+    ordering_fields = ['price', 'n_seats', 'rating']
 
     def get_queryset(self):
-        queryset = Transport.objects.all().select_related('route')
+        # Фильтры и сортировка идут по BusSearch (одна строка на автобус), без join через Route и Order
+        queryset = Transport.objects.all()
 
         start_date = self.request.query_params.get('start_date')
         end_date = self.request.query_params.get('end_date')
@@ -156,11 +214,7 @@ class BusSearchApiView(StandardResponseMixin, ListAPIView):
             except ValueError:
                 return queryset.none()
 
-            unavailable_transports = Schedule.objects.filter(
-                trip_start__lt=end_date,
-                trip_end__gt=start_date
-            ).values_list('bus_id', flat=True)
-            queryset = queryset.exclude(id__in=unavailable_transports)
+            queryset = exclude_busy(queryset, start_date, end_date)
 
         return queryset
 
@@ -188,6 +242,47 @@ class BusSearchApiView(StandardResponseMixin, ListAPIView):
         return super().get(request, *args, **kwargs)
 
 
+class CitySearchApiView(StandardResponseMixin, APIView):
+    permission_classes = [permissions.AllowAny]
+    max_limit = 50
+
+    @swagger_auto_schema(
+        tags=["[booking] города"],
+        operation_description="Автодополнение названия города. Сначала поиск по префиксу в памяти, "
+                              "затем нечеткий поиск по триграммам.",
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, description="Начало названия города",
+                              type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('limit', openapi.IN_QUERY, description="Количество результатов (до 50)",
+                              type=openapi.TYPE_INTEGER, required=False),
+        ],
+    )
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"error": "Query parameter q is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), self.max_limit))
+        except ValueError:
+            return Response({"error": "Invalid limit."}, status=status.HTTP_400_BAD_REQUEST)
+
+        cities = city_index.search(query, limit)
+
+        # Опечатки и совпадения не с начала названия добираем по триграммному индексу
+        if len(cities) < limit and len(query) >= 3:
+            found = [city['id'] for city in cities]
+            cities += list(
+                Cities.objects.filter(name__trigram_similar=query)
+                .exclude(id__in=found)
+                .annotate(similarity=TrigramSimilarity('name', query))
+                .order_by('-similarity')
+                .values('id', 'name', 'region')[:limit - len(cities)]
+            )
+
+        return Response(cities, status=status.HTTP_200_OK)
+
+
 class BookingCreateApiView(StandardResponseMixin, CreateAPIView):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
@@ -196,7 +291,22 @@ class BookingCreateApiView(StandardResponseMixin, CreateAPIView):
     def perform_create(self, serializer):
         if not hasattr(self.request.user, 'client'):
             raise ValueError("User must have an associated client.")
-        serializer.save(id_client=self.request.user.client)
+
+        # Пересечения броней проверяет ограничение в базе, без отдельного запроса
+        try:
+            with transaction.atomic():
+                order = serializer.save(id_client=self.request.user.client)
+                # Перевозчик уже загружен сериализатором, user_id берется без запроса
+                notify([
+                    Notification(booking=order, user=self.request.user, type='status',
+                                 message=f"Бронь №{order.id} создана и ожидает подтверждения."),
+                    Notification(booking=order, user_id=order.id_carrier.user_id, type='status',
+                                 message=f"Новая бронь №{order.id}."),
+                ])
+        except IntegrityError as exc:
+            if is_booking_conflict(exc):
+                raise BookingConflict()
+            raise
 
     @swagger_auto_schema(
         tags=["[booking] бронь (в разработке)"],
@@ -206,16 +316,18 @@ class BookingCreateApiView(StandardResponseMixin, CreateAPIView):
         return super().post(request, *args, **kwargs)
 
 
-class BookingListClientApiView(StandardResponseMixin, ListAPIView):
+class BookingListClientApiView(StandardResponseMixin, QueryBudgetMixin, ProjectionListMixin, ListAPIView):
     serializer_class = OrderSerializer
+    # Аутентификация (id клиента приходит вместе с пользователем) и страница броней
+    query_budget = 3
+    projection_class = OrderListSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-create_time', '-id')
 
     def get_queryset(self):
-        return (
-            Order.objects.filter(id_client=self.request.user.client)
-            .select_related('id_transport', 'id_route', 'id_carrier')  # Оптимизация связанных объектов
-            .prefetch_related('id_transport__schedule')  # Предварительная выборка расписаний
-        )
+        # Автобус и маршрут присоединяет проекция OrderListSerializer
+        return Order.objects.filter(id_client=self.request.user.client)
 
     @swagger_auto_schema(
         tags=["[booking] бронь (в разработке)"],
@@ -225,16 +337,16 @@ class BookingListClientApiView(StandardResponseMixin, ListAPIView):
         return super().get(request, *args, **kwargs)
 
 
-class BookingListCarrierApiView(StandardResponseMixin, ListAPIView):
+class BookingListCarrierApiView(StandardResponseMixin, QueryBudgetMixin, ProjectionListMixin, ListAPIView):
     serializer_class = OrderSerializer
+    query_budget = 3
+    projection_class = OrderListSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-create_time', '-id')
 
     def get_queryset(self):
-        return (
-            Order.objects.filter(id_carrier=self.request.user.carrier)
-            .select_related('id_transport', 'id_route', 'id_client')
-            .prefetch_related('id_transport__schedule')
-        )
+        return Order.objects.filter(id_carrier=self.request.user.carrier)
 
     @swagger_auto_schema(
         tags=["[booking] бронь (в разработке)"],
@@ -244,10 +356,11 @@ class BookingListCarrierApiView(StandardResponseMixin, ListAPIView):
         return super().get(request, *args, **kwargs)
 
 
-class BookingDetailApiView(StandardResponseMixin, RetrieveAPIView):
-    queryset = Order.objects.all()
+class BookingDetailApiView(StandardResponseMixin, QueryBudgetMixin, RetrieveAPIView):
+    queryset = Order.objects.select_related('id_transport__id_route', 'id_route').defer('id_transport__photo')
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    query_budget = 3
 
     @swagger_auto_schema(
         tags=["[booking] бронь (в разработке)"],
@@ -262,6 +375,15 @@ class BookingUpdateApiView(StandardResponseMixin, UpdateAPIView):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
 
+    def perform_update(self, serializer):
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except IntegrityError as exc:
+            if is_booking_conflict(exc):
+                raise BookingConflict()
+            raise
+
     @swagger_auto_schema(
         tags=["[booking] бронь (в разработке)"],
         operation_description="Обновить бронь по айди.",
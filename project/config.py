@@ -12,6 +12,8 @@ DB_NAME = os.getenv('DB_NAME')
 
 DJ_SCRT_KEY = os.getenv('DJ_SCRT_KEY')
 
+REDIS_URL = os.getenv('REDIS_URL')
+
 FROM_EMAIL_USER = os.getenv('FROM_EMAIL_USER')
 FROM_EMAIL_PASSWORD = os.getenv('FROM_EMAIL_PASSWORD')
 FROM_DEFAULT_EMAIL = os.getenv('FROM_DEFAULT_EMAIL')
@@ -24,4 +26,7 @@ YANDEX_SECRET = os.getenv('YANDEX_SECRET')
 
 AWS_KEY_ID = os.getenv('AWS_KEY_ID')
 AWS_SECRET_KEY = os.getenv('AWS_SECRET_KEY')
-AWS_BUCKET_NAME = os.getenv('AWS_BUCKET_NAME')
\ No newline at end of file
+AWS_BUCKET_NAME = os.getenv('AWS_BUCKET_NAME')
+
+# Хранить загруженные файлы локально вместо S3 (тесты и разработка)
+USE_LOCAL_STORAGE = os.getenv('USE_LOCAL_STORAGE', '').lower() in ('1', 'true', 'yes')
\ No newline at end of file
@@ -21,7 +21,6 @@ class Command(BaseCommand):
                 year_issued=2019,
                 n_deck=53,
                 n_seats=55,
-                photo=b'',
                 luggage=True,
                 wifi=True,
                 tv=True,
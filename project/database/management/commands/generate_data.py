@@ -0,0 +1,286 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
+from django.utils.timezone import now
+
+from booking.availability import availability_index
+from booking.search import refresh_bus_search
+from database.models import (
+    CustomUser, Client, Carrier, Cities, Route, Transport, Schedule, Order, Mailing, Subscription, LEGAL_TYPE,
+)
+
+FIRST_NAMES = ['Иван', 'Петр', 'Анна', 'Мария', 'Сергей', 'Ольга', 'Алексей', 'Елена', 'Дмитрий', 'Наталья']
+LAST_NAMES = ['Иванов', 'Петров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев', 'Козлов', 'Новиков']
+BUSES = [
+    ('Temsa', 'Maraton 13 VIP'), ('Mercedes-Benz', 'Tourismo'), ('Setra', 'S 515 HD'), ('Yutong', 'ZK6122H9'),
+    ('Higer', 'KLQ6128LQ'), ('ПАЗ', 'Вектор Next'), ('Golden Dragon', 'XML6127'), ('MAN', 'Lion\'s Coach'),
+]
+LEGAL_TYPES = [code for code, _ in LEGAL_TYPE if code]
+
+
+class Command(BaseCommand):
+    help = 'Генерация большого объема тестовых данных для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--clients', type=int, default=10000)
+        parser.add_argument('--carriers', type=int, default=500)
+        parser.add_argument('--routes', type=int, default=300)
+        parser.add_argument('--buses', type=int, default=2000)
+        parser.add_argument('--schedules-per-bus', type=int, default=20)
+        parser.add_argument('--orders-per-bus', type=int, default=50)
+        parser.add_argument('--mailings', type=int, default=20)
+        parser.add_argument('--subscription-rate', type=float, default=0.3,
+                            help="Доля пользователей, подписанных на каждую рассылку")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--password', default='password123', help="Общий пароль всех пользователей")
+        parser.add_argument('--email-prefix', default='load', help="Префикс email, чтобы запуски не пересекались")
+
+    def handle(self, *args, **kwargs):
+        self.rnd = random.Random(kwargs['seed'])
+        self.batch_size = kwargs['batch_size']
+        self.started = time.perf_counter()
+
+        city_ids = list(Cities.objects.values_list('id', flat=True))
+        if len(city_ids) < 2:
+            raise CommandError('Сначала загрузите города командой load_cities.')
+
+        groups = {}
+        for name in ('client', 'carrier'):
+            groups[name], _ = Group.objects.get_or_create(name=name)
+
+        # Хэш пароля считается один раз: PBKDF2 на каждого пользователя занял бы часы
+        password_hash = make_password(kwargs['password'])
+        prefix = f"{kwargs['email_prefix']}.{kwargs['seed']}"
+
+        client_ids, client_user_ids = self.create_clients(kwargs['clients'], prefix, password_hash, groups['client'])
+        carrier_ids, _ = self.create_carriers(kwargs['carriers'], prefix, password_hash, groups['carrier'])
+        route_ids, route_weights = self.create_routes(kwargs['routes'], city_ids)
+        bus_routes = self.create_buses(kwargs['buses'], route_ids, route_weights)
+        self.create_trips(bus_routes, client_ids, carrier_ids, kwargs['schedules_per_bus'], kwargs['orders_per_bus'])
+        self.create_mailings(kwargs['mailings'], client_user_ids, kwargs['subscription_rate'])
+
+        self.log('Пересборка таблицы поиска')
+        refresh_bus_search(batch_size=self.batch_size)
+        availability_index.invalidate()
+
+        self.stdout.write(self.style.SUCCESS(f'Данные созданы за {time.perf_counter() - self.started:.1f} с.'))
+
+    def log(self, message):
+        self.stdout.write(f'[{time.perf_counter() - self.started:7.1f} с] {message}')
+
+    def bulk(self, model, objects, keep=True):
+        """
+        Вставляет объекты пакетами, каждый пакет в своей транзакции.
+
+        :param keep: вернуть id созданных строк; для таблиц, на которые никто не ссылается, - False
+        """
+        created = []
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                with transaction.atomic():
+                    model.objects.bulk_create(batch)
+                if keep:
+                    created.extend(obj.pk for obj in batch)
+                batch = []
+        if batch:
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            if keep:
+                created.extend(obj.pk for obj in batch)
+        return created
+
+    def zipf_weights(self, n, s=1.1):
+        # Популярность маршрутов и рейтингов распределена неравномерно: немного популярных, длинный хвост
+        return list(accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+    def create_users(self, count, kind, prefix, password_hash, group):
+        rnd = self.rnd
+        user_ids = self.bulk(CustomUser, (
+            CustomUser(
+                email=f'{prefix}.{kind}{i}@example.com',
+                password=password_hash,
+                first_name=rnd.choice(FIRST_NAMES),
+                last_name=rnd.choice(LAST_NAMES),
+                is_active=True,
+            )
+            for i in range(count)
+        ))
+
+        through = CustomUser.groups.through
+        self.bulk(through, (through(customuser_id=user_id, group_id=group.id) for user_id in user_ids), keep=False)
+        return user_ids
+
+    def create_clients(self, count, prefix, password_hash, group):
+        self.log(f'Клиенты: {count}')
+        rnd = self.rnd
+        user_ids = self.create_users(count, 'client', prefix, password_hash, group)
+
+        def build(user_id):
+            if rnd.random() < 0.8:
+                return Client(user_id=user_id, client_type='IND', phone_number=f'9{rnd.randint(0, 10 ** 9):09d}')
+            return Client(
+                user_id=user_id,
+                client_type='LEG',
+                legal_type=rnd.choice(LEGAL_TYPES),
+                company_name=f'ООО Клиент {user_id}',
+                inn=f'{rnd.randint(0, 10 ** 10):010d}',
+                kpp=f'{rnd.randint(0, 10 ** 9):09d}',
+                phone_number=f'9{rnd.randint(0, 10 ** 9):09d}',
+            )
+
+        return self.bulk(Client, (build(user_id) for user_id in user_ids)), user_ids
+
+    def create_carriers(self, count, prefix, password_hash, group):
+        self.log(f'Транспортные компании: {count}')
+        rnd = self.rnd
+        user_ids = self.create_users(count, 'carrier', prefix, password_hash, group)
+        carrier_ids = self.bulk(Carrier, (
+            Carrier(
+                user_id=user_id,
+                carrier_type=rnd.choice(LEGAL_TYPES),
+                company_name=f'ТК {user_id}',
+                inn=f'{rnd.randint(0, 10 ** 10):010d}',
+                kpp=f'{rnd.randint(0, 10 ** 9):09d}',
+                phone_number=f'9{rnd.randint(0, 10 ** 9):09d}',
+                rating=min(5, max(0, round(rnd.gauss(4, 1)))),
+            )
+            for user_id in user_ids
+        ))
+        return carrier_ids, user_ids
+
+    def create_routes(self, count, city_ids):
+        self.log(f'Маршруты: {count}')
+        rnd = self.rnd
+        # Большая часть маршрутов начинается в небольшом числе крупных городов
+        hubs = rnd.sample(city_ids, min(len(city_ids), max(2, count // 10)))
+        routes = []
+        for _ in range(count):
+            id_from = rnd.choice(hubs) if rnd.random() < 0.7 else rnd.choice(city_ids)
+            id_to = rnd.choice(city_ids)
+            while id_to == id_from:
+                id_to = rnd.choice(city_ids)
+            routes.append(Route(id_from_id=id_from, id_to_id=id_to))
+        route_ids = self.bulk(Route, routes)
+        return route_ids, self.zipf_weights(len(route_ids))
+
+    def create_buses(self, count, route_ids, route_weights):
+        self.log(f'Автобусы: {count}')
+        rnd = self.rnd
+
+        bus_route_ids = rnd.choices(route_ids, cum_weights=route_weights, k=count)
+
+        def build(i):
+            brand, model = rnd.choice(BUSES)
+            n_seats = min(60, max(16, round(rnd.gauss(45, 10))))
+            return Transport(
+                bus_nickname=f'{brand} #{i}',
+                brand=brand,
+                model=model,
+                year_issued=rnd.randint(2005, 2024),
+                n_deck=2 if n_seats > 55 and rnd.random() < 0.5 else 1,
+                n_seats=n_seats,
+                luggage=rnd.random() < 0.9,
+                wifi=rnd.random() < 0.6,
+                tv=rnd.random() < 0.4,
+                toilet=n_seats > 40 and rnd.random() < 0.7,
+                rating=min(5, max(0, round(rnd.gauss(4, 1)))),
+                id_route_id=bus_route_ids[i],
+            )
+
+        bus_ids = self.bulk(Transport, (build(i) for i in range(count)))
+        return list(zip(bus_ids, bus_route_ids))
+
+    def create_trips(self, bus_routes, client_ids, carrier_ids, schedules_per_bus, orders_per_bus):
+        self.log(f'Рейсы: {len(bus_routes) * schedules_per_bus}, брони: {len(bus_routes) * orders_per_bus}')
+        rnd = self.rnd
+        current = now()
+
+        def timeline():
+            """
+            Для каждого автобуса идет по времени от полугода назад и выдает
+            непересекающиеся рейсы и брони вперемешку.
+            """
+            for bus_index, (bus_id, route_id) in enumerate(bus_routes):
+                carrier_id = carrier_ids[bus_index % len(carrier_ids)]
+                kinds = ['schedule'] * schedules_per_bus + ['order'] * orders_per_bus
+                rnd.shuffle(kinds)
+                moment = current - timedelta(days=180)
+                for kind in kinds:
+                    moment += timedelta(hours=rnd.expovariate(1 / 36))
+                    start = moment
+                    moment += timedelta(hours=rnd.uniform(2, 14))
+                    if kind == 'schedule':
+                        yield Schedule(bus_id_id=bus_id, trip_start=start, trip_end=moment)
+                        continue
+
+                    if start < current:
+                        status = 'completed' if rnd.random() < 0.9 else 'canceled'
+                    else:
+                        status = rnd.choices(['pending', 'confirmed', 'canceled'], weights=[3, 6, 1])[0]
+                    yield Order(
+                        status=status,
+                        time_range=DateTimeTZRange(start, moment),
+                        passenger_type=rnd.choices(['children', 'adults', 'mixed', 'corporate'],
+                                                   weights=[1, 4, 3, 2])[0],
+                        price=Decimal(round(rnd.lognormvariate(10, 0.5), -2)),
+                        notification_sent=start < current,
+                        id_client_id=rnd.choice(client_ids),
+                        id_transport_id=bus_id,
+                        id_route_id=route_id,
+                        id_carrier_id=carrier_id,
+                    )
+
+        schedules, orders = [], []
+        for item in timeline():
+            target = schedules if isinstance(item, Schedule) else orders
+            target.append(item)
+            if len(target) >= self.batch_size:
+                with transaction.atomic():
+                    type(item).objects.bulk_create(target)
+                target.clear()
+        for model, rows in ((Schedule, schedules), (Order, orders)):
+            if rows:
+                with transaction.atomic():
+                    model.objects.bulk_create(rows)
+
+    def create_mailings(self, count, user_ids, rate):
+        if not count:
+            return
+        self.log(f'Рассылки: {count}')
+        rnd = self.rnd
+        mailing_types = ['notification', 'promotion', 'reminder']
+        current = now()
+
+        def build(i):
+            send_time = current + timedelta(days=rnd.randint(-30, 30))
+            # Прошедшие рассылки уже разосланы, иначе диспетчер разослал бы их все при первом запуске
+            sent = send_time <= current
+            return Mailing(
+                subject=f'Рассылка {i}',
+                body='Текст рассылки',
+                send_time=send_time,
+                mailing_type=rnd.choice(mailing_types),
+                is_sent=sent,
+                dispatched_at=send_time if sent else None,
+            )
+
+        mailing_ids = self.bulk(Mailing, (build(i) for i in range(count)))
+
+        self.log(f'Подписки: ~{int(count * len(user_ids) * rate)}')
+        self.bulk(Subscription, (
+            Subscription(user_id=user_id, mailing_id=mailing_id, subscribed=rnd.random() < 0.95)
+            for mailing_id in mailing_ids
+            for user_id in user_ids
+            if rnd.random() < rate
+        ), keep=False)
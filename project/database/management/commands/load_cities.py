@@ -1,18 +1,205 @@
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from booking.cities import city_index
 from database.models import Cities
 
 
+# Ошибки обрезанного элемента приходятся на последние символы буфера (или это незакрытая строка);
+# ошибка дальше от конца - синтаксическая, и дочитывать файл бесполезно
+TRUNCATED_TAIL = 8
+
+
+def _may_be_truncated(exc, buffer):
+    return exc.msg.startswith('Unterminated string') or len(buffer) - exc.pos <= TRUNCATED_TAIL
+
+
+def iter_json_array(file, chunk_size=64 * 1024):
+    """
+    Поэлементно разбирает JSON-массив верхнего уровня, не загружая файл целиком.
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size)
+    pos = 0
+    eof = not buffer
+    started = False
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n' + (',' if started else ''):
+            pos += 1
+
+        if pos >= len(buffer):
+            if eof:
+                raise json.JSONDecodeError("Unexpected end of file", buffer, pos)
+            chunk = file.read(chunk_size)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+
+        if not started:
+            if buffer[pos] != '[':
+                raise json.JSONDecodeError("Expecting '['", buffer, pos)
+            started = True
+            pos += 1
+            continue
+
+        if buffer[pos] == ']':
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+            # Число в конце буфера могло продолжиться в следующем куске
+            truncated = end == len(buffer) and not eof and type(item) in (int, float)
+        except json.JSONDecodeError as exc:
+            if eof or not _may_be_truncated(exc, buffer):
+                raise
+            truncated = True
+
+        if truncated:
+            # Элемент разрезан границей куска - дочитываем файл. Дочитываем не меньше, чем уже
+            # накоплено, чтобы длинный элемент разбирался заново лишь логарифмическое число раз
+            chunk = file.read(max(chunk_size, len(buffer) - pos))
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+
+        pos = end
+        yield item
+
+
 class Command(BaseCommand):
     help = 'Загрузка городов из файла JSON'
 
     def add_arguments(self, parser):
         parser.add_argument('file_path', type=str, help="Путь к файлу JSON")
+        parser.add_argument('--stream', action='store_true',
+                            help="Потоковый разбор файла и пакетная вставка вместо построчной")
+        parser.add_argument('--copy', action='store_true',
+                            help="Загрузка через COPY во временную таблицу (вместе с --stream)")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Размер пакета вставки")
+        parser.add_argument('--progress-every', type=int, default=10000, help="Как часто выводить прогресс (строк)")
+        parser.add_argument('--workers', type=int, default=1, help="Параллельные пакеты (кроме режима --copy)")
+
+    def iter_cities(self, file):
+        # Дубликаты внутри файла отсекаем здесь, с уже существующими в базе разбирается ON CONFLICT
+        seen = set()
+        for item in iter_json_array(file):
+            city_name = item.get("Город") if isinstance(item, dict) else None
+            region_name = item.get("Регион") if isinstance(item, dict) else None
+
+            if not city_name or not region_name:
+                self.stdout.write(self.style.WARNING(f"Пропуск недопустимого элемента: {item}"))
+                continue
+
+            key = (city_name, region_name)
+            if key in seen:
+                continue
+            seen.add(key)
+            yield key
+
+    def report(self, processed, started):
+        rate = processed / max(time.perf_counter() - started, 1e-9)
+        self.stdout.write(f"Обработано городов: {processed} ({rate:.0f} в секунду)")
+
+    @staticmethod
+    def insert_batch(batch, close_connection=False):
+        try:
+            Cities.objects.bulk_create(
+                [Cities(name=name, region=region) for name, region in batch],
+                ignore_conflicts=True,
+            )
+        finally:
+            if close_connection:
+                connection.close()
+        return len(batch)
+
+    def load_bulk(self, cities, batch_size, progress_every, workers):
+        processed = 0
+        reported = 0
+        started = time.perf_counter()
+        batch = []
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+
+            def flush(rows):
+                nonlocal pending
+                if workers == 1:
+                    self.insert_batch(rows)
+                    return
+                # Не держим в очереди больше двух пакетов на поток
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(self.insert_batch, rows, True))
+
+            for city in cities:
+                batch.append(city)
+                if len(batch) >= batch_size:
+                    flush(batch)
+                    processed += len(batch)
+                    batch = []
+                    if processed - reported >= progress_every:
+                        self.report(processed, started)
+                        reported = processed
+
+            if batch:
+                flush(batch)
+                processed += len(batch)
+
+            for future in pending:
+                future.result()
+
+        return processed
+
+    def load_copy(self, cities, progress_every):
+        table = Cities._meta.db_table
+        processed = 0
+        started = time.perf_counter()
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMP TABLE tmp_cities (name varchar(255), region varchar(255)) ON COMMIT DROP"
+            )
+            with cursor.copy("COPY tmp_cities (name, region) FROM STDIN") as copy:
+                for city in cities:
+                    copy.write_row(city)
+                    processed += 1
+                    if processed % progress_every == 0:
+                        self.report(processed, started)
+            cursor.execute(
+                f"INSERT INTO {table} (name, region) SELECT name, region FROM tmp_cities "
+                f"ON CONFLICT (name, region) DO NOTHING"
+            )
+        return processed
+
+    def load_stream(self, file_path, **kwargs):
+        started = time.perf_counter()
+        with open(file_path, 'r', encoding='utf-8') as file:
+            cities = self.iter_cities(file)
+            if kwargs['copy']:
+                processed = self.load_copy(cities, kwargs['progress_every'])
+            else:
+                processed = self.load_bulk(
+                    cities, kwargs['batch_size'], kwargs['progress_every'], max(1, kwargs['workers'])
+                )
+
+        city_index.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f"Загружено городов: {processed} за {time.perf_counter() - started:.1f} с."
+        ))
 
     def handle(self, *args, **kwargs):
         file_path = kwargs['file_path']
 
         try:
+            if kwargs['stream']:
+                self.load_stream(file_path, **kwargs)
+                return
+
             # Открытие JSON-файла
             with open(file_path, 'r', encoding='utf-8') as file:
                 data = json.load(file)
@@ -31,9 +218,11 @@ class Command(BaseCommand):
                     self.stdout.write(self.style.WARNING(f"Пропуск недопустимого элемента: {item}"))
                     continue
 
-                Cities.objects.create(name=city_name, region=region_name)
-                self.stdout.write(self.style.SUCCESS(f"Добавлен город: {city_name}, регион: {region_name}"))
+                _, created = Cities.objects.get_or_create(name=city_name, region=region_name)
+                if created:
+                    self.stdout.write(self.style.SUCCESS(f"Добавлен город: {city_name}, регион: {region_name}"))
 
+            city_index.invalidate()
             self.stdout.write(self.style.SUCCESS("Все города были успешно загружены."))
 
         except FileNotFoundError:
@@ -41,4 +230,4 @@ class Command(BaseCommand):
         except json.JSONDecodeError:
             self.stdout.write(self.style.ERROR("Неверный формат файла JSON"))
         except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Произошла ошибка: {e}"))
\ No newline at end of file
+            self.stdout.write(self.style.ERROR(f"Произошла ошибка: {e}"))
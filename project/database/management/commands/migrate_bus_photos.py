@@ -0,0 +1,76 @@
+import tempfile
+
+from PIL import Image, UnidentifiedImageError
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models.functions import Length
+
+from database.models import Transport
+from project.cache import bump_generation
+
+
+class Command(BaseCommand):
+    help = 'Перенос фотографий автобусов из колонки photo в файловое хранилище (photo_file)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1024 * 1024, help="Размер читаемого куска в байтах")
+        parser.add_argument('--keep-blobs', action='store_true', help="Не очищать photo после переноса")
+
+    def read_blob(self, transport_id, length, chunk_size, target):
+        """
+        Читает photo кусками через substring, не загружая его в память целиком.
+        """
+        column = Transport._meta.get_field('photo').column
+        sql = f'SELECT substring({column} FROM %s FOR %s) FROM {Transport._meta.db_table} WHERE id = %s'
+
+        with connection.cursor() as cursor:
+            for offset in range(1, length + 1, chunk_size):
+                cursor.execute(sql, [offset, chunk_size, transport_id])
+                target.write(bytes(cursor.fetchone()[0]))
+        target.seek(0)
+
+    @staticmethod
+    def detect_extension(file):
+        try:
+            with Image.open(file) as image:
+                extension = (image.format or 'bin').lower()
+        except UnidentifiedImageError:
+            extension = 'bin'
+        file.seek(0)
+        return 'jpg' if extension == 'jpeg' else extension
+
+    def handle(self, *args, **kwargs):
+        chunk_size = kwargs['chunk_size']
+
+        pending = (
+            Transport.objects
+            .filter(photo__isnull=False)
+            .annotate(blob_length=Length('photo'))
+            .filter(blob_length__gt=0)
+            .values_list('id', 'blob_length')
+            .order_by('id')
+        )
+
+        moved = 0
+        for transport_id, length in pending.iterator(chunk_size=500):
+            with tempfile.SpooledTemporaryFile(max_size=chunk_size) as buffer:
+                self.read_blob(transport_id, length, chunk_size, buffer)
+                extension = self.detect_extension(buffer)
+
+                transport = Transport.objects.only('id', 'photo_file').get(id=transport_id)
+                transport.photo_file.save(f'bus_{transport_id}.{extension}', File(buffer), save=False)
+
+            update = {'photo_file': transport.photo_file.name}
+            if not kwargs['keep_blobs']:
+                update['photo'] = None
+            Transport.objects.filter(id=transport_id).update(**update)
+
+            moved += 1
+            self.stdout.write(f"Автобус {transport_id}: {length} байт -> {transport.photo_file.name}")
+
+        if moved:
+            # update() не отправляет сигналы: кэш ответов с автобусами сбрасывается явно
+            bump_generation(Transport)
+
+        self.stdout.write(self.style.SUCCESS(f"Перенесено фотографий: {moved}."))
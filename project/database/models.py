@@ -1,6 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.contrib.postgres.fields import DateTimeRangeField
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeOperators
+from django.contrib.postgres.fields.ranges import RangeStartsWith
+from django.contrib.postgres.indexes import GinIndex, GistIndex
 from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin
 from django.utils.translation import gettext_lazy as _
@@ -119,10 +122,19 @@ class Cities(models.Model):
     name = models.CharField(max_length=255)
     region = models.CharField(max_length=255)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'region'], name='cities_name_region_unique'),
+        ]
+        indexes = [
+            GinIndex(fields=['name'], name='cities_name_trgm', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['region'], name='cities_region_trgm', opclasses=['gin_trgm_ops']),
+        ]
+
 
 class Route(models.Model):
-    id_from = models.OneToOneField(Cities, on_delete=models.CASCADE, related_name='routes_from')
-    id_to = models.OneToOneField(Cities, on_delete=models.CASCADE, related_name='routes_to')
+    id_from = models.ForeignKey(Cities, on_delete=models.CASCADE, related_name='routes_from')
+    id_to = models.ForeignKey(Cities, on_delete=models.CASCADE, related_name='routes_to')
 
 
 class ExtraService(models.Model):
@@ -154,7 +166,9 @@ class Transport(models.Model):
     year_issued = models.IntegerField(default=0)
     n_deck = models.IntegerField(default=0)
     n_seats = models.IntegerField(default=0)
-    photo = models.BinaryField(editable=False)
+    # Старое хранение фото в строке, переносится в photo_file командой migrate_bus_photos
+    photo = models.BinaryField(editable=False, blank=True, null=True)
+    photo_file = models.ImageField(upload_to='buses/', blank=True, null=True)
     luggage = models.BooleanField(default=False)
     wifi = models.BooleanField(default=False)
     tv = models.BooleanField(default=False)
@@ -167,10 +181,62 @@ class Transport(models.Model):
     # тут будет функция по подсчёту среднего рейтинга из всех заказов на этот автобус.
 
 
+# Биты удобств автобуса в BusSearch.amenities
+AMENITY_FLAGS = {
+    'luggage': 1,
+    'wifi': 2,
+    'tv': 4,
+    'toilet': 8,
+}
+
+
+class BusSearch(models.Model):
+    # Денормализованная строка поиска, по одной на автобус. Обновляется сигналами booking.
+    transport = models.OneToOneField(Transport, on_delete=models.CASCADE, primary_key=True, related_name='search')
+    from_city_id = models.BigIntegerField()
+    to_city_id = models.BigIntegerField()
+    from_city_name = models.CharField(max_length=255)
+    to_city_name = models.CharField(max_length=255)
+    amenities = models.SmallIntegerField(default=0)
+    n_seats = models.IntegerField(default=0)
+    rating = models.IntegerField(default=0)
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['from_city_id', 'to_city_id', 'n_seats'], name='bus_search_route_seats_idx'),
+            models.Index(fields=['from_city_id', 'to_city_id', 'min_price'], name='bus_search_route_price_idx'),
+            models.Index(fields=['from_city_id', 'to_city_id', 'rating'], name='bus_search_route_rating_idx'),
+        ]
+
+
+class TsTzRange(models.Func):
+    function = 'TSTZRANGE'
+    output_field = DateTimeRangeField()
+
+
 class Schedule(models.Model):
     bus_id = models.ForeignKey(Transport, on_delete=models.CASCADE)
     trip_start = models.DateTimeField()
     trip_end = models.DateTimeField()
+    # Диапазон рейса для GiST-индекса, поддерживается самой базой
+    trip_range = models.GeneratedField(
+        expression=TsTzRange('trip_start', 'trip_end'),
+        output_field=DateTimeRangeField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            GistIndex(fields=['trip_range'], name='schedule_trip_range_gist'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Автобус на момент загрузки: при переносе рейса сбрасываются интервалы обоих автобусов
+        instance._loaded_bus_id = instance.__dict__.get('bus_id_id')
+        return instance
 
 
 class Order(models.Model):
@@ -195,19 +261,41 @@ class Order(models.Model):
     id_client = models.ForeignKey(Client, on_delete=models.CASCADE)
     id_transport = models.ForeignKey(Transport, on_delete=models.CASCADE)
     id_route = models.ForeignKey(Route, on_delete=models.CASCADE)
-    id_carrier = models.OneToOneField(Carrier, on_delete=models.CASCADE)
+    id_carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            # Один автобус не может иметь пересекающиеся активные брони. GiST-индекс ограничения
+            # по (id_transport, time_range) обслуживает и поиск пересечений активных броней
+            ExclusionConstraint(
+                name='order_no_double_booking',
+                expressions=[
+                    ('id_transport', RangeOperators.EQUAL),
+                    ('time_range', RangeOperators.OVERLAPS),
+                ],
+                condition=models.Q(status__in=['pending', 'confirmed']),
+            ),
+        ]
+        indexes = [
+            # Курсорная пагинация списков броней клиента и перевозчика (-create_time, -id)
+            models.Index(fields=['id_client', '-create_time', '-id'], name='order_client_created_idx'),
+            models.Index(fields=['id_carrier', '-create_time', '-id'], name='order_carrier_created_idx'),
+            # Поиск броней для напоминаний: начало поездки среди еще не уведомленных
+            models.Index(RangeStartsWith('time_range'), condition=models.Q(notification_sent=False),
+                         name='order_reminder_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Статус на момент загрузки: по нему сигналы узнают, что статус изменился
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_transport_id = instance.__dict__.get('id_transport_id')
+        return instance
 
     def __str__(self):
         return f"Order {self.pk} - {self.status}"
 
-    def is_conflicting(self):
-        conflicting = Order.objects.filter(
-            id_transport=self.id_transport,
-            time_range__overlap=self.time_range,
-            status__in=['pending', 'confirmed']
-        ).exclude(id=self.id)
-        return conflicting.exists()
-
 
 class Comment(models.Model):
     text = models.TextField()
@@ -220,22 +308,40 @@ class Comment(models.Model):
     id_carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE)
 
 
+MAILING_TEMPLATE_HELP = (
+    "Шаблон Django: {{ first_name }}, {{ last_name }} и {{ email }} заменяются данными получателя. "
+    "Чтобы вывести {{ или {% как есть, оберните текст в {% verbatim %}...{% endverbatim %}."
+)
+
+
 class Mailing(models.Model):
     id = models.AutoField(primary_key=True)
-    subject = models.CharField(max_length=255)
-    body = models.TextField()
+    # Тексты - шаблоны Django (notification.rendering): {{ ... }} и {% ... %} в них не выводятся как есть
+    subject = models.CharField(max_length=255, help_text=MAILING_TEMPLATE_HELP)
+    body = models.TextField(help_text=MAILING_TEMPLATE_HELP)
+    html_body = models.TextField(blank=True, default='', help_text=MAILING_TEMPLATE_HELP)  # HTML-версия, необязательна
     send_time = models.DateTimeField()  # время отправки
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_sent = models.BooleanField(default=False)
+    dispatched_at = models.DateTimeField(null=True, blank=True)  # когда диспетчер взял рассылку в работу
     task_id = models.CharField(max_length=255, blank=True, null=True)
-    failed_recipients = models.TextField(blank=True, null=True)
+    # Пакеты раздачи в очереди и время последнего изменения счетчика (обратное давление)
+    inflight_batches = models.PositiveIntegerField(default=0)
+    inflight_updated_at = models.DateTimeField(null=True, blank=True)
     mailing_type = models.CharField(max_length=50, choices=[
         ('notification', 'Notification'),
         ('promotion', 'Promotion'),
         ('reminder', 'Reminder'),
     ], default='notification')
-    
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['send_time', 'id'], name='mailing_send_time_idx'),
+            # Выборка диспетчером рассылок, время которых наступило
+            models.Index(fields=['send_time'], condition=models.Q(is_sent=False), name='mailing_due_idx'),
+        ]
+
     def __str__(self):
         return self.subject
 
@@ -247,6 +353,44 @@ class Subscription(models.Model):
     
     class Meta:
         unique_together = ['user', 'mailing']
+        indexes = [
+            # Обход подписчиков рассылки пакетами по id
+            models.Index(fields=['mailing', 'id'], condition=models.Q(subscribed=True),
+                         name='subscription_active_idx'),
+        ]
+
+
+class MailingDelivery(models.Model):
+    """
+    Журнал доставки рассылки: одна строка на получателя.
+
+    Пакет отправляет только строки в статусе pending (или зависшие в sending),
+    поэтому повтор задачи не дублирует уже доставленные письма.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, related_name='deliveries')
+    email = models.EmailField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['mailing', 'email'], name='mailing_delivery_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['mailing', 'status'], name='mailing_delivery_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.email} ({self.status})"
 
 
 class Notification(models.Model):
@@ -260,6 +404,28 @@ class Notification(models.Model):
     ])
     message = models.TextField()
     read_status = models.BooleanField(default=False)
-    
+
+    class Meta:
+        indexes = [
+            # Входящие пользователя, новые сверху; непрочитанные - частичный индекс только по ним
+            models.Index(fields=['user', '-sent_at', '-id'], name='notification_inbox_idx'),
+            models.Index(fields=['user', '-sent_at', '-id'], name='notification_unread_idx',
+                         condition=models.Q(read_status=False)),
+        ]
+
+    def __str__(self):
+        # booking_id не требует запроса к базе, в отличие от self.booking.id
+        return f"Notification for Booking {self.booking_id} - {self.type}"
+
+
+class NotificationCounter(models.Model):
+    """
+    Число непрочитанных уведомлений пользователя. Обновляется вместе с записью
+    и прочтением уведомлений, чтобы значок не считал COUNT(*) на каждый запрос.
+    """
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True,
+                                related_name='notification_counter')
+    unread = models.PositiveIntegerField(default=0)
+
     def __str__(self):
-        return f"Notification for Booking {self.booking.id} - {self.type}"
+        return f"{self.user_id}: {self.unread}"
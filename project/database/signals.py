@@ -0,0 +1,17 @@
+from django.db import connections
+
+# Расширения PostgreSQL, которые нужны индексам и ограничениям моделей
+POSTGRES_EXTENSIONS = [
+    'btree_gist',  # ExclusionConstraint по id_transport (равенство) и time_range (пересечение)
+    'pg_trgm',  # триграммные GIN-индексы по названиям городов
+]
+
+
+def create_postgres_extensions(sender, using, **kwargs):
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        for extension in POSTGRES_EXTENSIONS:
+            cursor.execute(f'CREATE EXTENSION IF NOT EXISTS {extension}')
@@ -1,3 +1,108 @@
-from django.test import TestCase
+import io
+import json
+import shutil
+import tempfile
 
-# Create your tests here.
+from PIL import Image
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from database.management.commands.load_cities import iter_json_array
+from database.models import Cities, Route, Transport
+from project.cache import get_generations
+
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (4, 4), 'red').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class MigrateBusPhotosTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        route = Route.objects.create(
+            id_from=Cities.objects.create(name='Москва', region='Москва'),
+            id_to=Cities.objects.create(name='Казань', region='Татарстан'),
+        )
+        cls.photo = png_bytes()
+        cls.bus = Transport.objects.create(bus_nickname='С фото', brand='ПАЗ', model='3205', id_route=route,
+                                           photo=cls.photo)
+        cls.empty = Transport.objects.create(bus_nickname='Без фото', brand='ПАЗ', model='3205', id_route=route)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def migrate(self, *args):
+        call_command('migrate_bus_photos', '--chunk-size', '16', *args, stdout=io.StringIO())
+        return Transport.objects.get(id=self.bus.id)
+
+    def test_moves_blob_in_chunks(self):
+        generation, = get_generations([Transport])
+
+        bus = self.migrate()
+
+        self.assertEqual(bus.photo_file.name, f'buses/bus_{bus.id}.png')
+        self.assertIsNone(bus.photo)
+        with bus.photo_file.open('rb') as file:
+            self.assertEqual(file.read(), self.photo)
+        self.assertFalse(Transport.objects.get(id=self.empty.id).photo_file)
+        self.assertEqual(get_generations([Transport]), [generation + 1])
+
+    def test_keep_blobs(self):
+        bus = self.migrate('--keep-blobs')
+
+        self.assertEqual(bus.photo_file.name, f'buses/bus_{bus.id}.png')
+        self.assertEqual(bytes(bus.photo), self.photo)
+
+
+class CountingReader(io.StringIO):
+    def __init__(self, text):
+        super().__init__(text)
+        self.consumed = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.consumed += len(chunk)
+        return chunk
+
+
+class IterJsonArrayTests(SimpleTestCase):
+    TEXT = json.dumps([
+        {'Город': 'Москва', 'Регион': 'Москва', 'escaped': 'кавычка \" и \\ \u00e9'},
+        {'Город': 'Казань', 'Регион': 'Татарстан', 'nested': [1.5e10, -3, True, False, None, {'a': []}]},
+        123456789,
+        'строка',
+    ], ensure_ascii=False, indent=1)
+
+    def parse(self, text, chunk_size):
+        return list(iter_json_array(io.StringIO(text), chunk_size=chunk_size))
+
+    def test_every_chunk_boundary(self):
+        expected = json.loads(self.TEXT)
+        for chunk_size in range(1, len(self.TEXT) + 2):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.parse(self.TEXT, chunk_size), expected)
+
+    def test_number_split_at_chunk_end(self):
+        self.assertEqual(self.parse('[12345, 6789]', 3), [12345, 6789])
+
+    def test_empty_array(self):
+        self.assertEqual(self.parse(' [ \n ] ', 2), [])
+
+    def test_invalid_input(self):
+        for text in ('{"Город": 1}', '[{"Город": 1}', '[{"Город" 1}]', ''):
+            with self.subTest(text=text), self.assertRaises(json.JSONDecodeError):
+                self.parse(text, 4)
+
+    def test_syntax_error_fails_without_reading_the_rest(self):
+        tail = ', '.join(['{"Город": "Москва", "Регион": "Москва"}'] * 10000)
+        reader = CountingReader('[{"Город": "Москва"}, {"Город" "Казань"}, ' + tail + ']')
+
+        with self.assertRaises(json.JSONDecodeError):
+            list(iter_json_array(reader, chunk_size=64))
+        self.assertLess(reader.consumed, 256)
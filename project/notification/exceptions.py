@@ -0,0 +1,8 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class MailingInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Mailing is being sent and cannot be changed.'
+    default_code = 'mailing_in_progress'
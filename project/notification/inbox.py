@@ -0,0 +1,68 @@
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from database.models import Notification, NotificationCounter
+from notification.stream import hub
+
+# Один upsert на пакет: счетчик создается или увеличивается для всех пользователей сразу
+INCREMENT_COUNTERS_SQL = f"""
+    INSERT INTO {NotificationCounter._meta.db_table} (user_id, unread)
+    SELECT * FROM unnest(%s::bigint[], %s::integer[])
+    ON CONFLICT (user_id) DO UPDATE
+    SET unread = {NotificationCounter._meta.db_table}.unread + EXCLUDED.unread
+"""
+
+
+def notify(notifications):
+    """
+    Сохраняет пакет уведомлений и увеличивает счетчики непрочитанных.
+
+    :param notifications: несохраненные объекты Notification
+    """
+    notifications = list(notifications)
+    if not notifications:
+        return []
+
+    unread = Counter(notification.user_id for notification in notifications if not notification.read_status)
+    with transaction.atomic():
+        created = Notification.objects.bulk_create(notifications)
+        if unread:
+            # Пользователи в порядке id, чтобы параллельные пакеты блокировали строки счетчиков в одном порядке
+            user_ids = sorted(unread)
+            with connection.cursor() as cursor:
+                cursor.execute(INCREMENT_COUNTERS_SQL, [user_ids, [unread[user_id] for user_id in user_ids]])
+        transaction.on_commit(lambda: hub.publish_many(
+            (notification.user_id, 'notification', {
+                'id': notification.id,
+                'booking': notification.booking_id,
+                'type': notification.type,
+                'message': notification.message,
+                'sent_at': notification.sent_at.isoformat(),
+            })
+            for notification in created
+        ))
+    return created
+
+
+def unread_count(user):
+    counter = NotificationCounter.objects.filter(user=user).values_list('unread', flat=True).first()
+    return counter or 0
+
+
+def mark_read(user, ids=None):
+    """
+    Отмечает уведомления пользователя прочитанными одним UPDATE (все или по списку id).
+    Возвращает число уведомлений, которые действительно сменили статус.
+    """
+    notifications = Notification.objects.filter(user=user, read_status=False)
+    if ids is not None:
+        notifications = notifications.filter(id__in=ids)
+
+    with transaction.atomic():
+        marked = notifications.update(read_status=True)
+        if marked:
+            NotificationCounter.objects.filter(user=user).update(unread=Greatest(F('unread') - marked, 0))
+    return marked
@@ -0,0 +1,170 @@
+import logging
+import smtplib
+import time
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.mail import EmailMessage, BadHeaderError, get_connection
+
+logger = logging.getLogger(__name__)
+
+FROM_EMAIL = "noreply@example.com"
+
+
+@dataclass
+class BulkResult:
+    """
+    Итог отправки пакета по каждому адресу.
+
+    sent - письмо принято сервером, failed - постоянная ошибка (адрес отклонен,
+    кривые заголовки), deferred - временная ошибка или обрыв соединения,
+    такие адреса имеет смысл отправить повторно.
+    """
+    sent: list = field(default_factory=list)
+    failed: dict = field(default_factory=dict)
+    deferred: dict = field(default_factory=dict)
+
+
+class ConnectionLost(Exception):
+    pass
+
+
+def _classify(exc):
+    """
+    Возвращает 'failed', 'deferred' или 'reconnect' для ошибки отправки одного письма.
+    """
+    if isinstance(exc, BadHeaderError):
+        return 'failed'
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in exc.recipients.values()]
+        return 'failed' if codes and all(code >= 500 for code in codes) else 'deferred'
+    if isinstance(exc, smtplib.SMTPServerDisconnected):
+        return 'reconnect'
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 'failed' if exc.smtp_code >= 500 else 'deferred'
+    if isinstance(exc, smtplib.SMTPException):
+        return 'deferred'
+    if isinstance(exc, OSError):
+        # Сброс соединения, broken pipe, таймаут сокета
+        return 'reconnect'
+    raise exc
+
+
+class BulkSender:
+    """
+    Отправка пакета писем через одно SMTP-соединение.
+
+    Соединение открывается один раз на пакет (а не на каждое письмо, как send_mail),
+    переоткрывается после messages_per_connection писем и при обрыве. Письма
+    уходят по одному через send_messages открытого соединения, чтобы знать
+    результат по каждому адресу.
+    """
+
+    def __init__(self, connection=None, rate=None, messages_per_connection=None, max_reconnects=None, limiter=None):
+        self.connection = connection or get_connection()
+        self.rate = settings.MAILING_SEND_RATE if rate is None else rate
+        # Общий лимит очереди и провайдера (notification.ratelimit.RateLimiter)
+        self.limiter = limiter
+        self.messages_per_connection = messages_per_connection or settings.MAILING_MESSAGES_PER_CONNECTION
+        self.max_reconnects = settings.MAILING_MAX_RECONNECTS if max_reconnects is None else max_reconnects
+        self.connections_opened = 0
+        self._sent_on_connection = 0
+        self._next_send = 0.0
+        self._is_open = False
+
+    def _open(self):
+        self.connection.open()
+        self._is_open = True
+        self._sent_on_connection = 0
+        self.connections_opened += 1
+
+    def _close(self):
+        self._is_open = False
+        try:
+            self.connection.close()
+        except (smtplib.SMTPException, OSError):
+            # Соединение уже мертво, закрывать нечего
+            pass
+
+    def _reconnect(self):
+        self._close()
+        for attempt in range(self.max_reconnects):
+            try:
+                self._open()
+                return
+            except (smtplib.SMTPException, OSError) as exc:
+                logger.warning("SMTP reconnect attempt %s failed: %s", attempt + 1, exc)
+                time.sleep(min(2 ** attempt, 10))
+        raise ConnectionLost()
+
+    def _throttle(self):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        if not self.rate:
+            return
+        delay = self._next_send - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_send = max(self._next_send, time.monotonic()) + 1 / self.rate
+
+    def _deliver(self, message):
+        """
+        Отправляет одно письмо, при обрыве соединения переподключается и повторяет.
+        Возвращает None при успехе или (вид ошибки, текст).
+        """
+        reconnects = 0
+        while True:
+            if not self._is_open or self._sent_on_connection >= self.messages_per_connection:
+                self._reconnect()
+            self._throttle()
+            try:
+                self.connection.send_messages([message])
+                self._sent_on_connection += 1
+                return None
+            except Exception as exc:
+                kind = _classify(exc)
+                if kind != 'reconnect':
+                    return kind, str(exc)
+                reconnects += 1
+                logger.warning("SMTP connection dropped: %s", exc)
+                self._is_open = False
+                if reconnects > self.max_reconnects:
+                    raise ConnectionLost()
+
+    def send(self, messages):
+        """
+        :param messages: пары (ключ, EmailMessage); ключ - адрес или другой идентификатор
+            получателя, по нему раскладываются результаты
+        """
+        result = BulkResult()
+        messages = list(messages)
+        try:
+            for index, (email, message) in enumerate(messages):
+                try:
+                    error = self._deliver(message)
+                except ConnectionLost:
+                    # Сервер недоступен: оставшиеся адреса откладываем целиком
+                    for rest, _ in messages[index:]:
+                        result.deferred[rest] = "SMTP connection lost"
+                    break
+                if error is None:
+                    result.sent.append(email)
+                elif error[0] == 'failed':
+                    result.failed[email] = error[1]
+                else:
+                    result.deferred[email] = error[1]
+        finally:
+            self._close()
+        return result
+
+
+def send_bulk(subject, body, recipients, from_email=FROM_EMAIL, **kwargs):
+    """
+    Отправляет одно и то же письмо каждому адресу отдельным сообщением
+    через общее SMTP-соединение. Параметры kwargs передаются в BulkSender.
+    """
+    sender = BulkSender(**kwargs)
+    return sender.send(
+        (email, EmailMessage(subject=subject, body=body, from_email=from_email, to=[email]))
+        for email in recipients
+    )
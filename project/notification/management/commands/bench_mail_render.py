@@ -0,0 +1,64 @@
+import time
+
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.core.management.base import BaseCommand
+from django.template import Context, Template
+
+from notification.mailer import FROM_EMAIL
+from notification.rendering import MailingTemplate
+
+SUBJECT = 'Скидки недели для вас, {{ first_name }}'
+BODY = 'Здравствуйте, {{ first_name }} {{ last_name }}!\n\n' + 'Новые маршруты и скидки до 30% на поездки.\n' * 20
+HTML = '<html><body><h1>Здравствуйте, {{ first_name }}!</h1>' + '<p>Новые маршруты и скидки до 30%.</p>' * 20 + '</body></html>'
+
+
+class Command(BaseCommand):
+    help = 'Стоимость сборки писем рассылки на 10 тысяч получателей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=10000)
+
+    def handle(self, *args, **kwargs):
+        recipients = [
+            (f'user{i}@example.com', {'first_name': f'Имя{i}', 'last_name': f'Фамилия{i}'})
+            for i in range(kwargs['recipients'])
+        ]
+
+        # Каждое письмо сериализуется, как при отправке через SMTP
+        self.run('f-строка, только текст', recipients, self.fstring)
+        self.run('шаблон Django на каждое письмо', recipients, self.reparse)
+        self.run('скомпилированный, текст', recipients, MailingTemplate(SUBJECT, BODY).render)
+        self.run('скомпилированный, текст + HTML', recipients, MailingTemplate(SUBJECT, BODY, HTML).render)
+        # Персонализирован только subject: тело письма сериализуется один раз на всю рассылку
+        static_body = BODY.replace('{{ first_name }} {{ last_name }}', 'клиент')
+        static_html = HTML.replace('{{ first_name }}', 'клиент')
+        self.run('готовое тело, текст + HTML', recipients, MailingTemplate(SUBJECT, static_body, static_html).render)
+
+    def fstring(self, email, context):
+        return EmailMessage(
+            subject=f"Скидки недели для вас, {context['first_name']}",
+            body=f"Здравствуйте, {context['first_name']} {context['last_name']}!\n\n"
+                 + 'Новые маршруты и скидки до 30% на поездки.\n' * 20,
+            from_email=FROM_EMAIL,
+            to=[email],
+        )
+
+    def reparse(self, email, context):
+        context = Context({'email': email, **context})
+        message = EmailMultiAlternatives(
+            subject=Template(SUBJECT).render(context),
+            body=Template(BODY).render(context),
+            from_email=FROM_EMAIL,
+            to=[email],
+        )
+        message.attach_alternative(Template(HTML).render(context), 'text/html')
+        return message
+
+    def run(self, title, recipients, build):
+        started = time.perf_counter()
+        size = 0
+        for email, context in recipients:
+            size += len(build(email, context).message().as_bytes(linesep='\r\n'))
+        elapsed = time.perf_counter() - started
+        per_10k = elapsed / len(recipients) * 10000
+        self.stdout.write(f"{title:34} {per_10k * 1000:8.0f} мс на 10k писем  ({size / len(recipients):.0f} байт)")
@@ -0,0 +1,87 @@
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.timezone import now
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from database.models import Mailing
+from notification.serializers import MailingSerializer
+from notification.views import MailingListView
+from project.pagination import KeysetPagination
+
+
+class Command(BaseCommand):
+    help = 'Сравнение OFFSET- и keyset-пагинации списка рассылок на таблицах разного размера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def fill(self, size):
+        base = now()
+        batch = []
+        for i in range(size):
+            batch.append(Mailing(subject=f'Рассылка {i}', body='Текст', send_time=base + timedelta(seconds=i // 3)))
+            if len(batch) == 5000:
+                Mailing.objects.bulk_create(batch)
+                batch = []
+        Mailing.objects.bulk_create(batch)
+
+    def timed(self, func, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - started) / repeat * 1000
+
+    def peak_memory(self, func):
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak / 1024 / 1024
+
+    def handle(self, *args, **kwargs):
+        page_size = kwargs['page_size']
+        repeat = kwargs['repeat']
+        factory = APIRequestFactory()
+        view = MailingListView()
+
+        for size in kwargs['sizes']:
+            # Данные создаются внутри транзакции и откатываются после замеров
+            with transaction.atomic():
+                self.fill(size)
+                queryset = Mailing.objects.order_by('send_time', 'id')
+                total = queryset.count()
+
+                # Курсор на предпоследнюю страницу - худший случай для OFFSET
+                paginator = KeysetPagination()
+                paginator.keys = [('send_time', False), ('id', False)]
+                anchor = queryset.values('send_time', 'id')[total - page_size - 1]
+                cursor = paginator.encode_cursor([anchor['send_time'], anchor['id']])
+                request = Request(factory.get('/', {'cursor': cursor, 'page_size': page_size}))
+
+                def offset_page():
+                    return MailingSerializer(list(queryset[total - page_size:total]), many=True).data
+
+                def keyset_page():
+                    page = KeysetPagination().paginate_queryset(queryset, request, view)
+                    return MailingSerializer(page, many=True).data
+
+                def full_list():
+                    return MailingSerializer(queryset, many=True).data
+
+                offset_ms = self.timed(offset_page, repeat)
+                keyset_ms = self.timed(keyset_page, repeat)
+                full_mb = self.peak_memory(full_list)
+                page_mb = self.peak_memory(keyset_page)
+
+                self.stdout.write(
+                    f'{total:>9} строк: OFFSET {offset_ms:8.2f} мс, keyset {keyset_ms:6.2f} мс, '
+                    f'память: весь список {full_mb:8.1f} МБ, страница {page_mb:5.2f} МБ'
+                )
+                transaction.set_rollback(True)
@@ -0,0 +1,127 @@
+import socketserver
+import threading
+import time
+
+from django.core.mail import send_mail
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from notification.mailer import send_bulk, FROM_EMAIL
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    """
+    Минимальный SMTP-сервер: принимает и выбрасывает письма, считает соединения и письма.
+    """
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        # Имитация стоимости установки соединения (TCP + TLS + AUTH у настоящего сервера)
+        time.sleep(server.connect_delay)
+        self.reply('220 sink ESMTP')
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().upper()
+
+            if command.startswith('EHLO'):
+                self.reply('250-sink')
+                self.reply('250 8BITMIME')
+            elif command.startswith(('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP')):
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                with server.lock:
+                    server.messages += 1
+                    drop = server.drop_every and server.messages % server.drop_every == 0
+                if drop:
+                    # Обрыв соединения до подтверждения письма
+                    return
+                self.reply('250 OK: queued')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, connect_delay=0.0, drop_every=0):
+        super().__init__(('127.0.0.1', 0), SinkHandler)
+        self.lock = threading.Lock()
+        self.connect_delay = connect_delay
+        self.drop_every = drop_every
+        self.connections = 0
+        self.messages = 0
+
+    def reset(self):
+        self.connections = 0
+        self.messages = 0
+
+
+class Command(BaseCommand):
+    help = 'Сравнение отправки рассылки через send_mail на каждое письмо и через одно SMTP-соединение'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=500)
+        parser.add_argument('--connect-delay', type=float, default=0.02,
+                            help="Задержка на каждое новое соединение, с (имитация TLS-рукопожатия)")
+        parser.add_argument('--drop-every', type=int, default=0,
+                            help="Обрывать соединение на каждом N-м письме (проверка переподключения)")
+
+    def handle(self, *args, **kwargs):
+        recipients = [f'user{i}@example.com' for i in range(kwargs['recipients'])]
+        server = SinkServer(kwargs['connect_delay'], kwargs['drop_every'])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        smtp = {
+            'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+            'EMAIL_HOST': '127.0.0.1',
+            'EMAIL_PORT': server.server_address[1],
+            'EMAIL_USE_TLS': False,
+            'EMAIL_USE_SSL': False,
+            'EMAIL_HOST_USER': '',
+            'EMAIL_HOST_PASSWORD': '',
+        }
+        try:
+            with override_settings(**smtp):
+                self.run('send_mail на каждый адрес', server, lambda: self.send_each(recipients))
+                self.run('одно соединение на пакет', server, lambda: self.send_batched(recipients))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def send_each(self, recipients):
+        failed = 0
+        for email in recipients:
+            try:
+                send_mail('Тест', 'Текст рассылки', FROM_EMAIL, [email], fail_silently=False)
+            except Exception:
+                failed += 1
+        return len(recipients) - failed, failed
+
+    def send_batched(self, recipients):
+        result = send_bulk('Тест', 'Текст рассылки', recipients, rate=0)
+        return len(result.sent), len(result.failed) + len(result.deferred)
+
+    def run(self, title, server, func):
+        server.reset()
+        started = time.perf_counter()
+        sent, failed = func()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{title:28} {sent / elapsed:8.0f} писем/с  отправлено: {sent}, ошибок: {failed}, "
+            f"соединений: {server.connections}"
+        )
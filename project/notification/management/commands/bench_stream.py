@@ -0,0 +1,127 @@
+import asyncio
+import json
+import statistics
+import threading
+import time
+import tracemalloc
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from database.models import CustomUser
+from notification.stream import hub
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест потока уведомлений: тысячи подключений к ASGI-приложению и задержка доставки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=5000)
+        parser.add_argument('--events', type=int, default=200, help="Событий, опубликованных из синхронного кода")
+
+    def handle(self, *args, **kwargs):
+        # Поток событий в памяти процесса: меряется само приложение, а не сеть до Redis
+        from project.asgi import application
+
+        # Поток проверяет пользователей в базе, поэтому подключаются настоящие тестовые пользователи
+        prefix = f'bench.{uuid.uuid4().hex[:8]}'
+        password = make_password(None)
+        users = CustomUser.objects.bulk_create(
+            CustomUser(email=f'{prefix}.{i}@example.com', password=password) for i in range(kwargs['connections'])
+        )
+        try:
+            with override_settings(REDIS_URL='', ALLOWED_HOSTS=['testserver']):
+                asyncio.run(self.run(application, [user.id for user in users], kwargs['events']))
+        finally:
+            CustomUser.objects.filter(email__startswith=prefix).delete()
+
+    async def run(self, application, user_ids, events):
+        connections = len(user_ids)
+        connected = asyncio.Event()
+        opened = [0]
+        latencies = []
+        delivered = asyncio.Event()
+        failed = asyncio.get_running_loop().create_future()
+
+        async def client(user_id, token, disconnect):
+            async def receive():
+                if not receive.sent:
+                    receive.sent = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+            receive.sent = False
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    if message['status'] != 200 and not failed.done():
+                        failed.set_exception(CommandError(f"Stream responded with {message['status']}"))
+                    return
+                body = message.get('body', b'').decode()
+                if body.startswith('retry:'):
+                    opened[0] += 1
+                    if opened[0] == connections:
+                        connected.set()
+                for line in body.splitlines():
+                    if line.startswith('data: '):
+                        latencies.append(time.perf_counter() - json.loads(line[6:])['published'])
+                        if len(latencies) == events:
+                            delivered.set()
+
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': '/api/notification/stream/', 'raw_path': b'/api/notification/stream/',
+                'query_string': b'', 'root_path': '', 'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+                'headers': [(b'host', b'testserver'), (b'authorization', f'Bearer {token}'.encode())],
+            }
+            await application(scope, receive, send)
+
+        tokens = []
+        for user_id in user_ids:
+            token = AccessToken()
+            token['user_id'] = user_id
+            tokens.append(str(token))
+
+        threads_before = threading.active_count()
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+
+        disconnect = asyncio.Event()
+        tasks = [asyncio.create_task(client(user_id, token, disconnect)) for user_id, token in zip(user_ids, tokens)]
+        await asyncio.wait([asyncio.ensure_future(connected.wait()), failed], return_when=asyncio.FIRST_COMPLETED)
+        if failed.done():
+            disconnect.set()
+            await asyncio.gather(*tasks)
+            failed.result()
+        connect_time = time.perf_counter() - started
+        memory = tracemalloc.get_traced_memory()[0] - memory_before
+        threads = threading.active_count()
+        subscribed = hub.connections
+
+        def publish():
+            # Как views и задачи: синхронная публикация из другого потока
+            for i in range(events):
+                hub.publish([user_ids[i % connections]], 'notification', {'published': time.perf_counter()})
+                time.sleep(0.005)
+
+        await asyncio.to_thread(publish)
+        await asyncio.wait_for(delivered.wait(), timeout=30)
+        tracemalloc.stop()
+
+        disconnect.set()
+        await asyncio.gather(*tasks)
+
+        ordered = sorted(latencies)
+        self.stdout.write(
+            f"подключений: {subscribed} за {connect_time:.1f} с; "
+            f"потоков: {threads_before} -> {threads}; "
+            f"память: {memory / connections / 1024:.1f} КиБ на подключение"
+        )
+        self.stdout.write(
+            f"доставка {len(ordered)} событий: p50 {statistics.median(ordered) * 1000:.2f} мс, "
+            f"p95 {ordered[int(len(ordered) * 0.95) - 1] * 1000:.2f} мс, max {ordered[-1] * 1000:.2f} мс"
+        )
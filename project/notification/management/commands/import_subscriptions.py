@@ -0,0 +1,98 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from notification.subscriptions import merge_from, upsert_subscriptions, MergeResult
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'f'}
+
+
+class Command(BaseCommand):
+    help = 'Импорт подписок на рассылки из CSV (user_id, mailing_id, subscribed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file_path', type=str, help="Путь к CSV с заголовком user_id,mailing_id[,subscribed]")
+        parser.add_argument('--batches', action='store_true',
+                            help="Слияние пакетами по --batch-size в отдельных транзакциях вместо одного COPY")
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--progress-every', type=int, default=100000, help="Как часто выводить прогресс (строк)")
+        parser.add_argument('--delimiter', default=',')
+
+    def iter_rows(self, file, delimiter):
+        reader = csv.DictReader(file, delimiter=delimiter)
+        if not reader.fieldnames or not {'user_id', 'mailing_id'} <= set(reader.fieldnames):
+            raise CommandError("CSV header must contain user_id and mailing_id")
+
+        for row in reader:
+            subscribed = (row.get('subscribed') or '1').strip().lower()
+            try:
+                if subscribed not in TRUE_VALUES | FALSE_VALUES:
+                    raise ValueError(subscribed)
+                yield int(row['user_id']), int(row['mailing_id']), subscribed in TRUE_VALUES
+            except (TypeError, ValueError):
+                self.stdout.write(self.style.WARNING(f"Пропуск строки {reader.line_num}: {row}"))
+
+    def report(self, processed, started):
+        rate = processed / max(time.perf_counter() - started, 1e-9)
+        self.stdout.write(f"Прочитано строк: {processed} ({rate:.0f} в секунду)")
+
+    def load_copy(self, rows, progress_every, started):
+        processed = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMP TABLE tmp_subscriptions "
+                "(line bigserial, user_id bigint, mailing_id bigint, subscribed boolean) ON COMMIT DROP"
+            )
+            with cursor.copy("COPY tmp_subscriptions (user_id, mailing_id, subscribed) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+                    processed += 1
+                    if processed % progress_every == 0:
+                        self.report(processed, started)
+            return processed, merge_from(cursor, 'tmp_subscriptions')
+
+    def load_batches(self, rows, batch_size, progress_every, started):
+        processed = 0
+        reported = 0
+        total = MergeResult()
+        batch = []
+
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                total += upsert_subscriptions(batch)
+                processed += len(batch)
+                batch = []
+                if processed - reported >= progress_every:
+                    self.report(processed, started)
+                    reported = processed
+        if batch:
+            total += upsert_subscriptions(batch)
+            processed += len(batch)
+        return processed, total
+
+    def handle(self, *args, **kwargs):
+        file_path = kwargs['file_path']
+        started = time.perf_counter()
+
+        try:
+            with open(file_path, 'r', encoding='utf-8', newline='') as file:
+                rows = self.iter_rows(file, kwargs['delimiter'])
+                if kwargs['batches']:
+                    processed, result = self.load_batches(
+                        rows, kwargs['batch_size'], kwargs['progress_every'], started
+                    )
+                else:
+                    processed, result = self.load_copy(rows, kwargs['progress_every'], started)
+        except FileNotFoundError:
+            raise CommandError(f"Файл не найден: {file_path}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Строк: {processed}, повторов пары: {result.duplicates}; создано {result.created}, "
+            f"изменено {result.updated}, без изменений {result.unchanged}, "
+            f"пропущено (нет пользователя или рассылки) {result.skipped}. "
+            f"Время: {time.perf_counter() - started:.1f} с."
+        ))
@@ -0,0 +1,137 @@
+import statistics
+import threading
+import time
+from collections import deque
+
+from django.core.mail import EmailMessage
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from notification.mailer import BulkSender, FROM_EMAIL
+from notification.management.commands.bench_smtp import SinkServer
+from notification.ratelimit import RateLimiter
+from notification.routing import QUEUE_CRITICAL, QUEUE_DEFAULT, QUEUE_BULK
+
+
+class Broker:
+    """
+    Очереди брокера в памяти. Воркер берет задачу из первой непустой очереди
+    в своем порядке - так же, как воркер Celery со стратегией priority.
+    """
+
+    def __init__(self, queues):
+        self.queues = {name: deque() for name in queues}
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def put(self, queue, task):
+        with self.condition:
+            self.queues[queue].append(task)
+            self.condition.notify()
+
+    def get(self, order):
+        with self.condition:
+            while not self.closed:
+                for queue in order:
+                    if self.queues[queue]:
+                        return self.queues[queue].popleft()
+                self.condition.wait()
+            return None
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест: задержка напоминаний о бронировании во время большой промо-рассылки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bulk-emails', type=int, default=1500, help="Писем в промо-рассылке")
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=4, help="Воркеры, разбирающие все очереди")
+        parser.add_argument('--critical-workers', type=int, default=1, help="Воркеры только для срочной очереди")
+        parser.add_argument('--duration', type=float, default=15, help="Сколько секунд поступают напоминания")
+        parser.add_argument('--reminder-interval', type=float, default=0.5)
+
+    def handle(self, *args, **kwargs):
+        server = SinkServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        smtp = {
+            'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+            'EMAIL_HOST': '127.0.0.1',
+            'EMAIL_PORT': server.server_address[1],
+            'EMAIL_USE_TLS': False,
+            'EMAIL_USE_SSL': False,
+            'EMAIL_HOST_USER': '',
+            'EMAIL_HOST_PASSWORD': '',
+        }
+        try:
+            with override_settings(**smtp):
+                self.run('одна очередь (как раньше)', lanes=False, **kwargs)
+                self.run('очереди с приоритетом', lanes=True, **kwargs)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def run(self, title, lanes, **kwargs):
+        if lanes:
+            broker = Broker([QUEUE_CRITICAL, QUEUE_DEFAULT, QUEUE_BULK])
+            bulk_queue, reminder_queue = QUEUE_BULK, QUEUE_CRITICAL
+            orders = [[QUEUE_CRITICAL, QUEUE_DEFAULT, QUEUE_BULK]] * kwargs['workers']
+            orders += [[QUEUE_CRITICAL]] * kwargs['critical_workers']
+        else:
+            broker = Broker(['celery'])
+            bulk_queue = reminder_queue = 'celery'
+            orders = [['celery']] * (kwargs['workers'] + kwargs['critical_workers'])
+
+        latencies = []
+        bulk_sent = [0]
+        lock = threading.Lock()
+
+        def bulk_task(emails):
+            sender = BulkSender(limiter=RateLimiter.for_queue(bulk_queue))
+            result = sender.send((email, EmailMessage('Акция', 'Скидки', FROM_EMAIL, [email])) for email in emails)
+            with lock:
+                bulk_sent[0] += len(result.sent)
+
+        def reminder_task(enqueued_at):
+            sender = BulkSender(limiter=RateLimiter.for_queue(reminder_queue))
+            sender.send([('r', EmailMessage('Напоминание', 'Поездка завтра', FROM_EMAIL, ['client@example.com']))])
+            with lock:
+                latencies.append(time.perf_counter() - enqueued_at)
+
+        def worker(order):
+            while (task := broker.get(order)) is not None:
+                task()
+
+        emails = [f'user{i}@example.com' for i in range(kwargs['bulk_emails'])]
+        for i in range(0, len(emails), kwargs['batch_size']):
+            broker.put(bulk_queue, lambda batch=emails[i:i + kwargs['batch_size']]: bulk_task(batch))
+
+        threads = [threading.Thread(target=worker, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+
+        started = time.perf_counter()
+        reminders = 0
+        while time.perf_counter() - started < kwargs['duration']:
+            enqueued_at = time.perf_counter()
+            broker.put(reminder_queue, lambda enqueued_at=enqueued_at: reminder_task(enqueued_at))
+            reminders += 1
+            time.sleep(kwargs['reminder_interval'])
+
+        while len(latencies) < reminders:
+            time.sleep(0.1)
+        elapsed = time.perf_counter() - started
+        broker.close()
+        for thread in threads:
+            thread.join()
+
+        ordered = sorted(latencies)
+        self.stdout.write(
+            f"{title:28} напоминания: p50 {statistics.median(ordered):6.2f} с, "
+            f"p95 {ordered[int(len(ordered) * 0.95) - 1]:6.2f} с, max {ordered[-1]:6.2f} с; "
+            f"промо-писем за {elapsed:.0f} с: {bulk_sent[0]}"
+        )
@@ -0,0 +1,126 @@
+import threading
+import time
+
+from django.conf import settings
+
+# KEYS[1] - ключ ведра; ARGV: скорость (токенов в секунду), емкость, сколько токенов нужно.
+# Время берется у Redis, чтобы расхождение часов воркеров не влияло на лимит.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = (requested - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class LocalTokenBucket:
+    """
+    Ведро токенов в памяти процесса. Замена Redis для разработки и нагрузочного теста:
+    лимит действует только внутри одного процесса.
+    """
+
+    def __init__(self, name, rate, capacity=None):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, tokens=1):
+        """
+        Забирает токены, если они есть. Возвращает 0 или сколько секунд подождать до следующей попытки.
+        """
+        with self._lock:
+            current = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (current - self._updated) * self.rate)
+            self._updated = current
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+
+class RedisTokenBucket:
+    """
+    Общее для всех воркеров ведро токенов: состояние в Redis, списание атомарно в Lua-скрипте.
+    """
+
+    _client = None
+    _script = None
+
+    def __init__(self, name, rate, capacity=None):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.key = f'ratelimit:{name}'
+
+    @classmethod
+    def client(cls):
+        if cls._client is None:
+            import redis
+            cls._client = redis.Redis.from_url(settings.REDIS_URL)
+            cls._script = cls._client.register_script(TOKEN_BUCKET_SCRIPT)
+        return cls._client
+
+    def take(self, tokens=1):
+        self.client()
+        return float(self._script(keys=[self.key], args=[self.rate, self.capacity, tokens]))
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(name, rate):
+    """
+    Ведро по имени, одно на процесс. Без REDIS_URL используется локальная замена.
+    """
+    bucket = _buckets.get(name)
+    if bucket is None or bucket.rate != rate:
+        bucket_class = RedisTokenBucket if settings.REDIS_URL else LocalTokenBucket
+        with _buckets_lock:
+            bucket = _buckets[name] = bucket_class(name, rate)
+    return bucket
+
+
+class RateLimiter:
+    """
+    Набор ведер, из каждого нужно получить токен перед отправкой письма:
+    лимит очереди и лимит SMTP-провайдера.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    @classmethod
+    def for_queue(cls, queue):
+        buckets = []
+        queue_rate = settings.NOTIFICATION_QUEUE_RATE_LIMITS.get(queue)
+        if queue_rate:
+            buckets.append(get_bucket(f'queue:{queue}', queue_rate))
+        if settings.NOTIFICATION_PROVIDER_RATE_LIMIT:
+            provider = getattr(settings, 'EMAIL_HOST', None) or 'default'
+            buckets.append(get_bucket(f'smtp:{provider}', settings.NOTIFICATION_PROVIDER_RATE_LIMIT))
+        return cls(buckets)
+
+    def acquire(self):
+        for bucket in self.buckets:
+            while wait := bucket.take():
+                time.sleep(wait)
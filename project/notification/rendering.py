@@ -0,0 +1,186 @@
+import re
+import threading
+from email.message import Message
+
+from django.core.cache import cache
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.template import Context, Engine
+from django.utils.html import escape
+
+from database.models import Mailing
+from notification.mailer import FROM_EMAIL
+
+VARIABLE_RE = re.compile(r'{{\s*(\w+)\s*}}')
+TEMPLATE_CACHE_TIMEOUT = 60 * 60
+
+_engine = Engine()
+
+
+class CompiledTemplate:
+    """
+    Шаблон, разобранный один раз.
+
+    Если в нем только подстановки вида {{ name }}, он хранится как чередование
+    текста и имен переменных, и рендер - это один join. Для шаблонов с тегами
+    и фильтрами используется шаблонизатор Django.
+    """
+
+    def __init__(self, source, autoescape=False):
+        self.autoescape = autoescape
+        self.template = None
+        self.segments = None
+        if '{%' in source or source.count('{{') != len(VARIABLE_RE.findall(source)):
+            self.template = _engine.from_string(source)
+        else:
+            self.segments = VARIABLE_RE.split(source)
+
+    @property
+    def is_static(self):
+        return self.segments is not None and len(self.segments) == 1
+
+    def render(self, context):
+        if self.template is not None:
+            return self.template.render(Context(context, autoescape=self.autoescape))
+        if self.is_static:
+            return self.segments[0]
+        quote = escape if self.autoescape else str
+        return ''.join(
+            segment if i % 2 == 0 else quote(context.get(segment, ''))
+            for i, segment in enumerate(self.segments)
+        )
+
+
+CONTENT_HEADERS = ('content-type', 'mime-version', 'content-transfer-encoding')
+
+
+class MimeSkeleton:
+    """
+    Неизменная часть письма: MIME-заголовки содержимого и уже сериализованное тело.
+
+    Строится один раз из EmailMessage.message() рассылки без персонализации текста;
+    письму конкретного получателя остается дописать свои заголовки (To, Subject, Message-ID).
+    """
+
+    def __init__(self, mime):
+        self.mime = mime
+        self._body = {}
+        # Первая сериализация фиксирует boundary, только после нее заголовки окончательные
+        self.body('\n')
+        self.headers = [(name, value) for name, value in mime.items() if name.lower() in CONTENT_HEADERS]
+
+    def body(self, linesep):
+        if linesep not in self._body:
+            raw = self.mime.as_bytes(linesep=linesep)
+            self._body[linesep] = raw.split((linesep * 2).encode(), 1)[1]
+        return self._body[linesep]
+
+
+class SkeletonMIME(Message):
+    """
+    Заголовки письма получателя и общее для всей рассылки тело из MimeSkeleton.
+    """
+
+    def __init__(self, skeleton, headers):
+        super().__init__()
+        self.skeleton = skeleton
+        for name, value in [*skeleton.headers, *headers]:
+            self[name] = value
+        # Пустой payload-строка: генератор не станет собирать части и выведет только заголовки
+        self.set_payload('')
+
+    def as_bytes(self, unixfrom=False, linesep='\n'):
+        policy = self.policy.clone(linesep=linesep)
+        return super().as_bytes(unixfrom, policy=policy) + self.skeleton.body(linesep)
+
+
+class SkeletonMessage(EmailMessage):
+    """
+    Письмо с готовым телом из MimeSkeleton: генерация MIME не повторяется на каждого получателя.
+
+    Заголовки (адреса, Date, Message-ID, проверка переводов строк) собирает сам
+    EmailMessage.message() по письму с пустым телом.
+    """
+
+    def __init__(self, skeleton, **kwargs):
+        super().__init__(**kwargs)
+        self.skeleton = skeleton
+
+    def message(self):
+        headers = [
+            (name, value) for name, value in super().message().items() if name.lower() not in CONTENT_HEADERS
+        ]
+        return SkeletonMIME(self.skeleton, headers)
+
+
+class MailingTemplate:
+    """
+    Скомпилированные subject, текст и HTML рассылки.
+
+    Переменные получателя: {{ email }}, {{ first_name }}, {{ last_name }};
+    для напоминаний - любые ключи переданного контекста.
+    """
+
+    def __init__(self, subject, body, html_body='', version=None):
+        self.version = version
+        self.subject = CompiledTemplate(subject)
+        self.body = CompiledTemplate(body)
+        self.html_body = CompiledTemplate(html_body, autoescape=True) if html_body else None
+        self.skeleton = None
+        if self.body.is_static and (self.html_body is None or self.html_body.is_static):
+            self.skeleton = MimeSkeleton(self._build_message('', [], {}).message())
+
+    def _build_message(self, subject, to, context):
+        if self.html_body is None:
+            return EmailMessage(subject=subject, body=self.body.render(context), from_email=FROM_EMAIL, to=to)
+        message = EmailMultiAlternatives(subject=subject, body=self.body.render(context), from_email=FROM_EMAIL, to=to)
+        message.attach_alternative(self.html_body.render(context), 'text/html')
+        return message
+
+    def render(self, email, context=None):
+        context = {'email': email, **(context or {})}
+        subject = self.subject.render(context)
+
+        if self.skeleton is not None:
+            return SkeletonMessage(self.skeleton, subject=subject, from_email=FROM_EMAIL, to=[email])
+        return self._build_message(subject, [email], context)
+
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+_COMPILED_LIMIT = 256
+
+
+def _source_key(mailing_id):
+    return f'mailing_template_{mailing_id}'
+
+
+def invalidate_mailing_template(mailing_id):
+    cache.delete(_source_key(mailing_id))
+
+
+def get_mailing_template(mailing_id):
+    """
+    Возвращает скомпилированный шаблон рассылки.
+
+    Текст рассылки берется из общего кэша (в базу ходит только первый пакет),
+    скомпилированный шаблон хранится в процессе воркера до изменения рассылки.
+    """
+    source = cache.get(_source_key(mailing_id))
+    if source is None:
+        mailing = Mailing.objects.only('subject', 'body', 'html_body', 'updated_at').get(id=mailing_id)
+        source = {
+            'subject': mailing.subject,
+            'body': mailing.body,
+            'html_body': mailing.html_body,
+            'version': mailing.updated_at.isoformat(),
+        }
+        cache.set(_source_key(mailing_id), source, timeout=TEMPLATE_CACHE_TIMEOUT)
+
+    template = _compiled.get(mailing_id)
+    if template is None or template.version != source['version']:
+        template = MailingTemplate(**source)
+        with _compiled_lock:
+            if len(_compiled) >= _COMPILED_LIMIT:
+                _compiled.clear()
+            _compiled[mailing_id] = template
+    return template
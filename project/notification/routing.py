@@ -0,0 +1,22 @@
+QUEUE_CRITICAL = 'notifications.critical'
+QUEUE_DEFAULT = 'notifications.default'
+QUEUE_BULK = 'notifications.bulk'
+
+# Массовые промо-рассылки идут отдельной полосой и не задерживают остальные письма
+MAILING_QUEUES = {
+    'promotion': QUEUE_BULK,
+    'notification': QUEUE_DEFAULT,
+    'reminder': QUEUE_DEFAULT,
+}
+
+
+def mailing_queue(mailing_type):
+    return MAILING_QUEUES.get(mailing_type, QUEUE_DEFAULT)
+
+
+def current_queue(task):
+    """
+    Очередь, из которой воркер получил задачу; при синхронном вызове - очередь по умолчанию.
+    """
+    delivery_info = task.request.delivery_info or {}
+    return delivery_info.get('routing_key') or QUEUE_DEFAULT
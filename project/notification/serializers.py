@@ -1,9 +1,51 @@
 from rest_framework import serializers
-from database.models import Mailing
+from database.models import Mailing, Notification
 
 
 class MailingSerializer(serializers.ModelSerializer):
+    # Счетчики из журнала доставки, есть только в списке рассылок (аннотации queryset)
+    sent_count = serializers.IntegerField(read_only=True)
+    failed_count = serializers.IntegerField(read_only=True)
+
     class Meta:
         model = Mailing
-        fields = ['id', 'subject', 'body', 'send_time', 'is_sent', 'task_id', 'failed_recipients']
-        read_only_fields = ['is_sent', 'task_id', 'failed_recipients']
+        fields = [
+            'id', 'subject', 'body', 'html_body', 'mailing_type', 'send_time', 'is_sent', 'dispatched_at', 'task_id',
+            'sent_count', 'failed_count',
+        ]
+        read_only_fields = ['is_sent', 'dispatched_at', 'task_id']
+
+    def update(self, instance, validated_data):
+        for name, value in validated_data.items():
+            setattr(instance, name, value)
+        # Служебные колонки пишут задачи раздачи: сохранение всей строки вернуло бы их прежние значения
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Notification
+        fields = ['id', 'booking', 'type', 'message', 'sent_at', 'read_status']
+        read_only_fields = fields
+
+
+class MarkReadSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=1000,
+                                help_text="Id уведомлений; если не переданы - прочитать все")
+
+
+class SubscriptionRowSerializer(serializers.Serializer):
+    user = serializers.IntegerField(min_value=1)
+    mailing = serializers.IntegerField(min_value=1)
+    subscribed = serializers.BooleanField(default=True)
+
+
+class BulkSubscriptionSerializer(serializers.Serializer):
+    subscriptions = SubscriptionRowSerializer(many=True, allow_empty=False, max_length=10000)
+
+
+class MySubscriptionsSerializer(serializers.Serializer):
+    mailings = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False,
+                                     max_length=1000, help_text="Id рассылок")
+    subscribed = serializers.BooleanField(default=True)
@@ -0,0 +1,12 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from database.models import Mailing
+from notification.rendering import invalidate_mailing_template
+
+
+@receiver([post_save, post_delete], sender=Mailing)
+def mailing_changed(sender, instance, **kwargs):
+    # Пакеты рассылки читают текст из кэша, после изменения он должен перечитаться
+    transaction.on_commit(lambda: invalidate_mailing_template(instance.pk))
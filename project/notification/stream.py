@@ -0,0 +1,302 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.http.request import split_domain_port, validate_host
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from authentication.backends import CachedJWTAuthentication
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'notify:'
+QUEUE_SIZE = 100
+HEARTBEAT = 25  # секунд; комментарий-пинг не дает прокси закрыть простаивающее соединение
+RETRY = 5000  # мс до переподключения EventSource
+# Поток закрывается через MAX_AGE секунд: клиент переподключается и снова проходит
+# аутентификацию, поэтому заблокированный пользователь не держит поток дольше этого срока
+MAX_AGE = 10 * 60
+TICKET_TTL = 60  # секунд на подключение по билету
+TICKET_SALT = 'notification.stream'
+# Пауза перед переподключением к Redis после ошибки, удваивается до READER_RETRY_MAX
+READER_RETRY = 1
+READER_RETRY_MAX = 30
+
+
+class NotificationHub:
+    """
+    Раздача событий пользователям, подключенным к потоку уведомлений.
+
+    Каждое подключение - корутина, ожидающая свою asyncio.Queue, без потока
+    на клиента. С REDIS_URL события публикуются в Redis pub/sub, и у процесса
+    одно соединение с подпиской на все каналы notify:*. Без Redis события
+    передаются в памяти процесса (разработка, тесты, бенчмарк).
+    """
+
+    def __init__(self):
+        self._listeners = defaultdict(set)
+        self._loop = None
+        self._reader = None
+        self._reader_failures = 0
+        self._publisher = None
+        self._lock = threading.Lock()
+
+    @property
+    def connections(self):
+        return sum(len(queues) for queues in self._listeners.values())
+
+    async def subscribe(self, user_id):
+        self._loop = asyncio.get_running_loop()
+        if settings.REDIS_URL and (self._reader is None or self._reader.done()):
+            self._reader = asyncio.create_task(self._read_redis())
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self._listeners[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self._listeners.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._listeners[user_id]
+
+    def _dispatch(self, user_id, message):
+        for queue in self._listeners.get(user_id, ()):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Клиент не успевает читать: событие теряется, полный список есть во входящих
+                logger.warning("Notification stream queue is full for user %s", user_id)
+
+    async def _read_redis(self):
+        """
+        Читает события всех подключений процесса из Redis.
+
+        При ошибке Redis чтение не прекращается молча: ошибка пишется в журнал,
+        и чтение переподключается с нарастающей паузой. События, опубликованные
+        за время обрыва, в поток не попадут - они есть во входящих.
+        """
+        self._reader_failures = 0
+        while True:
+            try:
+                await self._listen_redis()
+            except (redis.RedisError, OSError):
+                self._reader_failures += 1
+                delay = min(READER_RETRY * 2 ** (self._reader_failures - 1), READER_RETRY_MAX)
+                logger.exception("Notification stream lost Redis, reconnecting in %s s", delay)
+                await asyncio.sleep(delay)
+
+    async def _listen_redis(self):
+        client = redis.asyncio.Redis.from_url(settings.REDIS_URL)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.psubscribe(f'{CHANNEL_PREFIX}*')
+            self._reader_failures = 0
+            async for item in pubsub.listen():
+                try:
+                    user_id = int(item['channel'].decode()[len(CHANNEL_PREFIX):])
+                    message = json.loads(item['data'])
+                except (ValueError, KeyError):
+                    logger.warning("Malformed notification event on %s", item.get('channel'))
+                    continue
+                self._dispatch(user_id, message)
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+    def publish(self, user_ids, event, data):
+        """
+        Отправляет одно событие нескольким пользователям.
+        """
+        self.publish_many((user_id, event, data) for user_id in user_ids)
+
+    def publish_many(self, events):
+        """
+        Отправляет события (user_id, event, data). Вызывается из синхронного кода:
+        views, задачи, сигналы - обычно в transaction.on_commit.
+        """
+        events = [(user_id, {'event': event, 'data': data}) for user_id, event, data in events]
+        if not events:
+            return
+
+        if settings.REDIS_URL:
+            with self._lock:
+                if self._publisher is None:
+                    self._publisher = redis.Redis.from_url(settings.REDIS_URL)
+            try:
+                with self._publisher.pipeline(transaction=False) as pipe:
+                    for user_id, message in events:
+                        pipe.publish(f'{CHANNEL_PREFIX}{user_id}', json.dumps(message, default=str))
+                    pipe.execute()
+            except redis.RedisError as exc:
+                # Поток - только ускорение доставки, данные уже сохранены во входящих
+                logger.warning("Notification events were not published: %s", exc)
+            return
+
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        for user_id, message in events:
+            loop.call_soon_threadsafe(self._dispatch, user_id, message)
+
+
+hub = NotificationHub()
+
+
+def issue_ticket(validated_token):
+    """
+    Одноразовый билет на подключение к потоку на TICKET_TTL секунд.
+
+    EventSource не умеет передавать заголовки, а access-токен в адресе попал бы
+    в журналы сервера и прокси. В билете подписаны только id пользователя и
+    отпечаток пароля из токена, пользователь проверяется заново при подключении.
+    """
+    claims = (api_settings.USER_ID_CLAIM, api_settings.REVOKE_TOKEN_CLAIM)
+    return signing.dumps({claim: validated_token[claim] for claim in claims if claim in validated_token},
+                         salt=TICKET_SALT)
+
+
+def authenticate(header, ticket=''):
+    """
+    Id пользователя по заголовку Authorization или билету из issue_ticket.
+
+    Пользователь проверяется CachedJWTAuthentication: неактивный или удаленный
+    не подключится, даже если его токен еще не истек. Повторно билет не
+    принимается (с REDIS_URL - во всех процессах).
+
+    :param header: значение заголовка Authorization (bytes) или None
+    """
+    authentication = CachedJWTAuthentication()
+    try:
+        if header:
+            raw_token = authentication.get_raw_token(header)
+            if raw_token is None:
+                return None
+            claims = authentication.get_validated_token(raw_token)
+        elif ticket:
+            claims = signing.loads(ticket, salt=TICKET_SALT, max_age=TICKET_TTL)
+            if not cache.add(f'notification_stream_ticket_{ticket}', 1, timeout=TICKET_TTL):
+                return None
+        else:
+            return None
+        return authentication.get_user(claims).id
+    except (InvalidToken, TokenError, AuthenticationFailed, signing.BadSignature):
+        return None
+
+
+def _authenticate_request(header, ticket):
+    # Вне цикла запроса Django соединения с базой закрываются здесь, как по request_finished
+    try:
+        return authenticate(header, ticket)
+    finally:
+        close_old_connections()
+
+
+async def event_stream(user_id):
+    """
+    Чанки text/event-stream для пользователя: события из NotificationHub и пинги.
+    Поток заканчивается через MAX_AGE секунд.
+    """
+    queue = await hub.subscribe(user_id)
+    deadline = asyncio.get_running_loop().time() + MAX_AGE
+    try:
+        yield f'retry: {RETRY}\n\n'.encode()
+        while (remaining := deadline - asyncio.get_running_loop().time()) > 0:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=min(HEARTBEAT, remaining))
+            except asyncio.TimeoutError:
+                yield b': ping\n\n'
+                continue
+            yield f"event: {message['event']}\ndata: {json.dumps(message['data'], default=str)}\n\n".encode()
+    finally:
+        hub.unsubscribe(user_id, queue)
+
+
+STREAM_HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),  # nginx не должен буферизовать поток
+]
+
+
+class StreamRouter:
+    """
+    ASGI-обертка: запросы к потоку уведомлений обслуживаются здесь, остальные - Django.
+
+    Обработчик Django держит на каждый запрос свой поток для синхронного кода
+    (сигналы request_started/request_finished, синхронные middleware), и у
+    открытого потока событий он живет все время подключения. Здесь подключение -
+    только корутина: тысячи простаивающих клиентов не занимают потоков.
+    """
+
+    def __init__(self, application, path):
+        self.application = application
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == self.path:
+            await self.stream(scope, receive, send)
+        else:
+            await self.application(scope, receive, send)
+
+    async def stream(self, scope, receive, send):
+        headers = dict(scope['headers'])
+        host, _ = split_domain_port(headers.get(b'host', b'').decode('latin-1'))
+        if not validate_host(host, settings.ALLOWED_HOSTS if not settings.DEBUG else ['*']):
+            await self.reject(send, 400, "Invalid host header.")
+            return
+
+        query = parse_qs(scope['query_string'].decode('latin-1'))
+        user_id = await sync_to_async(_authenticate_request)(
+            headers.get(b'authorization'), query.get('ticket', [''])[0]
+        )
+        if user_id is None:
+            await self.reject(send, 401, "Authentication credentials were not provided or are invalid.")
+            return
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': STREAM_HEADERS})
+        events = event_stream(user_id)
+        disconnect = asyncio.ensure_future(self.wait_disconnect(receive))
+        chunk = None
+        try:
+            while True:
+                chunk = asyncio.ensure_future(anext(events))
+                await asyncio.wait({chunk, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnect.done():
+                    break
+                try:
+                    body = chunk.result()
+                except StopAsyncIteration:
+                    # Истек MAX_AGE: клиент переподключается с новым билетом
+                    break
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        finally:
+            disconnect.cancel()
+            if chunk is not None and not chunk.done():
+                # Отмена доходит до генератора, и он отписывается от hub
+                chunk.cancel()
+                await asyncio.gather(chunk, return_exceptions=True)
+            await events.aclose()
+        await send({'type': 'http.response.body', 'body': b''})
+
+    @staticmethod
+    async def wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    @staticmethod
+    async def reject(send, status, error):
+        body = json.dumps({'error': error}).encode()
+        await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': body})
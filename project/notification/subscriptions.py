@@ -0,0 +1,101 @@
+from dataclasses import dataclass
+
+from django.db import connection, transaction
+
+from database.models import CustomUser, Mailing, Subscription
+
+SUBSCRIPTION_TABLE = Subscription._meta.db_table
+
+# Слияние источника (user_id, mailing_id, subscribed, line) с таблицей подписок одним запросом:
+# - повтор пары внутри источника - побеждает последняя строка (иначе ON CONFLICT падает);
+# - пары с несуществующим пользователем или рассылкой пропускаются, а не откатывают весь импорт;
+# - строка, у которой subscribed не меняется, не перезаписывается.
+MERGE_SQL = f"""
+    WITH input AS (
+        SELECT user_id, mailing_id, subscribed, line FROM {{source}}
+    ), source AS (
+        SELECT DISTINCT ON (user_id, mailing_id) user_id, mailing_id, subscribed
+        FROM input
+        ORDER BY user_id, mailing_id, line DESC
+    ), valid AS (
+        SELECT source.* FROM source
+        JOIN {CustomUser._meta.db_table} AS u ON u.id = source.user_id
+        JOIN {Mailing._meta.db_table} AS m ON m.id = source.mailing_id
+    ), merged AS (
+        INSERT INTO {SUBSCRIPTION_TABLE} (user_id, mailing_id, subscribed)
+        SELECT user_id, mailing_id, subscribed FROM valid
+        ORDER BY user_id, mailing_id
+        ON CONFLICT (user_id, mailing_id) DO UPDATE SET subscribed = EXCLUDED.subscribed
+        WHERE {SUBSCRIPTION_TABLE}.subscribed IS DISTINCT FROM EXCLUDED.subscribed
+        RETURNING xmax = 0 AS inserted
+    )
+    SELECT
+        (SELECT count(*) FROM input),
+        (SELECT count(*) FROM source),
+        (SELECT count(*) FROM valid),
+        count(*) FILTER (WHERE inserted),
+        count(*) FILTER (WHERE NOT inserted)
+    FROM merged
+"""
+
+UNNEST_SOURCE = (
+    "unnest(%s::bigint[], %s::bigint[], %s::boolean[]) WITH ORDINALITY AS t(user_id, mailing_id, subscribed, line)"
+)
+
+
+@dataclass
+class MergeResult:
+    """
+    Счетчики слияния по входным строкам: received = duplicates + created + updated + unchanged + skipped.
+
+    duplicates - строки, которые перекрыла более поздняя строка с той же парой (user, mailing).
+    """
+    received: int = 0
+    duplicates: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    skipped: int = 0
+
+    def __add__(self, other):
+        return MergeResult(*(getattr(self, field) + getattr(other, field) for field in self.as_dict()))
+
+    def as_dict(self):
+        return {
+            'received': self.received,
+            'duplicates': self.duplicates,
+            'created': self.created,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'skipped': self.skipped,
+        }
+
+
+def merge_from(cursor, source, params=()):
+    """
+    Выполняет слияние из источника (таблица или unnest) и возвращает счетчики.
+    """
+    cursor.execute(MERGE_SQL.format(source=source), params)
+    received, pairs, valid, created, updated = cursor.fetchone()
+    return MergeResult(
+        received=received,
+        duplicates=received - pairs,
+        created=created,
+        updated=updated,
+        unchanged=valid - created - updated,
+        skipped=pairs - valid,
+    )
+
+
+def upsert_subscriptions(rows):
+    """
+    Создает или обновляет подписки пакетом, одним запросом.
+
+    :param rows: кортежи (user_id, mailing_id, subscribed)
+    """
+    rows = list(rows)
+    if not rows:
+        return MergeResult()
+    user_ids, mailing_ids, subscribed = zip(*rows)
+    with transaction.atomic(), connection.cursor() as cursor:
+        return merge_from(cursor, UNNEST_SOURCE, [list(user_ids), list(mailing_ids), list(subscribed)])
@@ -1,110 +1,370 @@
+import logging
 from datetime import timedelta
 
-from celery import shared_task, group
-from django.core.mail import send_mail, BadHeaderError
-from django.core.cache import cache
+from celery import shared_task
+from celery.utils import uuid
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
 from django.utils.timezone import now
 
-from database.models import Mailing, Subscription, Order, Schedule
+from booking.availability import ACTIVE_ORDER_STATUSES
+from database.models import Mailing, MailingDelivery, Subscription, Order, Notification
+from notification.mailer import BulkSender
+from notification.ratelimit import RateLimiter
+from notification.inbox import notify
+from notification.rendering import CompiledTemplate, MailingTemplate, get_mailing_template
+from notification.routing import QUEUE_CRITICAL, current_queue, mailing_queue
+
+logger = logging.getLogger(__name__)
+
+# Строка в статусе sending дольше этого срока считается брошенной (воркер упал) и забирается снова
+DELIVERY_LEASE = timedelta(minutes=10)
+# Счетчик пакетов в очереди, который столько не менялся, считается утекшим
+INFLIGHT_TTL = timedelta(minutes=10)
+BACKPRESSURE_DELAY = 5
+REMINDER_CHUNK_SIZE = 500
+
+REMINDER_TEMPLATE = MailingTemplate(
+    subject="Напоминание о вашем бронировании",
+    body=(
+        "Уважаемый пользователь,\n\n"
+        "Ваше бронирование автобуса {{ bus_nickname }} начнется {{ trip_start }}.\n\n"
+        "Просим вас быть готовыми к поездке!\n"
+        "С уважением, Команда Маркетплейса"
+    ),
+)
+REMINDER_INBOX_TEMPLATE = CompiledTemplate("Бронирование автобуса {{ bus_nickname }} начнется {{ trip_start }}.")
+
+
+def _claim_deliveries(mailing_id, emails):
+    """
+    Забирает в отправку еще не доставленных получателей пакета.
+
+    Строки блокируются с SKIP LOCKED и переводятся в sending, поэтому параллельный
+    повтор той же задачи их не увидит. Возвращает {email: id строки журнала}.
+    """
+    with transaction.atomic():
+        rows = list(
+            MailingDelivery.objects.select_for_update(skip_locked=True)
+            .filter(mailing_id=mailing_id, email__in=emails)
+            .filter(Q(status='pending') | Q(status='sending', updated_at__lt=now() - DELIVERY_LEASE))
+            .values_list('email', 'id')
+        )
+        MailingDelivery.objects.filter(id__in=[pk for _, pk in rows]).update(
+            status='sending', attempts=F('attempts') + 1, updated_at=now()
+        )
+    return dict(rows)
+
+
+def _record_results(claimed, result, final):
+    """
+    Записывает итоги пакета в журнал: доставленные одним UPDATE,
+    ошибки с текстом - одним bulk_update.
+    """
+    timestamp = now()
+    if result.sent:
+        MailingDelivery.objects.filter(id__in=[claimed[email] for email in result.sent]).update(
+            status='sent', error='', updated_at=timestamp
+        )
+
+    errors = [(email, error, 'failed') for email, error in result.failed.items()]
+    errors += [(email, error, 'failed' if final else 'pending') for email, error in result.deferred.items()]
+    if errors:
+        MailingDelivery.objects.bulk_update(
+            [
+                MailingDelivery(id=claimed[email], status=status, error=error, updated_at=timestamp)
+                for email, error, status in errors
+            ],
+            ['status', 'error', 'updated_at'],
+        )
+
+
+def _release_claimed(claimed, error, final):
+    """
+    Возвращает забранные строки пакета после непредвиденной ошибки: в pending
+    для повтора или в failed, если попытки кончились. Уже отмеченные
+    доставленными не трогаются.
+    """
+    MailingDelivery.objects.filter(id__in=list(claimed.values()), status='sending').update(
+        status='failed' if final else 'pending', error=repr(error), updated_at=now()
+    )
+
+
+def _acquire_inflight(mailing_id):
+    moment = now()
+    Mailing.objects.filter(id=mailing_id).update(
+        # Счетчик без движения дольше INFLIGHT_TTL считается утекшим (воркер упал, не уменьшив его)
+        inflight_batches=Case(
+            When(inflight_updated_at__lt=moment - INFLIGHT_TTL, then=Value(1)),
+            default=F('inflight_batches') + 1,
+        ),
+        inflight_updated_at=moment,
+    )
+
+
+def _release_inflight(mailing_id):
+    Mailing.objects.filter(id=mailing_id, inflight_batches__gt=0).update(
+        inflight_batches=F('inflight_batches') - 1, inflight_updated_at=now()
+    )
+
+
+def _inflight_batches(mailing_id):
+    row = Mailing.objects.filter(id=mailing_id).values_list('inflight_batches', 'inflight_updated_at').first()
+    if row is None or row[1] is None or row[1] < now() - INFLIGHT_TTL:
+        return 0
+    return row[0]
 
 
 @shared_task(bind=True, max_retries=3)
-def send_email_batch(self, mailing_id, batch):
-    # Отправка пакета писем
-    failed_recipients = []
+def send_email_batch(self, mailing_id, start_id, end_id):
+    """
+    Отправка пакета рассылки через одно SMTP-соединение.
+
+    Пакет задается диапазоном id подписок, а не списком адресов: адреса
+    читаются здесь же, и в брокер не уходят большие сообщения.
+    """
+    retrying = False
     try:
-        mailing = Mailing.objects.get(id=mailing_id)
-    except Mailing.DoesNotExist:
-        raise ValueError(f"Mailing with id {mailing_id} does not exist.")
+        try:
+            template = get_mailing_template(mailing_id)
+        except Mailing.DoesNotExist:
+            raise ValueError(f"Mailing with id {mailing_id} does not exist.")
+
+        recipients = {
+            email: {'first_name': first_name, 'last_name': last_name}
+            for email, first_name, last_name in
+            Subscription.objects.filter(mailing_id=mailing_id, subscribed=True, id__range=(start_id, end_id))
+            .values_list("user__email", "user__first_name", "user__last_name")
+        }
+        MailingDelivery.objects.bulk_create(
+            [MailingDelivery(mailing_id=mailing_id, email=email) for email in recipients],
+            ignore_conflicts=True,
+        )
 
-    for email in batch:
+        claimed = _claim_deliveries(mailing_id, list(recipients))
+        if not claimed:
+            return f"Batch {start_id}-{end_id}: nothing left to send."
+
+        final = self.request.retries >= self.max_retries
+        sender = BulkSender(limiter=RateLimiter.for_queue(current_queue(self)))
         try:
-            send_mail(
-                subject=mailing.subject,
-                message=mailing.body,
-                from_email="noreply@example.com",
-                recipient_list=[email],
-                fail_silently=False,
-            )
-        except BadHeaderError:
-            failed_recipients.append(email)
+            result = sender.send((email, template.render(email, recipients[email])) for email in claimed)
+            _record_results(claimed, result, final)
         except Exception as exc:
-            raise self.retry(exc=exc, countdown=60)
+            # Без этого строки остались бы в sending: рассылка уже is_sent, и повторять пакет некому
+            countdown = 60
+            try:
+                _release_claimed(claimed, exc, final)
+            except Exception:
+                logger.exception("Mailing %s: could not release batch %s-%s", mailing_id, start_id, end_id)
+                # Строки вернет в работу только истечение аренды
+                countdown = DELIVERY_LEASE.total_seconds()
+            if final:
+                raise
+            retrying = True
+            raise self.retry(exc=exc, countdown=countdown)
 
-    if failed_recipients:
-        mailing.failed_recipients = (mailing.failed_recipients or "") + ", ".join(failed_recipients) + ";"
-        mailing.save()
+        if result.deferred and not final:
+            # Повтор с тем же диапазоном: уже доставленные адреса отсеет _claim_deliveries
+            retrying = True
+            raise self.retry(countdown=60)
 
-    return f"Batch of {len(batch)} emails sent."
+        return f"Batch {start_id}-{end_id}: {len(result.sent)} sent, {len(claimed) - len(result.sent)} failed."
+    finally:
+        if not retrying:
+            _release_inflight(mailing_id)
+
+
+def _renew_dispatch(mailing_id, task_id):
+    """
+    Продлевает аренду раздачи, если рассылка все еще принадлежит этой задаче.
+
+    Диспетчер при повторной раздаче записывает в task_id новую задачу, поэтому
+    задача, пролежавшая в очереди дольше аренды, увидит чужой task_id и остановится.
+    """
+    return Mailing.objects.filter(id=mailing_id, task_id=task_id, is_sent=False).update(dispatched_at=now()) == 1
 
 
 @shared_task(bind=True)
-def send_notification(self, mailing_id):
-    # Планирование уведомлений и отправка пакетов
-    try:
-        mailing = Mailing.objects.get(id=mailing_id)
-    except Mailing.DoesNotExist:
+def send_notification(self, mailing_id, after_id=0):
+    """
+    Потоковая раздача рассылки по пакетам.
+
+    Подписки обходятся по возрастанию id, на каждый пакет ставится задача
+    с диапазоном id. Если в очереди уже MAILING_MAX_INFLIGHT_BATCHES пакетов
+    этой рассылки, задача перезапускает себя с того же места через несколько
+    секунд, не занимая воркер ожиданием. В памяти только id одного пакета.
+    Пакеты уходят в очередь по типу рассылки (notification.routing).
+    Раздачу ведет только задача, записанная в Mailing.task_id (см. _renew_dispatch).
+    """
+    mailing_type = Mailing.objects.filter(id=mailing_id).values_list("mailing_type", flat=True).first()
+    if mailing_type is None:
         raise ValueError(f"Mailing with id {mailing_id} does not exist.")
+    queue = mailing_queue(mailing_type)
+
+    subscriptions = Subscription.objects.filter(mailing_id=mailing_id, subscribed=True).order_by("id")
+    enqueued = 0
+    while True:
+        # Аренда продлевается на каждом пакете, иначе диспетчер решит, что раздача потерялась
+        if not _renew_dispatch(mailing_id, self.request.id):
+            return f"{enqueued} recipients queued, mailing is dispatched by another task."
+
+        if _inflight_batches(mailing_id) >= settings.MAILING_MAX_INFLIGHT_BATCHES:
+            # Продолжение получает новый id и становится владельцем раздачи
+            task_id = uuid()
+            Mailing.objects.filter(id=mailing_id, task_id=self.request.id).update(task_id=task_id, dispatched_at=now())
+            send_notification.apply_async((mailing_id, after_id), countdown=BACKPRESSURE_DELAY, task_id=task_id)
+            return f"{enqueued} recipients queued, paused after subscription {after_id}."
+
+        ids = list(subscriptions.filter(id__gt=after_id).values_list("id", flat=True)[:settings.MAILING_BATCH_SIZE])
+        if not ids:
+            break
 
-    cache_key = f"mailing_subscriptions_{mailing_id}"
-    subscriptions = cache.get(cache_key)
-    if not subscriptions:
-        subscriptions = list(
-            Subscription.objects.filter(mailing=mailing, subscribed=True)
-            .values_list("user__email", flat=True)
+        _acquire_inflight(mailing_id)
+        send_email_batch.apply_async((mailing_id, ids[0], ids[-1]), queue=queue)
+        after_id = ids[-1]
+        enqueued += len(ids)
+
+    Mailing.objects.filter(id=mailing_id, task_id=self.request.id).update(is_sent=True)
+    return f"{enqueued} recipients queued, fan-out finished."
+
+
+def _claim_due_mailings(moment):
+    """
+    Забирает порцию рассылок, время которых наступило.
+
+    Берутся не начатые и те, у которых раздача давно не подавала признаков жизни.
+    Строки блокируются с SKIP LOCKED, поэтому параллельные диспетчеры не возьмут одно и то же.
+    Каждой рассылке сразу назначается id будущей задачи раздачи: прежняя задача,
+    если она все же выйдет из очереди, увидит чужой id и ничего не разошлет.
+    Возвращает {id рассылки: id задачи}.
+    """
+    stale = moment - timedelta(seconds=settings.MAILING_DISPATCH_LEASE)
+    with transaction.atomic():
+        ids = list(
+            Mailing.objects.select_for_update(skip_locked=True)
+            .filter(is_sent=False, send_time__lte=moment)
+            .filter(Q(dispatched_at__isnull=True) | Q(dispatched_at__lt=stale))
+            .order_by('send_time')
+            .values_list('id', flat=True)[:settings.MAILING_DISPATCH_BATCH_SIZE]
         )
-        cache.set(cache_key, subscriptions, timeout=60 * 10)  # Кэшируем на 10 минут
+        claimed = [Mailing(id=mailing_id, dispatched_at=moment, task_id=uuid()) for mailing_id in ids]
+        Mailing.objects.bulk_update(claimed, ['dispatched_at', 'task_id'])
+    return {mailing.id: mailing.task_id for mailing in claimed}
 
-    if not subscriptions:
-        mailing.failed_recipients = "No recipients found."
-        mailing.save()
-        return "No recipients to send the notification."
 
-    batch_size = 100
-    tasks = [
-        send_email_batch.s(mailing_id, subscriptions[i : i + batch_size])
-        for i in range(0, len(subscriptions), batch_size)
-    ]
-    group(tasks).apply_async()
+@shared_task
+def dispatch_due_mailings():
+    """
+    Периодический диспетчер рассылок (beat, раз в минуту).
+
+    Рассылки хранятся в базе до своего времени вместо задач с eta в памяти
+    воркеров, поэтому их число не ограничено, а перезапуск воркера ничего не теряет.
+    """
+    dispatched = 0
+    while True:
+        moment = now()
+        claimed = _claim_due_mailings(moment)
+        for mailing_id, task_id in claimed.items():
+            send_notification.apply_async((mailing_id,), task_id=task_id)
+        dispatched += len(claimed)
+        if len(claimed) < settings.MAILING_DISPATCH_BATCH_SIZE:
+            break
+    return f"{dispatched} mailings dispatched."
 
-    mailing.is_sent = True
-    mailing.save()
-    return f"Notification tasks for {len(subscriptions)} recipients created."
+
+def _claim_reminders(window_start, window_end):
+    """
+    Забирает очередную порцию броней для напоминания.
+
+    Блокируются с SKIP LOCKED только строки броней (без клиентов и автобусов,
+    которые нужны для письма) и сразу помечаются notification_sent=True,
+    поэтому параллельные запуски задачи получают непересекающиеся порции.
+    Данные для писем читаются вторым запросом, уже без блокировок.
+    """
+    with transaction.atomic():
+        ids = list(
+            Order.objects.select_for_update(skip_locked=True)
+            .filter(
+                notification_sent=False,
+                status__in=ACTIVE_ORDER_STATUSES,
+                time_range__startswith__gte=window_start,
+                time_range__startswith__lt=window_end,
+            )
+            .values_list('id', flat=True)
+            .order_by()[:REMINDER_CHUNK_SIZE]
+        )
+        Order.objects.filter(id__in=ids).update(notification_sent=True)
+
+    if not ids:
+        return []
+    return list(
+        Order.objects.filter(id__in=ids).values_list(
+            'id', 'id_client__user_id', 'id_client__user__email', 'id_transport__bus_nickname', 'time_range'
+        )
+    )
 
 
 @shared_task
 def send_booking_notifications():
-    # Уведомление о бронировании, которое наступит через 24 часа и не имеет другого уведомления
-    future_schedules = Schedule.objects.filter(
-        trip_start__range=(now(), now() + timedelta(hours=24)),
-        bus_id__order__notification_sent=False  # Проверяем по связанным заказам
-    ).select_related('bus_id')
-    
-    for schedule in future_schedules:
-        orders = Order.objects.filter(
-            id_transport=schedule.bus_id,
-            notification_sent=False
-        ).select_related('id_client__user', 'id_transport')
-        
-        for order in orders:
-            try:
-                send_mail(
-                    subject="Напоминание о вашем бронировании",
-                    message=(
-                        f"Уважаемый пользователь,\n\n"
-                        f"Ваше бронирование автобуса {order.id_transport.bus_nickname} "
-                        f"начнется {schedule.trip_start.strftime('%Y-%m-%d %H:%M')}.\n\n"
-                        "Просим вас быть готовыми к поездке!\n"
-                        "С уважением, Команда Маркетплейса"
-                    ),
-                    from_email="noreply@example.com",
-                    recipient_list=[order.id_client.user.email],
-                    fail_silently=False,
-                )
-                # Устанавливаем флаг, что уведомление отправлено
-                order.notification_sent = True
-                order.save()
-            except Exception as e:
-                print(f"Ошибка при отправке уведомления для заказа {order.id}: {e}")
+    """
+    Напоминания о бронированиях, которые начнутся в ближайшие 24 часа.
+
+    Одна выборка броней по началу поездки (без запроса на каждый рейс),
+    порции по REMINDER_CHUNK_SIZE уходят через одно SMTP-соединение.
+    Задачу можно запускать параллельно на нескольких воркерах: см. _claim_reminders.
+
+    Порция помечается отправленной до отправки: при ошибке задачи она
+    возвращается в работу, но если воркер убит посреди порции, ее напоминания
+    теряются. Это сознательный выбор "не больше одного раза": повторное
+    напоминание хуже пропущенного.
+    """
+    window_start = now()
+    window_end = window_start + timedelta(hours=24)
+    sent = failed = 0
+
+    while rows := _claim_reminders(window_start, window_end):
+        contexts = {
+            order_id: (user_id, email, {
+                'bus_nickname': bus_nickname,
+                'trip_start': time_range.lower.strftime('%Y-%m-%d %H:%M'),
+            })
+            for order_id, user_id, email, bus_nickname, time_range in rows
+        }
+        try:
+            messages = [
+                (order_id, REMINDER_TEMPLATE.render(email, context))
+                for order_id, (_, email, context) in contexts.items()
+            ]
+            result = BulkSender(limiter=RateLimiter.for_queue(QUEUE_CRITICAL)).send(messages)
+        except Exception:
+            # Непредвиденная ошибка до итогов отправки (шаблон, лимитер): порцию заберет следующий запуск
+            Order.objects.filter(id__in=list(contexts)).update(notification_sent=False)
+            raise
+
+        # Во входящие пишем и тем, чей адрес отклонен; отложенные получат уведомление при повторе
+        notify(
+            Notification(
+                booking_id=order_id,
+                user_id=contexts[order_id][0],
+                type='reminder',
+                message=REMINDER_INBOX_TEMPLATE.render(contexts[order_id][2]),
+            )
+            for order_id in contexts if order_id not in result.deferred
+        )
+
+        # Временные ошибки возвращаем, чтобы их подобрал следующий запуск;
+        # адреса, отклоненные сервером, повторять бессмысленно
+        if result.deferred:
+            Order.objects.filter(id__in=list(result.deferred)).update(notification_sent=False)
+        if result.failed or result.deferred:
+            logger.warning("Booking reminders were not sent for orders %s", [*result.failed, *result.deferred])
+        sent += len(result.sent)
+        failed += len(result.failed) + len(result.deferred)
 
+        if result.deferred:
+            # SMTP недоступен: нет смысла забирать следующие порции
+            break
 
+    return f"Booking reminders: {sent} sent, {failed} failed."
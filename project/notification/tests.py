@@ -0,0 +1,558 @@
+import asyncio
+import re
+import smtplib
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.core.mail.backends.locmem import EmailBackend
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+from redis import ConnectionError as RedisConnectionError
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from booking.tests import create_booking_data
+from database.models import CustomUser, Mailing, MailingDelivery, Notification, Order, Subscription
+from .exceptions import MailingInProgress
+from .mailer import FROM_EMAIL
+from .rendering import MailingTemplate, SkeletonMessage
+from .routing import QUEUE_BULK, QUEUE_DEFAULT
+from .serializers import MailingSerializer
+from .stream import CHANNEL_PREFIX, TICKET_TTL, NotificationHub, authenticate, issue_ticket
+from .subscriptions import MergeResult, upsert_subscriptions
+from .tasks import (
+    BACKPRESSURE_DELAY, DELIVERY_LEASE, _claim_deliveries, _claim_reminders, _renew_dispatch,
+    send_booking_notifications, send_email_batch, send_notification,
+)
+
+
+class FlakyBackend(EmailBackend):
+    """
+    Почтовый бэкенд в памяти с управляемыми ошибками по адресам получателей.
+
+    refused_once - временный отказ сервера (4xx) на первую попытку,
+    crash - непредвиденная ошибка на каждую попытку, crashes - на столько ближайших писем.
+    """
+    refused_once = set()
+    crash = set()
+    crashes = 0
+
+    @classmethod
+    def reset(cls):
+        cls.refused_once, cls.crash, cls.crashes = set(), set(), 0
+
+    def send_messages(self, messages):
+        for message in messages:
+            email, = message.to
+            if email in self.refused_once:
+                self.refused_once.discard(email)
+                raise smtplib.SMTPRecipientsRefused({email: (450, b'Mailbox busy')})
+            if email in self.crash or FlakyBackend.crashes:
+                FlakyBackend.crashes = max(FlakyBackend.crashes - 1, 0)
+                raise RuntimeError(f'Unexpected failure for {email}')
+        return super().send_messages(messages)
+
+
+def create_mailing(recipients, **fields):
+    """
+    Рассылка и подписки recipients пользователей в порядке id.
+    """
+    fields = {'send_time': now(), **fields}
+    mailing = Mailing.objects.create(subject='Новости {{ first_name }}', body='Здравствуйте, {{ first_name }}!',
+                                     **fields)
+    subscriptions = [
+        Subscription.objects.create(
+            mailing=mailing,
+            user=CustomUser.objects.create_user(f'user{i}.{mailing.id}@example.com', 'Mailing-password-1',
+                                                first_name=f'Имя{i}'),
+        )
+        for i in range(recipients)
+    ]
+    return mailing, subscriptions
+
+
+def emails(subscriptions):
+    return [subscription.user.email for subscription in subscriptions]
+
+
+@override_settings(
+    EMAIL_BACKEND='notification.tests.FlakyBackend',
+    NOTIFICATION_QUEUE_RATE_LIMITS={},
+    NOTIFICATION_PROVIDER_RATE_LIMIT=None,
+)
+class MailingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        FlakyBackend.reset()
+        self.addCleanup(FlakyBackend.reset)
+
+    def outbox(self):
+        return sorted(email for message in mail.outbox for email in message.to)
+
+    def deliveries(self, mailing):
+        return {
+            email: (status, attempts)
+            for email, status, attempts in
+            MailingDelivery.objects.filter(mailing=mailing).values_list('email', 'status', 'attempts')
+        }
+
+
+class ClaimDeliveriesTests(MailingTestCase):
+    def test_claims_pending_and_abandoned_rows(self):
+        mailing, _ = create_mailing(0)
+        stale = now() - DELIVERY_LEASE - timedelta(minutes=1)
+        rows = {
+            status: MailingDelivery.objects.create(mailing=mailing, email=f'{status}@example.com', status=status)
+            for status in ('pending', 'sending', 'sent', 'failed')
+        }
+        abandoned = MailingDelivery.objects.create(mailing=mailing, email='abandoned@example.com', status='sending')
+        # auto_now переписал бы updated_at при save(), update() - нет
+        MailingDelivery.objects.filter(id=abandoned.id).update(updated_at=stale)
+
+        claimed = _claim_deliveries(mailing.id, [row.email for row in rows.values()] + [abandoned.email])
+
+        self.assertEqual(claimed, {'pending@example.com': rows['pending'].id, abandoned.email: abandoned.id})
+        self.assertEqual(self.deliveries(mailing), {
+            'pending@example.com': ('sending', 1),
+            'sending@example.com': ('sending', 0),
+            'sent@example.com': ('sent', 0),
+            'failed@example.com': ('failed', 0),
+            'abandoned@example.com': ('sending', 1),
+        })
+
+    def test_claimed_rows_are_not_claimed_again(self):
+        mailing, _ = create_mailing(0)
+        MailingDelivery.objects.create(mailing=mailing, email='once@example.com')
+
+        self.assertEqual(len(_claim_deliveries(mailing.id, ['once@example.com'])), 1)
+        self.assertEqual(_claim_deliveries(mailing.id, ['once@example.com']), {})
+
+
+class SendEmailBatchTests(MailingTestCase):
+    def send(self, mailing, start_id, end_id):
+        Mailing.objects.filter(id=mailing.id).update(inflight_batches=1, inflight_updated_at=now())
+        return send_email_batch.apply(args=(mailing.id, start_id, end_id))
+
+    def test_range_bounds_are_inclusive(self):
+        mailing, subscriptions = create_mailing(5)
+        # Отписавшийся внутри диапазона письма не получает
+        Subscription.objects.filter(id=subscriptions[2].id).update(subscribed=False)
+
+        self.send(mailing, subscriptions[1].id, subscriptions[3].id)
+
+        expected = sorted(emails([subscriptions[1], subscriptions[3]]))
+        self.assertEqual(self.outbox(), expected)
+        self.assertEqual(sorted(self.deliveries(mailing)), expected)
+        bodies = {message.to[0]: message.body for message in mail.outbox}
+        self.assertEqual(bodies[subscriptions[1].user.email], 'Здравствуйте, Имя1!')
+
+    def test_retry_skips_delivered_rows(self):
+        mailing, subscriptions = create_mailing(3)
+        busy = subscriptions[0].user.email
+        FlakyBackend.refused_once.add(busy)
+
+        self.send(mailing, subscriptions[0].id, subscriptions[-1].id)
+
+        # Временный отказ повторяется пакетом, остальные адреса второй раз не отправляются
+        self.assertEqual(self.outbox(), sorted(emails(subscriptions)))
+        deliveries = self.deliveries(mailing)
+        self.assertEqual(deliveries.pop(busy), ('sent', 2))
+        self.assertEqual(set(deliveries.values()), {('sent', 1)})
+        self.assertEqual(Mailing.objects.get(id=mailing.id).inflight_batches, 0)
+
+    def test_failed_batch_releases_rows_for_retry(self):
+        mailing, subscriptions = create_mailing(2)
+        # Ошибка на первом письме: весь пакет возвращается в pending и уходит при повторе
+        FlakyBackend.crashes = 1
+
+        self.send(mailing, subscriptions[0].id, subscriptions[-1].id)
+
+        self.assertEqual(self.outbox(), sorted(emails(subscriptions)))
+        self.assertEqual(set(self.deliveries(mailing).values()), {('sent', 2)})
+
+    def test_failed_batch_gives_up_after_max_retries(self):
+        mailing, subscriptions = create_mailing(2)
+        FlakyBackend.crash.update(emails(subscriptions))
+
+        result = self.send(mailing, subscriptions[0].id, subscriptions[-1].id)
+
+        self.assertTrue(result.failed())
+        self.assertEqual(mail.outbox, [])
+        attempts = send_email_batch.max_retries + 1
+        self.assertEqual(set(self.deliveries(mailing).values()), {('failed', attempts)})
+        self.assertIn('Unexpected failure', MailingDelivery.objects.filter(mailing=mailing).first().error)
+        self.assertEqual(Mailing.objects.get(id=mailing.id).inflight_batches, 0)
+
+
+@override_settings(MAILING_BATCH_SIZE=2)
+class SendNotificationTests(MailingTestCase):
+    """
+    Раздача рассылки: пакеты и продолжения задачи перехватываются вместо отправки в брокер.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.mailing, self.subscriptions = create_mailing(5)
+        self.take_over('owner')
+
+    def take_over(self, task_id):
+        Mailing.objects.filter(id=self.mailing.id).update(task_id=task_id, dispatched_at=now() - timedelta(minutes=5))
+
+    def fan_out(self, task_id='owner'):
+        with mock.patch('notification.tasks.send_email_batch') as batches, \
+                mock.patch('notification.tasks.send_notification') as continuation:
+            result = send_notification.apply(args=(self.mailing.id,), task_id=task_id).get()
+        self.mailing.refresh_from_db()
+        return result, batches.apply_async, continuation.apply_async
+
+    def ranges(self, *pairs):
+        ids = [subscription.id for subscription in self.subscriptions]
+        return [mock.call((self.mailing.id, ids[start], ids[end]), queue=QUEUE_DEFAULT) for start, end in pairs]
+
+    def test_renew_dispatch_fence(self):
+        self.assertTrue(_renew_dispatch(self.mailing.id, 'owner'))
+        self.mailing.refresh_from_db()
+        self.assertGreater(self.mailing.dispatched_at, now() - timedelta(minutes=1))
+
+        self.assertFalse(_renew_dispatch(self.mailing.id, 'stale'))
+        Mailing.objects.filter(id=self.mailing.id).update(is_sent=True)
+        self.assertFalse(_renew_dispatch(self.mailing.id, 'owner'))
+
+    def test_fans_out_subscription_ranges(self):
+        result, batches, continuation = self.fan_out()
+
+        self.assertIn('fan-out finished', result)
+        self.assertEqual(batches.call_args_list, self.ranges((0, 1), (2, 3), (4, 4)))
+        continuation.assert_not_called()
+        self.assertTrue(self.mailing.is_sent)
+        self.assertEqual(self.mailing.inflight_batches, 3)
+
+    def test_superseded_task_sends_nothing(self):
+        # Диспетчер перераздал рассылку новой задаче, пока старая лежала в очереди
+        self.take_over('redispatched')
+
+        result, batches, continuation = self.fan_out('owner')
+
+        self.assertIn('dispatched by another task', result)
+        batches.assert_not_called()
+        continuation.assert_not_called()
+        self.assertFalse(self.mailing.is_sent)
+        self.assertEqual(self.mailing.task_id, 'redispatched')
+
+    @override_settings(MAILING_MAX_INFLIGHT_BATCHES=1)
+    def test_backpressure_continuation_owns_dispatch(self):
+        result, batches, continuation = self.fan_out()
+
+        self.assertIn('paused', result)
+        self.assertEqual(batches.call_args_list, self.ranges((0, 1)))
+        (args,), options = continuation.call_args
+        self.assertEqual(args, (self.mailing.id, self.subscriptions[1].id))
+        self.assertEqual(options['countdown'], BACKPRESSURE_DELAY)
+        # Продолжение - новый владелец раздачи, прежний id больше не продлевает аренду
+        self.assertNotEqual(options['task_id'], 'owner')
+        self.assertEqual(self.mailing.task_id, options['task_id'])
+        self.assertFalse(self.mailing.is_sent)
+        self.assertFalse(_renew_dispatch(self.mailing.id, 'owner'))
+
+
+class BookingReminderTests(MailingTestCase):
+    def setUp(self):
+        super().setUp()
+        _, self.client_user, _ = create_booking_data(buses=2)
+        start = now() + timedelta(hours=2)
+        Order.objects.update(time_range=DateTimeTZRange(start, start + timedelta(hours=2)))
+
+    def test_claim_marks_orders(self):
+        rows = _claim_reminders(now(), now() + timedelta(hours=24))
+
+        self.assertEqual(sorted(row[0] for row in rows), sorted(Order.objects.values_list('id', flat=True)))
+        self.assertEqual({row[2] for row in rows}, {self.client_user.email})
+        self.assertFalse(Order.objects.filter(notification_sent=False).exists())
+        self.assertEqual(_claim_reminders(now(), now() + timedelta(hours=24)), [])
+
+    def test_sends_each_reminder_once(self):
+        send_booking_notifications.apply()
+        send_booking_notifications.apply()
+
+        self.assertEqual(self.outbox(), [self.client_user.email] * 2)
+        self.assertEqual(Notification.objects.filter(type='reminder').count(), 2)
+
+    def test_failure_returns_orders(self):
+        FlakyBackend.crash.add(self.client_user.email)
+
+        self.assertTrue(send_booking_notifications.apply().failed())
+
+        self.assertFalse(Order.objects.filter(notification_sent=True).exists())
+
+
+class MailingTemplateTests(SimpleTestCase):
+    """
+    Письмо с готовым MIME-телом (SkeletonMessage) совпадает с собранным для каждого получателя.
+    """
+
+    def normalize(self, message, linesep):
+        raw = message.message().as_bytes(linesep=linesep)
+        # Date, Message-ID и boundary у каждого письма свои
+        raw = re.sub(rb'^(Date|Message-ID): .*$', rb'\1: -', raw, flags=re.MULTILINE)
+        for boundary in set(re.findall(rb'boundary="([^"]+)"', raw)):
+            raw = raw.replace(boundary, b'BOUNDARY')
+        return raw
+
+    def assertSameAsPerMessage(self, template, expected):
+        rendered = template.render('ivan@example.com', {'first_name': 'Иван'})
+
+        self.assertIsInstance(rendered, SkeletonMessage)
+        for linesep in ('\n', '\r\n'):
+            self.assertEqual(self.normalize(rendered, linesep), self.normalize(expected, linesep))
+
+    def test_plain(self):
+        template = MailingTemplate('Новости для {{ first_name }}', 'Текст рассылки\nвторая строка ' + 'х' * 200)
+
+        self.assertSameAsPerMessage(template, EmailMessage(
+            subject='Новости для Иван', body='Текст рассылки\nвторая строка ' + 'х' * 200,
+            from_email=FROM_EMAIL, to=['ivan@example.com'],
+        ))
+
+    def test_html(self):
+        template = MailingTemplate('Новости', 'Текст рассылки', '<p>Текст <b>рассылки</b></p>')
+
+        expected = EmailMultiAlternatives(subject='Новости', body='Текст рассылки', from_email=FROM_EMAIL,
+                                          to=['ivan@example.com'])
+        expected.attach_alternative('<p>Текст <b>рассылки</b></p>', 'text/html')
+        self.assertSameAsPerMessage(template, expected)
+
+    def test_verbatim_prints_template_syntax(self):
+        template = MailingTemplate('Тема', '{% verbatim %}{{ first_name }}{% endverbatim %}, {{ first_name }}')
+
+        self.assertEqual(template.render('ivan@example.com', {'first_name': 'Иван'}).body, '{{ first_name }}, Иван')
+
+
+class MailingApiTests(MailingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = APIClient()
+        self.api.force_authenticate(CustomUser.objects.create_superuser('admin@example.com', 'Admin-password-1'))
+
+    def test_promotion_batches_go_to_bulk_queue(self):
+        response = self.api.post(reverse('mailing-create'), {
+            'subject': 'Скидки', 'body': 'Текст', 'mailing_type': 'promotion',
+            'send_time': (now() + timedelta(days=1)).isoformat(),
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        mailing = Mailing.objects.get(id=response.json()['data']['id'])
+        self.assertEqual(mailing.mailing_type, 'promotion')
+
+        Subscription.objects.create(mailing=mailing, user=CustomUser.objects.create_user('reader@example.com', 'x'))
+        Mailing.objects.filter(id=mailing.id).update(task_id='owner')
+        with mock.patch('notification.tasks.send_email_batch') as batches:
+            send_notification.apply(args=(mailing.id,), task_id='owner').get()
+
+        self.assertEqual(batches.apply_async.call_args.kwargs['queue'], QUEUE_BULK)
+
+    def update(self, mailing, **data):
+        return self.api.patch(reverse('mailing-update', args=[mailing.id]), data, format='json')
+
+    def test_update_keeps_dispatch_columns(self):
+        mailing, _ = create_mailing(0, send_time=now() + timedelta(days=1))
+        stale = Mailing.objects.get(id=mailing.id)
+        # Раздача началась, пока правка держала старую копию строки
+        Mailing.objects.filter(id=mailing.id).update(task_id='owner', inflight_batches=2, is_sent=True)
+
+        serializer = MailingSerializer(stale, data={'subject': 'Новая тема'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        mailing.refresh_from_db()
+        self.assertEqual(mailing.subject, 'Новая тема')
+        self.assertEqual((mailing.task_id, mailing.inflight_batches, mailing.is_sent), ('owner', 2, True))
+
+    def test_update_before_dispatch(self):
+        mailing, _ = create_mailing(0, send_time=now() + timedelta(days=1))
+
+        response = self.update(mailing, body='Новый текст')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Mailing.objects.get(id=mailing.id).body, 'Новый текст')
+
+    def test_update_refused_while_dispatching(self):
+        mailing, _ = create_mailing(0, dispatched_at=now(), task_id='owner')
+
+        response = self.update(mailing, body='Новый текст')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['errors'], {'detail': [MailingInProgress.default_detail]})
+        self.assertEqual(Mailing.objects.get(id=mailing.id).body, mailing.body)
+
+
+class UpsertSubscriptionsTests(TestCase):
+    def setUp(self):
+        self.mailing, (self.subscription,) = create_mailing(1)
+        self.other = Mailing.objects.create(subject='Другая', body='Текст', send_time=now())
+        self.user = self.subscription.user
+
+    def subscriptions(self):
+        return dict(Subscription.objects.filter(user=self.user).values_list('mailing_id', 'subscribed'))
+
+    def test_last_duplicate_row_wins(self):
+        result = upsert_subscriptions([
+            (self.user.id, self.other.id, True),
+            (self.user.id, self.other.id, False),
+            (self.user.id, self.mailing.id, False),
+            (self.user.id, self.mailing.id, True),
+        ])
+
+        self.assertEqual(result, MergeResult(received=4, duplicates=2, created=1, unchanged=1))
+        self.assertEqual(self.subscriptions(), {self.mailing.id: True, self.other.id: False})
+
+    def test_updates_existing_subscription(self):
+        result = upsert_subscriptions([(self.user.id, self.mailing.id, False)])
+
+        self.assertEqual(result, MergeResult(received=1, updated=1))
+        self.assertEqual(Subscription.objects.get(id=self.subscription.id).subscribed, False)
+
+        self.assertEqual(upsert_subscriptions([(self.user.id, self.mailing.id, False)]),
+                         MergeResult(received=1, unchanged=1))
+
+    def test_unknown_user_or_mailing_skipped(self):
+        result = upsert_subscriptions([
+            (self.user.id, self.other.id, True),
+            (self.user.id, self.other.id + 1000, True),
+            (self.user.id + 1000, self.mailing.id, True),
+        ])
+
+        self.assertEqual(result, MergeResult(received=3, created=1, skipped=2))
+        self.assertEqual(self.subscriptions(), {self.mailing.id: True, self.other.id: True})
+
+    def test_counters_add_up(self):
+        self.assertEqual(
+            MergeResult(1, 2, 3, 4, 5, 6) + MergeResult(received=1, skipped=1),
+            MergeResult(received=2, duplicates=2, created=3, updated=4, unchanged=5, skipped=7),
+        )
+
+
+class StreamAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('stream@example.com', 'Stream-password-1')
+        self.token = AccessToken.for_user(self.user)
+
+    def header(self, token):
+        return f'Bearer {token}'.encode()
+
+    def test_ticket_is_single_use(self):
+        ticket = issue_ticket(self.token)
+
+        self.assertEqual(authenticate(None, ticket), self.user.id)
+        self.assertIsNone(authenticate(None, ticket))
+
+    def test_expired_ticket_rejected(self):
+        ticket = issue_ticket(self.token)
+
+        with mock.patch('django.core.signing.time.time', return_value=time.time() + TICKET_TTL + 1):
+            self.assertIsNone(authenticate(None, ticket))
+
+    def test_tampered_ticket_rejected(self):
+        ticket = issue_ticket(self.token)
+
+        self.assertIsNone(authenticate(None, ticket[:-1] + ('A' if ticket[-1] != 'A' else 'B')))
+        self.assertIsNone(authenticate(None, ''))
+
+    def test_ticket_endpoint(self):
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+        response = api.post(reverse('notification-stream-ticket'))
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual(data['expires_in'], TICKET_TTL)
+        self.assertEqual(authenticate(None, data['ticket']), self.user.id)
+
+    def test_header(self):
+        self.assertEqual(authenticate(self.header(self.token)), self.user.id)
+        self.assertIsNone(authenticate(self.header('not-a-token')))
+        self.assertIsNone(authenticate(b'Basic abc'))
+
+    def test_inactive_user_rejected(self):
+        user = CustomUser.objects.create_user('inactive@example.com', 'Stream-password-1', is_active=False)
+
+        self.assertIsNone(authenticate(self.header(AccessToken.for_user(user))))
+        self.assertIsNone(authenticate(None, issue_ticket(AccessToken.for_user(user))))
+
+    def test_user_read_from_cache(self):
+        authenticate(self.header(self.token))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(authenticate(self.header(self.token)), self.user.id)
+
+
+class FakePubSub:
+    """
+    Подписка redis.asyncio: первое подключение обрывается, второе отдает события.
+    """
+
+    def __init__(self, events, fail):
+        self.events = events
+        self.fail = fail
+
+    async def psubscribe(self, pattern):
+        if self.fail:
+            raise RedisConnectionError('Connection refused')
+
+    async def listen(self):
+        for event in self.events:
+            yield event
+        await asyncio.Event().wait()
+
+    async def aclose(self):
+        pass
+
+
+class FakeRedis:
+    connections = 0
+
+    def __init__(self, events):
+        self.events = events
+        FakeRedis.connections += 1
+        self.fail = FakeRedis.connections == 1
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FakePubSub(self.events, self.fail)
+
+    async def aclose(self):
+        pass
+
+
+@override_settings(REDIS_URL='redis://stream-test')
+class NotificationHubReaderTests(SimpleTestCase):
+    def test_reader_reconnects_after_redis_error(self):
+        events = [
+            {'channel': f'{CHANNEL_PREFIX}bad'.encode(), 'data': b'{}'},
+            {'channel': f'{CHANNEL_PREFIX}7'.encode(), 'data': b'{"event": "notification", "data": 1}'},
+        ]
+        FakeRedis.connections = 0
+        hub = NotificationHub()
+
+        async def receive():
+            queue = await hub.subscribe(7)
+            try:
+                return await asyncio.wait_for(queue.get(), timeout=5)
+            finally:
+                hub._reader.cancel()
+
+        with mock.patch('redis.asyncio.Redis.from_url', side_effect=lambda url: FakeRedis(events)), \
+                mock.patch('notification.stream.READER_RETRY', 0), \
+                self.assertLogs('notification.stream', 'WARNING') as logs:
+            message = asyncio.run(receive())
+
+        self.assertEqual(message, {'event': 'notification', 'data': 1})
+        self.assertEqual(FakeRedis.connections, 2)
+        self.assertEqual([record.levelname for record in logs.records], ['ERROR', 'WARNING'])
+        self.assertEqual(hub._reader_failures, 0)
@@ -1,12 +1,20 @@
 from django.urls import path
 from notification.views import MailingListView, MailingCreateView, MailingUpdateView, MailingDeleteView, \
-    subscribe_to_mailing, unsubscribe_from_mailing
+    subscribe_to_mailing, unsubscribe_from_mailing, subscribe_bulk, subscriptions_import, InboxListView, \
+    inbox_unread_count, inbox_mark_read, notification_stream, notification_stream_ticket
 
 urlpatterns = [
     path('', MailingListView.as_view(), name='mailing-list'),
     path('create/', MailingCreateView.as_view(), name='mailing-create'),
     path('<int:pk>/update/', MailingUpdateView.as_view(), name='mailing-update'),
     path('<int:pk>/delete/', MailingDeleteView.as_view(), name='mailing-delete'),
-    path('subscribe/', subscribe_to_mailing, name='mailing-subscribe'),
-    path('unsubscribe/', unsubscribe_from_mailing, name='mailing-unsubscribe'),
+    path('<int:mailing_id>/subscribe/', subscribe_to_mailing, name='mailing-subscribe'),
+    path('<int:mailing_id>/unsubscribe/', unsubscribe_from_mailing, name='mailing-unsubscribe'),
+    path('subscribe/bulk/', subscribe_bulk, name='mailing-subscribe-bulk'),
+    path('subscriptions/import/', subscriptions_import, name='subscriptions-import'),
+    path('inbox/', InboxListView.as_view(), name='inbox-list'),
+    path('inbox/unread-count/', inbox_unread_count, name='inbox-unread-count'),
+    path('inbox/mark-read/', inbox_mark_read, name='inbox-mark-read'),
+    path('stream/', notification_stream, name='notification-stream'),
+    path('stream/ticket/', notification_stream_ticket, name='notification-stream-ticket'),
 ]
@@ -1,19 +1,42 @@
 from drf_yasg.utils import swagger_auto_schema
-from rest_framework import generics, permissions
+from rest_framework import generics, permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.utils.timezone import now
-from celery import current_app
-from database.models import Mailing, Subscription
+from django.db import transaction
+from django.http import JsonResponse
+from database.models import Mailing, MailingDelivery, Notification
+from project.pagination import KeysetPagination, RequiredKeysetPagination
 from project.utils import StandardResponseMixin
-from .serializers import MailingSerializer
-from .tasks import send_notification
+from .exceptions import MailingInProgress
+from .inbox import mark_read, unread_count
+from .serializers import MailingSerializer, NotificationSerializer, MarkReadSerializer, \
+    BulkSubscriptionSerializer, MySubscriptionsSerializer
+from .stream import TICKET_TTL, issue_ticket
+from .subscriptions import upsert_subscriptions
+from .tasks import dispatch_due_mailings
+
+
+def delivery_count(status):
+    # Подзапрос по индексу (mailing, status) на каждую строку страницы, без GROUP BY по всему журналу
+    deliveries = (
+        MailingDelivery.objects.filter(mailing=OuterRef('pk'), status=status)
+        .order_by().values('mailing').annotate(count=Count('id')).values('count')
+    )
+    return Coalesce(Subquery(deliveries), 0)
 
 
 class MailingListView(StandardResponseMixin, generics.ListAPIView):
-    queryset = Mailing.objects.all().order_by('send_time')
+    queryset = Mailing.objects.annotate(
+        sent_count=delivery_count('sent'),
+        failed_count=delivery_count('failed'),
+    ).order_by('send_time')
     serializer_class = MailingSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = KeysetPagination
+    cursor_ordering = ('send_time', 'id')
 
     @swagger_auto_schema(
         tags=["[notification] уведомления (в разработке)"],
@@ -30,10 +53,9 @@ class MailingCreateView(StandardResponseMixin, generics.CreateAPIView):
 
     def perform_create(self, serializer):
         mailing = serializer.save()
-        if mailing.send_time and mailing.send_time > now():
-            task = send_notification.apply_async((mailing.id,), eta=mailing.send_time)
-            mailing.task_id = task.id
-            mailing.save()
+        # Отложенные рассылки забирает dispatch_due_mailings, срочную не ждем до следующей минуты
+        if mailing.send_time <= now():
+            transaction.on_commit(dispatch_due_mailings.delay)
 
     @swagger_auto_schema(
         tags=["[notification] уведомления (в разработке)"],
@@ -49,13 +71,16 @@ class MailingUpdateView(StandardResponseMixin, generics.UpdateAPIView):
     permission_classes = [permissions.IsAdminUser]
 
     def perform_update(self, serializer):
-        mailing = serializer.save()
-        if not mailing.is_sent and mailing.send_time > now():
-            if mailing.task_id:
-                current_app.control.revoke(mailing.task_id, terminate=True)  # Отзываем задачу
-            task = send_notification.apply_async((mailing.id,), eta=mailing.send_time)
-            mailing.task_id = task.id
-            mailing.save()
+        # Строка блокируется до конца сохранения: диспетчер (SKIP LOCKED) не заберет ее посреди правки
+        with transaction.atomic():
+            dispatched_at, is_sent = (
+                Mailing.objects.select_for_update().filter(id=serializer.instance.id)
+                .values_list('dispatched_at', 'is_sent').get()
+            )
+            # Пакеты уже читают текст рассылки: правка разослала бы часть писем в новой редакции
+            if dispatched_at is not None and not is_sent:
+                raise MailingInProgress()
+            serializer.save()
 
     @swagger_auto_schema(
         tags=["[notification] уведомления (в разработке)"],
@@ -77,11 +102,6 @@ class MailingDeleteView(StandardResponseMixin, generics.DestroyAPIView):
     serializer_class = MailingSerializer
     permission_classes = [permissions.IsAdminUser]
 
-    def perform_destroy(self, instance):
-        if instance.task_id:
-            current_app.control.revoke(instance.task_id, terminate=True)
-        super().perform_destroy(instance)
-
     @swagger_auto_schema(
         tags=["[notification] уведомления (в разработке)"],
         operation_description="Удалить уведомление по айди.",
@@ -98,14 +118,8 @@ class MailingDeleteView(StandardResponseMixin, generics.DestroyAPIView):
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def subscribe_to_mailing(request, mailing_id):
-    subscription, created = Subscription.objects.get_or_create(
-        user=request.user,
-        mailing_id=mailing_id,
-        defaults={'subscribed': True}
-    )
-    if not created:
-        subscription.subscribed = True
-        subscription.save()
+    if upsert_subscriptions([(request.user.id, mailing_id, True)]).skipped:
+        return Response({"error": "Mailing not found"}, status=status.HTTP_404_NOT_FOUND)
     return Response({"message": "Subscribed successfully"})
 
 
@@ -117,10 +131,116 @@ def subscribe_to_mailing(request, mailing_id):
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def unsubscribe_from_mailing(request, mailing_id):
-    try:
-        subscription = Subscription.objects.get(user=request.user, mailing_id=mailing_id)
-        subscription.subscribed = False
-        subscription.save()
-    except Subscription.DoesNotExist:
-        pass
+    # Отписка от рассылки без подписки оставляет строку с subscribed=False - повторная подписка ее обновит
+    upsert_subscriptions([(request.user.id, mailing_id, False)])
     return Response({"message": "Unsubscribed successfully"})
+
+
+@swagger_auto_schema(
+    method='post',
+    request_body=MySubscriptionsSerializer,
+    tags=["[notification] уведомления (в разработке)"],
+    operation_description="Подписаться на несколько рассылок или отписаться от них одним запросом.",
+)
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def subscribe_bulk(request):
+    serializer = MySubscriptionsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    subscribed = serializer.validated_data['subscribed']
+    result = upsert_subscriptions(
+        (request.user.id, mailing_id, subscribed) for mailing_id in serializer.validated_data['mailings']
+    )
+    return Response(result.as_dict())
+
+
+@swagger_auto_schema(
+    method='post',
+    request_body=BulkSubscriptionSerializer,
+    tags=["[notification] уведомления (в разработке)"],
+    operation_description="Импорт подписок (user, mailing, subscribed) пакетом до 10 тысяч строк. "
+                          "Строки с несуществующим пользователем или рассылкой пропускаются.",
+)
+@api_view(['POST'])
+@permission_classes([permissions.IsAdminUser])
+def subscriptions_import(request):
+    serializer = BulkSubscriptionSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    result = upsert_subscriptions(
+        (row['user'], row['mailing'], row['subscribed']) for row in serializer.validated_data['subscriptions']
+    )
+    return Response(result.as_dict())
+
+
+class InboxListView(StandardResponseMixin, generics.ListAPIView):
+    serializer_class = NotificationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = RequiredKeysetPagination
+    cursor_ordering = ('-sent_at', '-id')
+
+    def get_queryset(self):
+        # Индексы notification_inbox_idx и notification_unread_idx (read_status=False): (user, -sent_at, -id)
+        queryset = Notification.objects.filter(user=self.request.user)
+        if self.request.query_params.get('unread') in ('1', 'true'):
+            queryset = queryset.filter(read_status=False)
+        return queryset.order_by('-sent_at', '-id')
+
+    @swagger_auto_schema(
+        tags=["[notification] уведомления (в разработке)"],
+        operation_description="Входящие уведомления пользователя страницами по 50 (cursor, page_size до 500). "
+                              "?unread=true - только непрочитанные.",
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+@swagger_auto_schema(
+    method='get',
+    tags=["[notification] уведомления (в разработке)"],
+    operation_description="Число непрочитанных уведомлений (для значка).",
+)
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def inbox_unread_count(request):
+    return Response({"unread": unread_count(request.user)})
+
+
+@swagger_auto_schema(
+    method='post',
+    request_body=MarkReadSerializer,
+    tags=["[notification] уведомления (в разработке)"],
+    operation_description="Отметить уведомления прочитанными.",
+)
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def inbox_mark_read(request):
+    serializer = MarkReadSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    marked = mark_read(request.user, serializer.validated_data.get('ids'))
+    return Response({"marked": marked, "unread": unread_count(request.user)})
+
+
+@swagger_auto_schema(
+    method='post',
+    tags=["[notification] уведомления (в разработке)"],
+    operation_description="Одноразовый билет для подключения к потоку уведомлений: "
+                          "stream/?ticket=<ticket> в течение expires_in секунд.",
+)
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def notification_stream_ticket(request):
+    return Response({"ticket": issue_ticket(request.auth), "expires_in": TICKET_TTL})
+
+
+def notification_stream(request):
+    """
+    Поток событий пользователя (Server-Sent Events): новые уведомления и смена статуса брони.
+
+    Поток обслуживает только ASGI: этот путь перехватывает notification.stream.StreamRouter,
+    и представление не вызывается. Под WSGI и runserver бесконечный ответ занял бы
+    обработчик навсегда, поэтому здесь - 501.
+    """
+    return JsonResponse(
+        {"error": "Notification stream requires an ASGI server (uvicorn project.asgi:application)."},
+        status=501,
+    )
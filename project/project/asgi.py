@@ -14,3 +14,14 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
 application = get_asgi_application()
+
+# Поток уведомлений обслуживается в обход обработчика Django, без потока на подключение
+from django.urls import reverse  # noqa: E402
+from notification.stream import StreamRouter  # noqa: E402
+
+application = StreamRouter(application, reverse('notification-stream'))
+
+# Прогрев индекса городов для автодополнения
+from booking.cities import city_index  # noqa: E402
+
+city_index.warm()
@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'cache_generation_{}'
+
+_metrics = Counter()
+_metrics_lock = threading.Lock()
+
+# Фоновое обновление устаревших записей: запрос отдает старое значение и не ждет пересчета
+refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='cache-refresh')
+
+
+def generation_key(model):
+    return GENERATION_KEY.format(model._meta.label_lower)
+
+
+def bump_generation(*models):
+    """
+    Увеличивает счетчик поколения моделей.
+
+    Ключи кэша включают поколения всех моделей, от которых зависит ответ,
+    поэтому после увеличения счетчика старые записи просто перестают читаться.
+    """
+    for model in models:
+        increment(generation_key(model))
+
+
+def increment(key):
+    """
+    Атомарно увеличивает бессрочный счетчик в кэше, создавая его при первом вызове.
+    """
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def get_generations(models):
+    keys = [generation_key(model) for model in models]
+    values = cache.get_many(keys)
+    return [values.get(key, 0) for key in keys]
+
+
+def record_metric(prefix, name):
+    with _metrics_lock:
+        _metrics[(prefix, name)] += 1
+
+
+def get_metrics():
+    """
+    Счетчики попаданий и промахов кэша текущего процесса.
+
+    :return: {prefix: {"hit": n, "miss": n, "stale": n, "coalesced": n}}
+    """
+    with _metrics_lock:
+        result = {}
+        for (prefix, name), value in _metrics.items():
+            result.setdefault(prefix, {})[name] = value
+        return result
+
+
+def _store(key, value, timeout, stale_timeout):
+    cache.set(key, (time.time() + timeout, value), timeout=timeout + stale_timeout)
+
+
+def _refresh(key, compute, timeout, stale_timeout, lock_key):
+    try:
+        value, cacheable = compute()
+        if cacheable:
+            _store(key, value, timeout, stale_timeout)
+    except Exception:
+        logger.exception("Background refresh of %s failed", key)
+    finally:
+        cache.delete(lock_key)
+        # Соединения с базой у потока свои, закрываем их после пересчета
+        connections.close_all()
+
+
+def get_or_compute(key, compute, timeout, stale_timeout, metric_prefix='', lock_timeout=10, wait_timeout=2.0):
+    """
+    Возвращает значение из кэша или вычисляет его.
+
+    - Свежая запись отдается сразу.
+    - Устаревшая запись (старше timeout, но младше timeout + stale_timeout)
+      отдается всем запросам, а пересчитывает ее в фоновом потоке тот, кто
+      взял блокировку.
+    - При промахе значение вычисляет один запрос, остальные ждут его результат
+      до wait_timeout секунд, а потом считают сами.
+
+    Блокировки и записи видны всем процессам только в общем кэше (Redis),
+    поэтому CacheResponseMixin без него не кэширует (RESPONSE_CACHE).
+
+    :param compute: функция, возвращающая пару (value, cacheable)
+    """
+    lock_key = f'{key}_lock'
+    entry = cache.get(key)
+
+    if entry is not None:
+        fresh_until, value = entry
+        if time.time() < fresh_until:
+            record_metric(metric_prefix, 'hit')
+            return value
+        record_metric(metric_prefix, 'stale')
+        if cache.add(lock_key, 1, timeout=lock_timeout):
+            refresh_executor.submit(_refresh, key, compute, timeout, stale_timeout, lock_key)
+        return value
+
+    if not cache.add(lock_key, 1, timeout=lock_timeout):
+        deadline = time.monotonic() + wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                record_metric(metric_prefix, 'coalesced')
+                return entry[1]
+        record_metric(metric_prefix, 'miss')
+        return compute()[0]
+
+    record_metric(metric_prefix, 'miss')
+    try:
+        value, cacheable = compute()
+        if cacheable:
+            _store(key, value, timeout, stale_timeout)
+    finally:
+        cache.delete(lock_key)
+    return value
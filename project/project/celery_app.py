@@ -16,13 +16,15 @@ def debug_task(self):
     print(f'Request: {self.request!r}')
 
 
-CELERY_BEAT_SCHEDULE = {
-    'send_notification': {
-        'task': 'notification.tasks.send_notification',
-        'schedule': crontab(hour='10', minute='0'),
+# Расписание передается в app.conf, иначе beat его не видит. Рассылки не планируются
+# через eta: раз в минуту диспетчер сам забирает из базы те, чье время наступило.
+app.conf.beat_schedule = {
+    'dispatch_due_mailings': {
+        'task': 'notification.tasks.dispatch_due_mailings',
+        'schedule': crontab(),  # Каждую минуту
     },
     'send_booking_notifications': {
         'task': 'notification.tasks.send_booking_notifications',
-        'schedule': crontab(minute='*/30'), # Каждые 30 минут
+        'schedule': crontab(minute='*/30'),  # Каждые 30 минут
     },
 }
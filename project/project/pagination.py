@@ -0,0 +1,194 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Model, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def _encode_value(value):
+    if isinstance(value, Model):
+        value = value.pk
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _resolve_field(model, path):
+    """
+    Поле модели по пути ORM (id_route__id_from) или None, если путь - не поле (аннотация).
+    """
+    field = None
+    for part in path.split('__'):
+        if model is None:
+            return None
+        try:
+            field = model._meta.pk if part == 'pk' else model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+        model = field.related_model
+    return field
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная (keyset) пагинация по индексированным колонкам.
+
+    Следующая страница выбирается условием по значениям ключа последней строки,
+    а не OFFSET, поэтому время ответа не зависит от глубины страницы.
+    Порядок берется из OrderingFilter (если клиент его передал) или из
+    атрибута представления cursor_ordering; в конец всегда добавляется id.
+
+    Пагинация включается, только если в запросе передан cursor или page_size,
+    иначе ответ остается прежним списком (optional = False - всегда).
+    """
+    optional = True
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 50
+    max_page_size = 500
+    ordering = ('-id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, request, queryset, view):
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, OrderingFilter) and backend.ordering_param in request.query_params:
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+
+        if not ordering:
+            ordering = getattr(view, 'cursor_ordering', self.ordering)
+
+        ordering = list(ordering)
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            # id делает порядок строгим, иначе строки с одинаковым ключом потеряются
+            ordering.append('-id' if ordering[0].startswith('-') else 'id')
+        return [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+
+    def encode_cursor(self, values):
+        raw = json.dumps([_encode_value(value) for value in values], separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor, model):
+        """
+        Значения ключа из курсора, приведенные полями модели: курсор приходит
+        от клиента, и неверное значение должно дать 404, а не ошибку в filter().
+        """
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.keys):
+            raise NotFound(self.invalid_cursor_message)
+
+        converted = []
+        for (name, _), value in zip(self.keys, values):
+            field = _resolve_field(model, name)
+            try:
+                if field is not None:
+                    value = field.to_python(value)
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            if value is None or isinstance(value, (list, dict)):
+                raise NotFound(self.invalid_cursor_message)
+            converted.append(value)
+        return converted
+
+    def get_cursor_filter(self, values):
+        """
+        Условие "строго после курсора" для составного ключа.
+
+        Дополнительное нестрогое условие по первой колонке ограничивает
+        диапазон сканирования индекса, остальные отсекают совпадения.
+        """
+        first_name, first_desc = self.keys[0]
+        bound = Q(**{f'{first_name}__{"lte" if first_desc else "gte"}': values[0]})
+
+        after = Q()
+        for i, (name, desc) in enumerate(self.keys):
+            condition = Q(**{f'{name}__{"lt" if desc else "gt"}': values[i]})
+            for j, (prev_name, _) in enumerate(self.keys[:i]):
+                condition &= Q(**{prev_name: values[j]})
+            after |= condition
+        return bound & after
+
+    @staticmethod
+    def get_item_value(item, name):
+        if isinstance(item, dict):
+            return item[name]
+        for part in name.split('__'):
+            item = getattr(item, part)
+        return item
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if self.optional and cursor is None and self.page_size_query_param not in request.query_params:
+            return None
+
+        self.request = request
+        self.page_size_value = self.get_page_size(request)
+        self.keys = self.get_ordering(request, queryset, view)
+        self.key_names = [name for name, _ in self.keys]
+
+        queryset = queryset.order_by(*[f'-{name}' if desc else name for name, desc in self.keys])
+        if queryset._fields:
+            # Проекция values(): ключи курсора должны быть среди колонок строки
+            missing = [name for name in self.key_names if name not in queryset._fields]
+            if missing:
+                queryset = queryset.values(*queryset._fields, *missing)
+        if cursor:
+            queryset = queryset.filter(self.get_cursor_filter(self.decode_cursor(cursor, queryset.model)))
+
+        # Берем на одну строку больше, чтобы узнать, есть ли следующая страница
+        page = list(queryset[:self.page_size_value + 1])
+        self.has_next = len(page) > self.page_size_value
+        self.page = page[:self.page_size_value]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        cursor = self.encode_cursor([self.get_item_value(last, name) for name in self.key_names])
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class RequiredKeysetPagination(KeysetPagination):
+    """
+    Курсорная пагинация для новых списков без старых клиентов: запрос без
+    cursor и page_size получает первую страницу из page_size строк.
+    """
+    optional = False
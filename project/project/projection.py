@@ -0,0 +1,127 @@
+from django.contrib.postgres.fields.utils import AttributeSetter
+from rest_framework.response import Response
+
+
+class Column:
+    """
+    Колонка проекции: путь для queryset.values() и необязательное преобразование значения.
+
+    :param path: путь в нотации ORM (id_route__id_from)
+    :param convert: функция от значения или имя метода сериализатора
+    """
+
+    __slots__ = ('path', 'convert')
+
+    def __init__(self, path, convert=None):
+        self.path = path
+        self.convert = convert
+
+
+def prefixed(spec, prefix):
+    """
+    Те же поля через связь, например поля автобуса из брони: prefixed(fields, 'id_transport__').
+    """
+    result = {}
+    for name, item in spec.items():
+        if isinstance(item, dict):
+            result[name] = prefixed(item, prefix)
+        elif isinstance(item, Column):
+            result[name] = Column(prefix + item.path, item.convert)
+        else:
+            result[name] = prefix + item
+    return result
+
+
+def model_field_string(field):
+    """
+    Преобразование как у ModelField в DRF: строковое представление поля модели.
+    """
+    return lambda value: field.value_to_string(AttributeSetter(field.attname, value))
+
+
+def _columns(spec):
+    columns = []
+    for item in spec.values():
+        if isinstance(item, dict):
+            columns += _columns(item)
+        else:
+            columns.append(item.path if isinstance(item, Column) else item)
+    return columns
+
+
+class ProjectionSerializer:
+    """
+    Сериализатор только для чтения списков: строки queryset.values() -> словари ответа.
+
+    fields описывает ответ: имя -> путь в values(), Column или вложенный словарь.
+    Колонки вычисляются один раз при объявлении класса, на строку остается
+    сборка словаря без полей DRF (get_attribute, to_representation, ReturnDict).
+    Проекция - один SELECT с join, поэтому число запросов не зависит от числа строк.
+
+    В ответ попадают те же значения, что у обычного сериализатора представления,
+    а для документации и записи представление оставляет прежний serializer_class.
+    """
+    fields = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.columns = tuple(dict.fromkeys(_columns(cls.fields)))
+
+    def __init__(self, instance=None, many=False, context=None):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+        self._build = self._compile(self.fields)
+
+    @classmethod
+    def project(cls, queryset):
+        # Аннотации (ключи сортировки фильтров) остаются в строке: по ним строится курсор
+        return queryset.values(*cls.columns, *queryset.query.annotation_select)
+
+    def _compile(self, spec):
+        parts = []
+        for name, item in spec.items():
+            if isinstance(item, dict):
+                parts.append((name, None, self._compile(item)))
+                continue
+            column = item if isinstance(item, Column) else Column(item)
+            convert = column.convert
+            if isinstance(convert, str):
+                convert = getattr(self, convert)
+            parts.append((name, column.path, convert))
+
+        def build(row):
+            result = {}
+            for name, path, convert in parts:
+                if path is None:
+                    result[name] = convert(row)
+                elif convert is None:
+                    result[name] = row[path]
+                else:
+                    value = row[path]
+                    result[name] = None if value is None else convert(value)
+            return result
+        return build
+
+    @property
+    def data(self):
+        if self.many:
+            return [self._build(row) for row in self.instance]
+        return self._build(self.instance)
+
+
+class ProjectionListMixin:
+    """
+    list() через ProjectionSerializer из projection_class: фильтры и сортировка
+    применяются к обычному queryset, затем выбираются только нужные колонки.
+    """
+    projection_class = None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.projection_class.project(self.filter_queryset(self.get_queryset()))
+        context = self.get_serializer_context()
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.projection_class(page, many=True, context=context).data)
+        return Response(self.projection_class(queryset, many=True, context=context).data)
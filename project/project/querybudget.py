@@ -0,0 +1,110 @@
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Один и тот же SQL (с разными параметрами) столько раз за запрос - признак N+1
+REPEATED_QUERY_THRESHOLD = 3
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    """
+    Обертка выполнения запросов (connection.execute_wrapper): считает запросы
+    и одинаковые тексты SQL. Параметры в тексте не участвуют, поэтому запросы
+    в цикле по строкам сворачиваются в один шаблон.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        self.statements[sql] += 1
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold=REPEATED_QUERY_THRESHOLD):
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= threshold]
+
+
+def check_budget(name, budget, counter):
+    """
+    Сравнивает число запросов с бюджетом. Реакция задается QUERY_BUDGET_MODE:
+    raise - исключение (тесты), log - предупреждение с повторяющимися запросами
+    (staging), off - без проверки.
+    """
+    if counter.count <= budget:
+        return
+
+    repeated = counter.repeated()
+    message = f"{name}: {counter.count} queries, budget {budget}"
+    if settings.QUERY_BUDGET_MODE == 'raise':
+        details = ''.join(f"\n  {count} x {sql}" for sql, count in repeated)
+        raise QueryBudgetExceeded(message + details)
+    logger.warning(message, extra={'repeated_queries': repeated})
+    for sql, count in repeated:
+        logger.warning("%s: possible N+1, %s x %s", name, count, sql)
+
+
+@contextmanager
+def query_budget(budget, name):
+    if settings.QUERY_BUDGET_MODE == 'off':
+        yield None
+        return
+
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
+    check_budget(name, budget, counter)
+
+
+def max_queries(budget):
+    """
+    Бюджет запросов для функции-представления:
+
+        @max_queries(2)
+        @api_view(['GET'])
+        def view(request): ...
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with query_budget(budget, view.__qualname__):
+                return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class QueryBudgetMixin:
+    """
+    Бюджет запросов для представления DRF. query_budget - число на любой запрос
+    или словарь по action для ViewSet (list, retrieve) и по методу для
+    остальных представлений (get, post). Без записи в словаре проверки нет.
+
+    В бюджет входят аутентификация и проверки прав: это все запросы одного ответа.
+    """
+    query_budget = None
+
+    def get_query_budget(self, request):
+        if isinstance(self.query_budget, dict):
+            return self.query_budget.get(getattr(self, 'action', None) or request.method.lower())
+        return self.query_budget
+
+    def dispatch(self, request, *args, **kwargs):
+        # action у ViewSet появляется только в initialize_request, внутри super().dispatch
+        if isinstance(self.query_budget, dict) and hasattr(self, 'action_map'):
+            self.action = self.action_map.get(request.method.lower())
+        budget = self.get_query_budget(request)
+        if budget is None:
+            return super().dispatch(request, *args, **kwargs)
+        with query_budget(budget, type(self).__name__):
+            return super().dispatch(request, *args, **kwargs)
@@ -0,0 +1,48 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # необязательная зависимость, без нее работает json из стандартной библиотеки
+    orjson = None
+
+ENVELOPE_START = b'{"status":"success","data":'
+ENVELOPE_END = b',"errors":{}}'
+
+
+class EnvelopeJSONRenderer(JSONRenderer):
+    """
+    JSON-рендерер со стандартной оберткой {"status", "data", "errors"}.
+
+    Обертка пишется вокруг уже сериализованных данных, без промежуточных
+    словарей. Оборачиваются только ответы, отмеченные StandardResponseMixin
+    (response.envelope); ошибки в том же формате собирает custom_exception_handler.
+    С установленным orjson данные кодируются им, иначе - как в JSONRenderer.
+    """
+    use_orjson = orjson is not None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        response = renderer_context.get('response')
+        envelope = getattr(response, 'envelope', False)
+        if data is None and not envelope:
+            return b''
+
+        if self.use_orjson and self.get_indent(accepted_media_type, renderer_context) is None:
+            payload = self.dumps(data)
+        else:
+            payload = super().render(data, accepted_media_type, renderer_context) or b'null'
+
+        if not envelope:
+            return payload
+        return b''.join((ENVELOPE_START, payload, ENVELOPE_END))
+
+    def dumps(self, data):
+        # Даты и время форматирует энкодер DRF (миллисекунды, Z вместо +00:00), а не сам orjson
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        try:
+            payload = orjson.dumps(data, default=self.encoder_class().default, option=option)
+        except orjson.JSONEncodeError:
+            # Например, целые больше 64 бит: orjson их не кодирует
+            return super().render(data) or b'null'
+        # Как JSONRenderer: вывод остается подмножеством JavaScript
+        return payload.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
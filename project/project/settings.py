@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 
 from celery.schedules import crontab
@@ -111,6 +112,26 @@ DATABASES = {
     },
 }
 
+# Cache
+# Без REDIS_URL используется локальный кэш процесса (подходит только для разработки)
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
+
+# Кэш ответов (CacheResponseMixin) держит поколения моделей и блокировки в кэше:
+# с локальным кэшем процесса сброс и объединение запросов работали бы только
+# внутри одного процесса, поэтому без общего кэша он выключен
+RESPONSE_CACHE = bool(REDIS_URL)
+# Индекс занятости автобусов (booking.availability) узнает об изменениях других
+# процессов через версию в кэше - по той же причине без общего кэша он выключен
+# и пересечения ищет база
+AVAILABILITY_INDEX = bool(REDIS_URL)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -152,12 +173,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'authentication.backends.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
     ),
     'EXCEPTION_HANDLER': 'project.utils.custom_exception_handler',
+    'DEFAULT_RENDERER_CLASSES': (
+        'project.renderers.EnvelopeJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
 }
 
@@ -170,6 +195,9 @@ SIMPLE_JWT = {
     "USER_ID_CLAIM": "user_id",
 }
 
+# Сколько секунд CachedJWTAuthentication хранит пользователя, его роль и id клиента/перевозчика
+AUTH_USER_CACHE_TIMEOUT = 60
+
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
         'Bearer': {
@@ -200,6 +228,19 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 # EMAIL_USE_SSL = True
 # DEFAULT_FROM_EMAIL = FROM_DEFAULT_EMAIL
 
+# Массовые рассылки: ограничение скорости (писем в секунду на соединение, None - без ограничения)
+# и число писем, после которого SMTP-соединение переоткрывается
+MAILING_SEND_RATE = None
+MAILING_MESSAGES_PER_CONNECTION = 100
+MAILING_MAX_RECONNECTS = 3
+# Раздача рассылки: подписчиков в пакете и сколько пакетов одной рассылки может ждать в очереди
+MAILING_BATCH_SIZE = 100
+MAILING_MAX_INFLIGHT_BATCHES = 50
+# Диспетчер рассылок: сколько рассылок забирать за раз и через сколько секунд без признаков
+# жизни рассылка считается потерянной (например, после потери брокера) и ставится заново
+MAILING_DISPATCH_BATCH_SIZE = 500
+MAILING_DISPATCH_LEASE = 10 * 60
+
 ACCOUNT_AUTHENTICATION_METHOD = 'email'
 ACCOUNT_EMAIL_REQUIRED = True
 ACCOUNT_EMAIL_VERIFICATION = 'mandatory'
@@ -244,6 +285,32 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_ACCEPT_CONTENT = ['json']
 
+# Очереди уведомлений: срочные напоминания не должны ждать за массовыми рассылками.
+# Воркер с -Q notifications.critical,notifications.default,notifications.bulk
+# при стратегии priority всегда сначала разбирает более срочную очередь.
+CELERY_TASK_ROUTES = {
+    'notification.tasks.send_booking_notifications': {'queue': 'notifications.critical'},
+    'notification.tasks.send_notification': {'queue': 'notifications.default'},
+    'notification.tasks.send_email_batch': {'queue': 'notifications.default'},
+}
+CELERY_BROKER_TRANSPORT_OPTIONS = {'queue_order_strategy': 'priority'}
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Лимиты отправки, писем в секунду (None - без ограничения). Сумма лимитов default и bulk
+# меньше лимита провайдера, чтобы у срочных писем всегда оставался запас.
+NOTIFICATION_QUEUE_RATE_LIMITS = {
+    'notifications.critical': None,
+    'notifications.default': 15,
+    'notifications.bulk': 20,
+}
+NOTIFICATION_PROVIDER_RATE_LIMIT = 50
+
+# Проверка бюджета запросов представлений (project.querybudget): raise - исключение,
+# log - предупреждение с повторяющимися запросами (staging), off - выключено.
+# В тестах (manage.py test или pytest) по умолчанию raise
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+QUERY_BUDGET_MODE = os.getenv('QUERY_BUDGET_MODE', 'raise' if TESTING else 'log')
+
 
 AWS_ACCESS_KEY_ID = AWS_KEY_ID
 AWS_SECRET_ACCESS_KEY = AWS_SECRET_KEY 
@@ -251,7 +318,15 @@ AWS_STORAGE_BUCKET_NAME = AWS_BUCKET_NAME
 AWS_S3_ENDPOINT_URL = 'https://s3.ru-moscow-1.hc.sbercloud.ru'  
 AWS_S3_CUSTOM_DOMAIN = 'project-files.s3.ru-moscow-1.hc.sbercloud.ru' 
 
-DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+# DEFAULT_FILE_STORAGE удален в Django 5.1, хранилище задается через STORAGES
+STORAGES = {
+    'default': {
+        'BACKEND': 'storages.backends.s3boto3.S3Boto3Storage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
 
 AWS_S3_OBJECT_PARAMETERS = {
     'CacheControl': 'max-age=86400',
@@ -259,3 +334,11 @@ AWS_S3_OBJECT_PARAMETERS = {
 
 MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/'
 
+# Локальная файловая система для тестов и разработки
+if USE_LOCAL_STORAGE or TESTING:
+    STORAGES['default'] = {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    }
+    MEDIA_ROOT = BASE_DIR / 'media'
+    MEDIA_URL = '/media/'
+
@@ -0,0 +1,101 @@
+import uuid
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import skipIf
+
+from django.test import SimpleTestCase, override_settings
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from database.models import Order
+from .pagination import KeysetPagination
+from .querybudget import QueryBudgetExceeded, QueryCounter, check_budget
+from .renderers import ENVELOPE_END, ENVELOPE_START, EnvelopeJSONRenderer, orjson
+
+DATA = {
+    'id': 7,
+    'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+    'created': datetime(2030, 1, 2, 3, 4, 5, 123456, tzinfo=dt_timezone.utc),
+    'local': datetime(2030, 1, 2, 3, 4, 5, 123456, tzinfo=dt_timezone(timedelta(hours=3))),
+    'naive': datetime(2030, 1, 2, 3, 4, 5),
+    'day': date(2030, 1, 2),
+    'start': time(8, 30, 15, 250000),
+    'duration': timedelta(hours=2, minutes=5),
+    'price': Decimal('1500.50'),
+    'rating': 4.5,
+    'nickname': 'Автобус "Ласточка"\u2028',
+    'is_active': True,
+    'photo': None,
+    'orders': [{'time_range': [datetime(2030, 1, 2, 10, tzinfo=dt_timezone.utc), None]}],
+    5: 'integer key',
+}
+
+
+class EnvelopeJSONRendererTests(SimpleTestCase):
+    def render(self, renderer, data, envelope=True):
+        response = Response(data)
+        response.envelope = envelope
+        return renderer.render(data, 'application/json', {'response': response})
+
+    def assertSameAsJSONRenderer(self, renderer):
+        expected = JSONRenderer().render(DATA, 'application/json')
+        self.assertEqual(self.render(renderer, DATA, envelope=False), expected)
+        self.assertEqual(self.render(renderer, DATA), ENVELOPE_START + expected + ENVELOPE_END)
+
+    @skipIf(orjson is None, "orjson is not installed")
+    def test_orjson_output_matches_json_renderer(self):
+        self.assertSameAsJSONRenderer(EnvelopeJSONRenderer())
+
+    def test_json_output_matches_json_renderer(self):
+        renderer = EnvelopeJSONRenderer()
+        renderer.use_orjson = False
+        self.assertSameAsJSONRenderer(renderer)
+
+    def test_big_integers_fall_back_to_json(self):
+        data = {'value': 2 ** 70}
+        self.assertEqual(self.render(EnvelopeJSONRenderer(), data, envelope=False), b'{"value":1180591620717411303424}')
+
+
+class QueryBudgetTests(SimpleTestCase):
+    def counter(self, *statements):
+        counter = QueryCounter()
+        for sql in statements:
+            counter(lambda sql, params, many, context: None, sql, (), False, {})
+        return counter
+
+    def test_counts_and_groups_repeated_statements(self):
+        counter = self.counter('SELECT 1', 'SELECT 2 WHERE id = %s', 'SELECT 2 WHERE id = %s', 'SELECT 2 WHERE id = %s')
+        self.assertEqual(counter.count, 4)
+        self.assertEqual(counter.repeated(), [('SELECT 2 WHERE id = %s', 3)])
+
+    @override_settings(QUERY_BUDGET_MODE='raise')
+    def test_raise_mode(self):
+        check_budget('view', 2, self.counter('SELECT 1', 'SELECT 2'))
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'view: 3 queries, budget 2'):
+            check_budget('view', 2, self.counter('SELECT 1', 'SELECT 2', 'SELECT 3'))
+
+    @override_settings(QUERY_BUDGET_MODE='log')
+    def test_log_mode(self):
+        with self.assertLogs('project.querybudget', 'WARNING') as logs:
+            check_budget('view', 2, self.counter('SELECT 1', 'SELECT 1', 'SELECT 1'))
+        self.assertIn('view: 3 queries, budget 2', logs.output[0])
+        self.assertIn('possible N+1, 3 x SELECT 1', logs.output[1])
+
+
+class KeysetCursorTests(SimpleTestCase):
+    def setUp(self):
+        self.pagination = KeysetPagination()
+        self.pagination.keys = [('create_time', True), ('price', False), ('id', True)]
+
+    def test_round_trip(self):
+        values = [datetime(2030, 1, 2, 3, 4, 5, 123456, tzinfo=dt_timezone.utc), Decimal('1500.50'), 42]
+
+        cursor = self.pagination.encode_cursor(values)
+
+        self.assertEqual(self.pagination.decode_cursor(cursor, Order), values)
+
+    def test_rejects_null_and_malformed_cursor(self):
+        for cursor in (self.pagination.encode_cursor([None, '1.00', 1]), self.pagination.encode_cursor([1]), '%%%'):
+            with self.assertRaises(NotFound):
+                self.pagination.decode_cursor(cursor, Order)
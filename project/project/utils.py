@@ -1,9 +1,11 @@
+from django.conf import settings
 from rest_framework.views import exception_handler
 from rest_framework.response import Response
 
-from django.core.cache import cache
+from project.cache import get_generations, get_or_compute
 
 import hashlib
+from urllib.parse import urlencode
 
 
 def custom_exception_handler(exc, context):
@@ -50,94 +52,87 @@ def api_response(status="success", data=None, errors=None, http_status=200):
 
 class StandardResponseMixin:
     """
-    Миксин для стандартизации всех ответов ViewSet
+    Миксин для стандартизации всех ответов ViewSet.
+
+    Успешный ответ только отмечается, обертку {"status", "data", "errors"}
+    пишет EnvelopeJSONRenderer при сериализации.
     """
 
     def finalize_response(self, request, response, *args, **kwargs):
-        # Если уже есть форматированный ответ, пропускаем обработку
-        if isinstance(response.data, dict) and {"status", "data", "errors"}.issubset(response.data.keys()):
-            return super().finalize_response(request, response, *args, **kwargs)
-
-        # Если это ошибка, просто возвращаем
-        if response.status_code >= 400:
-            return super().finalize_response(request, response, *args, **kwargs)
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if isinstance(response, Response) and response.status_code < 400:
+            response.envelope = True
+        return response
 
-        # Формируем стандартный успешный ответ
-        response.data = {
-            "status": "success",
-            "data": response.data,
-            "errors": {},
-        }
 
-        return super().finalize_response(request, response, *args, **kwargs)
+def get_user_role(user):
+    """
+    Роль пользователя для ключей кэша: имена его групп через запятую.
+    """
+    if not user or not user.is_authenticated:
+        return 'anonymous'
 
-    def dispatch(self, request, *args, **kwargs):
-        """
-        Перехватываем обработку запросов для классов, которые не используют finalize_response.
-        """
-        response = super().dispatch(request, *args, **kwargs)
-        if hasattr(response, "data") and response.status_code < 400:
-            response.data = {
-                "status": "success",
-                "data": response.data,
-                "errors": {},
-            }
-        return response
+    role = getattr(user, '_cached_role', None)
+    if role is None:
+        role = ','.join(sorted(user.groups.values_list('name', flat=True))) or 'user'
+        user._cached_role = role
+    return role
 
 
 class CacheResponseMixin:
     """
-    Миксин для автоматического кэширования ответов методов list и retrieve.
+    Миксин для кэширования ответов методов list и retrieve.
+
+    Ключ строится из пути, нормализованной строки запроса, роли пользователя
+    и поколений моделей из cache_models. Сигналы записи этих моделей
+    увеличивают поколение, и все зависящие от них ответы сбрасываются за O(1).
+
+    Поколения и блокировки работают между процессами только в общем кэше,
+    поэтому без него (RESPONSE_CACHE = False) ответы не кэшируются.
     """
-    cache_timeout = None
+    cache_timeout = 60
+    cache_stale_timeout = 300
+    cache_models = ()
     name_prefix_cache = ''
 
     def _get_cache_key(self, prefix, request):
         """
         Создает уникальный ключ для кэша на основе префикса и параметров запроса.
         """
-        query_string = request.GET.urlencode()
-        hash_key = hashlib.md5(query_string.encode('utf-8')).hexdigest()
+        query_string = urlencode(sorted(request.query_params.lists()), doseq=True)
+        generations = '.'.join(str(generation) for generation in get_generations(self.cache_models))
+        raw_key = f'{request.path}?{query_string}|{get_user_role(request.user)}|{generations}'
+        hash_key = hashlib.md5(raw_key.encode('utf-8')).hexdigest()
         return f"{prefix}_{hash_key}"
 
-    def get(self, request, *args, **kwargs):
-        """
-        Переопределение метода get с поддержкой кэширования.
-        """
-        cache_key = f'{self.name_prefix_cache}_detail_cache_{request.user.id}'
-        cached_response = cache.get(cache_key)
+    def _cached(self, prefix, handler, request, *args, **kwargs):
+        if not settings.RESPONSE_CACHE:
+            return handler(request, *args, **kwargs)
 
-        if cached_response:
-            return Response(cached_response)
+        computed = {}
 
-        response = super().get(request, *args, **kwargs)
-        cache.set(cache_key, response.data, timeout=self.cache_timeout)
-        return response
+        def compute():
+            response = handler(request, *args, **kwargs)
+            computed['response'] = response
+            return response.data, response.status_code == 200
+
+        data = get_or_compute(
+            self._get_cache_key(prefix, request),
+            compute,
+            timeout=self.cache_timeout,
+            stale_timeout=self.cache_stale_timeout,
+            metric_prefix=prefix,
+        )
+        return computed.get('response') or Response(data)
 
     def list(self, request, *args, **kwargs):
         """
         Переопределение метода list с поддержкой кэширования.
         """
-        cache_key = self._get_cache_key(f'{self.name_prefix_cache}_list_cache', request)
-        cached_response = cache.get(cache_key)
-
-        if cached_response:
-            return Response(cached_response)
-
-        response = super().list(request, *args, **kwargs)
-        cache.set(cache_key, response.data, timeout=self.cache_timeout)
-        return response
+        return self._cached(f'{self.name_prefix_cache}_list_cache', super().list, request, *args, **kwargs)
 
     def retrieve(self, request, *args, **kwargs):
         """
         Переопределение метода retrieve с поддержкой кэширования.
         """
-        cache_key = f'{self.name_prefix_cache}_detail_cache_{kwargs["pk"]}'
-        cached_response = cache.get(cache_key)
-
-        if cached_response:
-            return Response(cached_response)
-
-        response = super().retrieve(request, *args, **kwargs)
-        cache.set(cache_key, response.data, timeout=self.cache_timeout)
-        return response
+        return self._cached(f'{self.name_prefix_cache}_detail_cache', super().retrieve, request, *args, **kwargs)